@@ -0,0 +1,199 @@
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+AUDIT_PARTITIONS_AHEAD = int(os.environ.get('AUDIT_PARTITIONS_AHEAD', '3'))
+AUDIT_RETENTION_MONTHS = int(os.environ.get('AUDIT_RETENTION_MONTHS', '12'))
+AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR', 'audit_archive')
+AUDIT_DDL_LOCK_TIMEOUT = os.environ.get('AUDIT_DDL_LOCK_TIMEOUT', '5s')
+
+ACTIONS = (
+    'ADD_REPORT', 'BATCH_ADD_REPORTS', 'BULK_CHANGE_ROLE', 'BULK_CREATE_USERS', 'BULK_DELETE_USERS',
+    'BULK_IMPORT', 'BULK_RESET_PASSWORD', 'CHANGE_ROLE', 'CREATE_USER', 'DELETE_REPORT', 'DELETE_USER',
+    'EDIT_REPORT', 'LOGIN', 'LOGOUT', 'RESET_PASSWORD', 'RUN_SIGNALS',
+)
+
+PARTITION_PREFIX = 'activity_logs_p'
+_PARTITION_RE = re.compile(r'^activity_logs_p(\d{4})(\d{2})$')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month.year:04d}{month.month:02d}'
+
+
+def partition_month(name):
+    match = _PARTITION_RE.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def attached_partitions(cursor):
+    cursor.execute(
+        '''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'activity_logs'::regclass
+        ORDER BY c.relname
+        '''
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_partitions(cursor, start=None, ahead=AUDIT_PARTITIONS_AHEAD):
+    # There is no default partition: it would stop the planner from scanning partitions in
+    # time order. Months are created ahead instead, and writers call this again on a miss.
+    first = month_start(start or datetime.now())
+    last = add_months(month_start(datetime.now()), ahead)
+    existing = set(attached_partitions(cursor))
+    created = []
+    month = first
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF activity_logs FOR VALUES FROM (%s) TO (%s)',
+                (month.isoformat(), add_months(month, 1).isoformat()),
+            )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def maintain_partitions(conn):
+    # Short lock timeout: creating a partition briefly locks the parent and must never queue
+    # behind a long audit query while holding up every writer.
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SET LOCAL lock_timeout = %s', (AUDIT_DDL_LOCK_TIMEOUT,))
+        created = ensure_partitions(cursor)
+        conn.commit()
+        return created
+    except psycopg2.Error:
+        conn.rollback()
+        logger.exception('Could not create upcoming activity_logs partitions')
+        return []
+
+
+def expired_partitions(cursor, retention_months=AUDIT_RETENTION_MONTHS, today=None):
+    cutoff = add_months(month_start(today or datetime.now()), -retention_months)
+    return [name for name in attached_partitions(cursor) if (partition_month(name) or cutoff) < cutoff]
+
+
+def detached_leftovers(cursor):
+    # Partitions a previous run detached but did not finish archiving.
+    cursor.execute(
+        '''
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relname LIKE 'activity_logs_p%'
+          AND c.relnamespace = 'public'::regnamespace
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+        ORDER BY c.relname
+        '''
+    )
+    return [row[0] for row in cursor.fetchall() if partition_month(row[0])]
+
+
+def archive_table(cursor, name, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.csv.gz')
+    temp_path = path + '.partial'
+    with gzip.open(temp_path, 'wb') as target:
+        cursor.copy_expert(
+            f'COPY (SELECT id, user_id, action, details, created_at FROM {name} ORDER BY created_at, id) '
+            'TO STDOUT WITH (FORMAT csv, HEADER)',
+            target,
+        )
+    with open(temp_path, 'rb') as written:
+        os.fsync(written.fileno())
+    os.replace(temp_path, path)
+    # The rename is only durable once the directory entry is; the partition is dropped right after.
+    directory = os.open(archive_dir, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return path
+
+
+def apply_retention(conn, retention_months=AUDIT_RETENTION_MONTHS, archive_dir=AUDIT_ARCHIVE_DIR, log=print):
+    cursor = conn.cursor()
+    archived = []
+    for name in expired_partitions(cursor, retention_months):
+        cursor.execute('SET LOCAL lock_timeout = %s', (AUDIT_DDL_LOCK_TIMEOUT,))
+        cursor.execute(f'ALTER TABLE activity_logs DETACH PARTITION {name}')
+        conn.commit()
+        log(f'Detached {name}')
+    conn.commit()
+
+    # Detach commits first so a failed export leaves the table in place for the next run.
+    for name in detached_leftovers(cursor):
+        path = archive_table(cursor, name, archive_dir)
+        cursor.execute(f'DROP TABLE {name}')
+        conn.commit()
+        archived.append((name, path))
+        log(f'Archived {name} to {path}')
+    return archived
+
+
+def fetch_activity_page(cursor, filters, after=None, before=None, per_page=50):
+    conditions = []
+    params = []
+    if filters.get('user_id') is not None:
+        conditions.append('l.user_id = %s')
+        params.append(filters['user_id'])
+    if filters.get('action'):
+        conditions.append('l.action = %s')
+        params.append(filters['action'])
+    if filters.get('date_from'):
+        conditions.append('l.created_at >= %s')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        conditions.append('l.created_at < %s')
+        params.append(filters['date_to'])
+
+    # The plain created_at bound next to the row comparison is what lets the planner prune partitions.
+    if after:
+        conditions.append('l.created_at <= %s AND (l.created_at, l.id) < (%s, %s)')
+        params.extend([after[0], after[0], after[1]])
+        order = 'DESC'
+    elif before:
+        conditions.append('l.created_at >= %s AND (l.created_at, l.id) > (%s, %s)')
+        params.extend([before[0], before[0], before[1]])
+        order = 'ASC'
+    else:
+        order = 'DESC'
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    cursor.execute(
+        f'''
+        SELECT l.id, l.created_at, COALESCE(u.username, 'System'), l.action, l.details
+        FROM activity_logs l
+        LEFT JOIN users u ON u.id = l.user_id
+        {where}
+        ORDER BY l.created_at {order}, l.id {order}
+        LIMIT %s
+        ''',
+        params + [per_page + 1],
+    )
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    return rows, has_more
+
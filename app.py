@@ -1,13 +1,35 @@
-from flask import Flask, render_template, request, redirect, session, flash, send_file, url_for
+from flask import Flask, Response, g, render_template, request, redirect, session, flash, send_file, url_for, jsonify
+import click
 import psycopg2
 from functools import wraps
 import os
-import csv
-import secrets
-import string
-from io import StringIO, BytesIO
-from datetime import datetime
-from werkzeug.security import check_password_hash, generate_password_hash
+import base64
+import time
+from datetime import datetime, timedelta
+from markupsafe import Markup
+from zipfile import BadZipFile
+
+import activity
+import audit
+import cache
+import db
+import drugs
+import duplicates
+import exports
+import importer
+import loader
+import metrics
+import migrations
+import passwords
+import provisioning
+import ratelimit
+import rollups
+import search
+import signal_detection
+import slowlog
+import submissions
+import trends
+import versions
 
 app = Flask(__name__)
 
@@ -20,106 +42,42 @@ app.config.update(
     SESSION_COOKIE_SECURE=os.environ.get('FLASK_ENV') == 'production',
 )
 app.jinja_env.auto_reload = True
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+metrics.init_app(app)
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
 ALLOWED_ROLES = {'admin', 'user'}
+REPORT_PAGE_SIZE = int(os.environ.get('REPORT_PAGE_SIZE', '50'))
+REPORT_PAGE_SIZE_MAX = 500
+REPORT_EXACT_TOTAL_BELOW = int(os.environ.get('REPORT_EXACT_TOTAL_BELOW', '10000'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', '10'))
+# Read-only views whose queries may be served by a replica (see DATABASE_READ_URLS).
+REPLICA_ENDPOINTS = {
+    'admin_dashboard',
+    'user_dashboard',
+    'api_dashboard_metrics',
+    'api_dashboard_charts',
+    'api_reports',
+    'audit_log',
+    'export_adr_csv',
+    'export_adr_xlsx',
+    'export_adr_parquet',
+}
+
+dashboard_cache = cache.VersionedCache(
+    ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', '30')),
+    max_entries=int(os.environ.get('DASHBOARD_CACHE_MAX_ENTRIES', '1024')),
+)
+fragment_cache = cache.FragmentCache(
+    max_bytes=int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+)
 
 
 def get_db_connection():
-    if not DATABASE_URL:
-        raise RuntimeError('DATABASE_URL is not set')
-    return psycopg2.connect(DATABASE_URL)
-
-
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(80) UNIQUE NOT NULL,
-            password VARCHAR(255) NOT NULL,
-            role VARCHAR(20) NOT NULL DEFAULT 'user'
-        )
-        '''
-    )
-
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS adr (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            name VARCHAR(120) NOT NULL,
-            age INTEGER NOT NULL,
-            drug VARCHAR(120) NOT NULL,
-            reaction TEXT NOT NULL,
-            severity VARCHAR(50) NOT NULL,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-        )
-        '''
-    )
-
-    cursor.execute('ALTER TABLE adr ADD COLUMN IF NOT EXISTS user_id INTEGER')
-    cursor.execute(
-        '''
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1 FROM pg_constraint
-                WHERE conname = 'adr_user_id_fkey'
-            ) THEN
-                ALTER TABLE adr
-                ADD CONSTRAINT adr_user_id_fkey
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
-            END IF;
-        END $$;
-        '''
-    )
+    return db.connection()
 
-    cursor.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS activity_logs (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
-            action VARCHAR(80) NOT NULL,
-            details TEXT,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-        )
-        '''
-    )
-
-    cursor.execute("UPDATE users SET role = 'user' WHERE role = 'viewer'")
-
-    admin_user = os.environ.get('ADMIN_USERNAME', 'admin')
-    admin_password = os.environ.get('ADMIN_PASSWORD', 'admin1234')
-    cursor.execute(
-        '''
-        INSERT INTO users (username, password, role)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (username) DO NOTHING
-        ''',
-        (admin_user, generate_password_hash(admin_password), 'admin'),
-    )
 
-    conn.commit()
-    conn.close()
-
-
-def log_activity(action, details=''):
-    user_id = session.get('user_id')
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)',
-            (user_id, action, details),
-        )
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
+def log_activity(action, details='', conn=None, user_id=None):
+    audit.writer.log(user_id or session.get('user_id'), action, details, conn=conn)
 
 
 def login_required(f):
@@ -171,11 +129,10 @@ def ensure_session_identity():
         return True
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT username, role FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT username, role FROM users WHERE id = %s', (user_id,))
+            user = cursor.fetchone()
 
         if not user:
             session.clear()
@@ -193,19 +150,6 @@ def dashboard_redirect_for_role():
     return redirect(url_for('admin_dashboard' if session.get('role') == 'admin' else 'user_dashboard'))
 
 
-def generate_random_password(length=12):
-    alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
-
-
-def generate_unique_username(cursor, base='user'):
-    while True:
-        candidate = f"{base}_{secrets.randbelow(900000) + 100000}"
-        cursor.execute('SELECT 1 FROM users WHERE username = %s', (candidate,))
-        if not cursor.fetchone():
-            return candidate
-
-
 def get_dashboard_metrics(cursor, user_id=None):
     filter_sql = ''
     params = []
@@ -213,27 +157,19 @@ def get_dashboard_metrics(cursor, user_id=None):
         filter_sql = ' WHERE user_id = %s'
         params = [user_id]
 
-    cursor.execute(f'SELECT COUNT(*) FROM adr{filter_sql}', tuple(params))
-    total_reports = cursor.fetchone()[0]
-
-    date_filter = f"{filter_sql} {'AND' if filter_sql else 'WHERE'} DATE(created_at) = CURRENT_DATE"
-    cursor.execute(f'SELECT COUNT(*) FROM adr{date_filter}', tuple(params))
-    todays_reports = cursor.fetchone()[0]
-
-    severe_filter = f"{filter_sql} {'AND' if filter_sql else 'WHERE'} LOWER(severity) = 'severe'"
-    cursor.execute(f'SELECT COUNT(*) FROM adr{severe_filter}', tuple(params))
-    severe_cases = cursor.fetchone()[0]
-
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-
     cursor.execute(
-        f"SELECT COUNT(DISTINCT LOWER(TRIM(drug))) FROM adr{filter_sql} "
-        "AND TRIM(COALESCE(drug, '')) <> ''" if filter_sql else
-        "SELECT COUNT(DISTINCT LOWER(TRIM(drug))) FROM adr WHERE TRIM(COALESCE(drug, '')) <> ''",
+        f'''
+        SELECT
+            COALESCE(SUM(report_count), 0),
+            COALESCE(SUM(report_count) FILTER (WHERE day = CURRENT_DATE), 0),
+            COALESCE(SUM(report_count) FILTER (WHERE LOWER(severity) = 'severe'), 0),
+            COUNT(DISTINCT drug_id) FILTER (WHERE drug_id <> 0 AND report_count > 0),
+            (SELECT COUNT(*) FROM users)
+        FROM adr_daily_rollup{filter_sql}
+        ''',
         tuple(params),
     )
-    total_drugs = cursor.fetchone()[0]
+    total_reports, todays_reports, severe_cases, total_drugs, total_users = cursor.fetchone()
 
     return {
         'total_reports': total_reports,
@@ -248,33 +184,31 @@ def get_chart_data(cursor, user_id=None):
     params = []
     where = ''
     if user_id:
-        where = 'WHERE user_id = %s'
+        where = 'WHERE r.user_id = %s'
         params = [user_id]
 
     cursor.execute(
         f'''
-        SELECT COALESCE(severity, 'Unknown') AS label, COUNT(*) AS count
-        FROM adr
+        SELECT
+            GROUPING(r.severity) = 0 AS by_severity,
+            CASE WHEN GROUPING(r.severity) = 0 THEN r.severity ELSE COALESCE(MIN(d.name), 'Unknown') END AS label,
+            SUM(r.report_count) AS count
+        FROM adr_daily_rollup r
+        LEFT JOIN drugs d ON d.id = r.drug_id
         {where}
-        GROUP BY label
-        ORDER BY count DESC
+        GROUP BY GROUPING SETS ((r.severity), (r.drug_id))
+        HAVING SUM(r.report_count) > 0
+        ORDER BY count DESC, label ASC
         ''',
         tuple(params),
     )
-    severity_data = cursor.fetchall()
-
-    cursor.execute(
-        f'''
-        SELECT COALESCE(drug, 'Unknown') AS label, COUNT(*) AS count
-        FROM adr
-        {where}
-        GROUP BY label
-        ORDER BY count DESC
-        LIMIT 10
-        ''',
-        tuple(params),
-    )
-    drug_data = cursor.fetchall()
+    severity_data = []
+    drug_data = []
+    for by_severity, label, count in cursor.fetchall():
+        if by_severity:
+            severity_data.append((label, count))
+        elif len(drug_data) < 10:
+            drug_data.append((label, count))
 
     return {
         'severity_labels': [row[0] for row in severity_data],
@@ -284,6 +218,126 @@ def get_chart_data(cursor, user_id=None):
     }
 
 
+def dashboard_scope(user_id=None):
+    return f'user:{user_id}' if user_id else 'global'
+
+
+EMPTY_DASHBOARD_METRICS = {'total_reports': 0, 'todays_reports': 0, 'severe_cases': 0, 'total_users': 0, 'total_drugs': 0}
+EMPTY_CHART_DATA = {'severity_labels': [], 'severity_values': [], 'drug_labels': [], 'drug_values': []}
+
+
+def cached_dashboard_task(scope, key, watermark, compute, user_id=None):
+    def run(cursor):
+        # Re-read on the connection that computes the value: a replica behind the one the watermark
+        # came from must not file older numbers under the newer key.
+        found, _ = versions.fetch_versions(cursor, data_version_scopes(user_id))
+        value = compute(cursor, user_id=user_id)
+        if versions.watermark(found) == watermark:
+            dashboard_cache.fill(scope, f'{key}@{watermark}', lambda: value)
+        return value
+
+    return run
+
+
+def fetch_user_list(cursor):
+    cursor.execute('SELECT id, username, role FROM users ORDER BY id ASC')
+    return cursor.fetchall()
+
+
+def load_dashboard(filters, page_args, watermark, user_id=None, with_page=True, with_users=False):
+    scope = dashboard_scope(user_id)
+    results = {}
+    tasks = {}
+    for key, compute in (('metrics', get_dashboard_metrics), ('chart_data', get_chart_data)):
+        # Keyed by watermark like the API values, so other workers' writes are never hidden.
+        found, value = dashboard_cache.get(scope, f'{key}@{watermark}') if watermark else (False, None)
+        if found:
+            results[key] = value
+        elif watermark:
+            tasks[key] = cached_dashboard_task(scope, key, watermark, compute, user_id)
+        else:
+            tasks[key] = lambda cursor, compute=compute: compute(cursor, user_id=user_id)
+
+    if with_page:
+        tasks['page'] = lambda cursor: fetch_report_page(cursor, filters, page_args, user_id=user_id)
+        tasks['total'] = lambda cursor: fetch_report_total(cursor, filters, user_id=user_id)
+    if with_users:
+        tasks['users'] = fetch_user_list
+
+    loaded, errors = loader.dashboard.run(tasks)
+    results.update(loaded)
+    return results, errors
+
+
+def dashboard_context(results, page_args):
+    page = results.get('page') or empty_report_page(page_args)
+    if 'page' in results and 'total' in results:
+        page['total'], page['total_is_estimate'] = results['total']
+
+    chart_data = results.get('chart_data', EMPTY_CHART_DATA)
+    if 'chart_data' in results:
+        severity_options = sorted(label for label in chart_data['severity_labels'] if label.strip())
+    else:
+        severity_options = ['Mild', 'Moderate', 'Severe']
+
+    return {
+        'metrics': results.get('metrics', EMPTY_DASHBOARD_METRICS),
+        'adr_list': page['rows'],
+        'page': page,
+        'severity_options': severity_options,
+        'severity_labels': chart_data['severity_labels'],
+        'severity_values': chart_data['severity_values'],
+        'drug_labels': chart_data['drug_labels'],
+        'drug_values': chart_data['drug_values'],
+    }
+
+
+def flash_dashboard_errors(label, results, errors):
+    if not errors:
+        return
+    if results:
+        flash(f'Some {label} dashboard panels could not be loaded.', 'warning')
+    else:
+        flash(f'Unable to load {label} dashboard.', 'danger')
+
+
+def invalidate_dashboard_cache(user_id=None):
+    dashboard_cache.invalidate(dashboard_scope())
+    fragment_cache.invalidate(dashboard_scope())
+    if user_id:
+        dashboard_cache.invalidate(dashboard_scope(user_id))
+        fragment_cache.invalidate(dashboard_scope(user_id))
+
+
+def dashboard_watermark(user_id=None):
+    if not fragment_cache.enabled() and dashboard_cache.ttl <= 0:
+        return None
+    try:
+        with get_db_connection() as conn:
+            found, _ = versions.fetch_versions(conn.cursor(), data_version_scopes(user_id))
+    except psycopg2.Error:
+        return None
+    return versions.watermark(found)
+
+
+def fragment_key(name, watermark, *parts):
+    # No watermark means no proof the data is unchanged, so nothing is cached.
+    if watermark is None:
+        return None
+    return (name, watermark) + parts
+
+
+def report_fragment_key(name, watermark, filters, page_args):
+    return fragment_key(name, watermark, tuple(sorted(filters.items())), tuple(sorted(page_args.items())))
+
+
+def render_fragment(scope, key, template, cacheable=True, **context):
+    html = Markup(render_template(template, **context))
+    if cacheable:
+        fragment_cache.put(scope, key, html)
+    return html
+
+
 def get_report_filters():
     return {
         'search': request.args.get('search', '').strip(),
@@ -291,16 +345,34 @@ def get_report_filters():
         'severity': request.args.get('severity', '').strip(),
         'date_from': request.args.get('date_from', '').strip(),
         'date_to': request.args.get('date_to', '').strip(),
+        'sort': request.args.get('sort', '').strip(),
     }
 
 
-def fetch_reports_with_filters(cursor, filters, user_id=None):
-    query = '''
-        SELECT a.id, a.name, a.age, a.drug, a.reaction, a.severity, a.created_at, COALESCE(u.username, 'Unknown')
+def parse_filter_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+REPORT_SELECT = '''
+        SELECT a.id, a.name, a.age, a.drug, a.reaction, a.severity, a.created_at, COALESCE(u.username, 'Unknown'),
+               a.duplicate_of
+        FROM adr a
+        LEFT JOIN users u ON u.id = a.user_id
+'''
+
+REPORT_SELECT_RANKED = '''
+        SELECT a.id, a.name, a.age, a.drug, a.reaction, a.severity, a.created_at, COALESCE(u.username, 'Unknown'),
+               a.duplicate_of, {rank} AS rank
         FROM adr a
         LEFT JOIN users u ON u.id = a.user_id
-        WHERE 1=1
-    '''
+'''
+
+
+def build_report_conditions(filters, user_id=None, caps=None):
+    query = ' WHERE 1=1'
     params = []
 
     if user_id:
@@ -308,30 +380,172 @@ def fetch_reports_with_filters(cursor, filters, user_id=None):
         params.append(user_id)
 
     if filters['search']:
-        query += ' AND (a.name ILIKE %s OR a.drug ILIKE %s OR a.reaction ILIKE %s OR a.severity ILIKE %s)'
-        params.extend([f"%{filters['search']}%"] * 4)
+        condition, condition_params = search.search_condition(filters['search'], caps or search.capabilities())
+        query += f' AND {condition}'
+        params.extend(condition_params)
 
     if filters['drug']:
-        query += ' AND a.drug ILIKE %s'
-        params.append(f"%{filters['drug']}%")
+        query += ' AND a.drug_id = ANY(%s)'
+        params.append(drugs.dictionary.matching_ids(filters['drug']))
 
     if filters['severity']:
         query += ' AND a.severity = %s'
         params.append(filters['severity'])
 
-    if filters['date_from']:
-        query += ' AND DATE(a.created_at) >= %s'
-        params.append(filters['date_from'])
+    date_from = parse_filter_date(filters['date_from'])
+    if date_from:
+        query += ' AND a.created_at >= %s'
+        params.append(date_from)
+
+    date_to = parse_filter_date(filters['date_to'])
+    if date_to:
+        query += ' AND a.created_at < %s'
+        params.append(date_to + timedelta(days=1))
+
+    return query, params
 
-    if filters['date_to']:
-        query += ' AND DATE(a.created_at) <= %s'
-        params.append(filters['date_to'])
 
-    query += ' ORDER BY a.created_at DESC, a.id DESC'
+def build_report_query(filters, user_id=None):
+    where, params = build_report_conditions(filters, user_id)
+    return REPORT_SELECT + where + ' ORDER BY a.created_at DESC, a.id DESC', params
+
+
+def fetch_reports_with_filters(cursor, filters, user_id=None):
+    query, params = build_report_query(filters, user_id)
     cursor.execute(query, tuple(params))
     return cursor.fetchall()
 
 
+def encode_keyset_cursor(created_at, row_id, rank=None):
+    parts = [created_at.isoformat(), str(row_id)]
+    if rank is not None:
+        parts.append(repr(rank))
+    raw = '|'.join(parts).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def encode_page_cursor(row, ranked=False):
+    return encode_keyset_cursor(row[6], row[0], row[9] if ranked else None)
+
+
+def decode_page_cursor(token, ranked=False):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        parts = raw.split('|')
+        if len(parts) != (3 if ranked else 2):
+            return None
+        key = (datetime.fromisoformat(parts[0]), int(parts[1]))
+        return (float(parts[2]),) + key if ranked else key
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_page_args():
+    try:
+        per_page = int(request.args.get('per_page', REPORT_PAGE_SIZE))
+    except ValueError:
+        per_page = REPORT_PAGE_SIZE
+    return {
+        'after': request.args.get('after', '').strip(),
+        'before': request.args.get('before', '').strip(),
+        'per_page': min(max(per_page, 1), REPORT_PAGE_SIZE_MAX),
+    }
+
+
+def estimate_report_total(cursor, where, params):
+    cursor.execute(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM adr a{where}', tuple(params))
+    estimate = int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+    if estimate > REPORT_EXACT_TOTAL_BELOW:
+        return estimate, True
+
+    cursor.execute(f'SELECT COUNT(*) FROM adr a{where}', tuple(params))
+    return cursor.fetchone()[0], False
+
+
+def empty_report_page(page_args):
+    return {
+        'rows': [],
+        'per_page': page_args['per_page'],
+        'next_cursor': None,
+        'prev_cursor': None,
+        'total': None,
+        'total_is_estimate': False,
+    }
+
+
+def fetch_report_total(cursor, filters, user_id=None):
+    where, params = build_report_conditions(filters, user_id, search.capabilities(cursor))
+    return estimate_report_total(cursor, where, params)
+
+
+def fetch_report_page(cursor, filters, page_args, user_id=None, with_total=False):
+    caps = search.capabilities(cursor)
+    where, params = build_report_conditions(filters, user_id, caps)
+    per_page = page_args['per_page']
+
+    rank_sql, rank_params = None, []
+    if filters['search'] and filters['sort'] == 'relevance':
+        rank_sql, rank_params = search.rank_expression(filters['search'], caps)
+    ranked = rank_sql is not None
+
+    after = decode_page_cursor(page_args['after'], ranked)
+    before = None if after else decode_page_cursor(page_args['before'], ranked)
+
+    total = None
+    total_is_estimate = False
+    if with_total:
+        total, total_is_estimate = estimate_report_total(cursor, where, params)
+
+    if ranked:
+        query = REPORT_SELECT_RANKED.format(rank=rank_sql) + where
+        page_params = rank_params + params
+        key_sql = f'({rank_sql}, a.created_at, a.id)'
+        key_params = rank_params
+        order_sql = 'rank {0}, a.created_at {0}, a.id {0}'
+    else:
+        query = REPORT_SELECT + where
+        page_params = list(params)
+        key_sql = '(a.created_at, a.id)'
+        key_params = []
+        order_sql = 'a.created_at {0}, a.id {0}'
+
+    if after:
+        query += f' AND {key_sql} < %s ORDER BY ' + order_sql.format('DESC')
+        page_params.extend(key_params + [after])
+    elif before:
+        query += f' AND {key_sql} > %s ORDER BY ' + order_sql.format('ASC')
+        page_params.extend(key_params + [before])
+    else:
+        query += ' ORDER BY ' + order_sql.format('DESC')
+    query += ' LIMIT %s'
+    page_params.append(per_page + 1)
+
+    cursor.execute(query, tuple(page_params))
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if before or has_more:
+            next_cursor = encode_page_cursor(rows[-1], ranked)
+        if after or (before and has_more):
+            prev_cursor = encode_page_cursor(rows[0], ranked)
+
+    return {
+        'rows': rows,
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'total': total,
+        'total_is_estimate': total_is_estimate,
+    }
+
+
 def can_access_report(cursor, adr_id, user_id, role):
     if role == 'admin':
         cursor.execute('SELECT 1 FROM adr WHERE id = %s', (adr_id,))
@@ -340,11 +554,179 @@ def can_access_report(cursor, adr_id, user_id, role):
     return cursor.fetchone() is not None
 
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        rows = rollups.rebuild_rollups(cursor)
+        conn.commit()
+    dashboard_cache.invalidate()
+    click.echo(f'Rebuilt adr_daily_rollup with {rows} rows.')
+
+
+@app.cli.command('close-trends')
+@click.option('--rebuild', is_flag=True, help='Recount every day instead of only new and dirty ones.')
+def close_trends_command(rebuild):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        result = trends.rebuild(cursor) if rebuild else trends.close_out(cursor)
+        conn.commit()
+    if result is None:
+        click.echo('Another close-out is running; nothing done.')
+        return
+    click.echo(f"Closed {result['days']} day(s) into {result['buckets']} bucket(s); closed through {result['closed_through']}.")
+
+
+@app.cli.command('audit-retention')
+@click.option('--months', type=int, default=activity.AUDIT_RETENTION_MONTHS, show_default=True,
+              help='Keep this many whole months of activity logs online.')
+@click.option('--archive-dir', default=activity.AUDIT_ARCHIVE_DIR, show_default=True,
+              help='Directory that receives the gzipped CSV export of each expired month.')
+def audit_retention_command(months, archive_dir):
+    with get_db_connection() as conn:
+        created = activity.maintain_partitions(conn)
+        archived = activity.apply_retention(conn, months, archive_dir, log=click.echo)
+    click.echo(f'Created {len(created)} partition(s); archived and dropped {len(archived)} month(s).')
+
+
+@app.cli.command('create-users')
+@click.option('--count', type=int, default=0, help='Number of users with generated usernames.')
+@click.option('--prefix', default='user', show_default=True, help='Prefix for generated usernames.')
+@click.option('--from-file', 'usernames_file', type=click.File('r'), help='File with one username per line.')
+@click.option('--role', type=click.Choice(sorted(ALLOWED_ROLES)), default='user', show_default=True)
+@click.option('--output', type=click.File('w'), default='-', help='Where to write the credentials CSV.')
+def create_users_command(count, prefix, usernames_file, role, output):
+    try:
+        usernames = provisioning.clean_usernames(usernames_file or [])
+        with get_db_connection() as conn:
+            accounts = provisioning.provision_users(conn, usernames, count, role=role, base=prefix)
+    except provisioning.ProvisioningError as exc:
+        raise click.ClickException(str(exc))
+    invalidate_dashboard_cache()
+    output.write(provisioning.credentials_csv(accounts))
+    click.echo(f'Created {len(accounts)} user(s) with role {role}.', err=True)
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    with get_db_connection() as conn:
+        applied = migrations.run_migrations(conn, log=click.echo)
+    click.echo(f'Applied {len(applied)} migration(s); schema is at version {migrations.LATEST_VERSION}.')
+
+
+@app.cli.command('import-reports')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--username', required=True, help='Account the imported reports are filed under.')
+def import_reports_command(path, username):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE username = %s', (username,))
+        user = cursor.fetchone()
+        if not user:
+            raise click.ClickException(f'Unknown user {username}')
+
+        def audit_import(conn, summary):
+            audit.writer.log(
+                user[0],
+                'BULK_IMPORT',
+                f"Imported {summary['imported']} ADR reports from {os.path.basename(path)} "
+                f"({summary['rejected']} rejected)",
+                conn=conn,
+            )
+
+        with open(path, 'rb') as stream:
+            try:
+                summary = importer.import_reports(conn, stream, path, user[0], before_commit=audit_import)
+            except importer.ImportFormatError as exc:
+                raise click.ClickException(str(exc))
+
+    for error in summary['errors']:
+        click.echo(f"row {error['row']}: {' '.join(error['errors'])}", err=True)
+    click.echo(f"Imported {summary['imported']} of {summary['rows']} rows ({summary['rejected']} rejected).")
+
+
+@app.cli.command('detect-signals')
+@click.option('--full', is_flag=True, help='Recount every report instead of only those added since the last run.')
+def detect_signals_command(full):
+    with get_db_connection() as conn:
+        summary = signal_detection.run_signal_detection(conn, full=full)
+    click.echo(
+        f"{summary['mode']}: {summary['touched_pairs']} pair(s) updated, "
+        f"{summary['flagged']} of {summary['pairs']} pairs flagged across {summary['reports']} reports."
+    )
+
+
+@app.cli.command('backfill-drugs')
+@click.option('--batch-size', default=drugs.DRUG_BACKFILL_BATCH, show_default=True, help='Report ids per transaction.')
+def backfill_drugs_command(batch_size):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM adr')
+        max_id = cursor.fetchone()[0]
+        conn.commit()
+        updated = 0
+        for after_id in range(0, max_id, batch_size):
+            updated += drugs.backfill_drug_ids(cursor, after_id, after_id + batch_size)
+            conn.commit()
+    dashboard_cache.invalidate()
+    click.echo(f'Linked {updated} ADR report(s) to the drug dictionary.')
+
+
+@app.cli.command('drug-synonym')
+@click.argument('synonym')
+@click.argument('canonical')
+def drug_synonym_command(synonym, canonical):
+    with get_db_connection() as conn:
+        try:
+            drug_id, moved = drugs.add_synonym(conn.cursor(), synonym, canonical)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        conn.commit()
+    dashboard_cache.invalidate()
+    click.echo(f'"{synonym}" now maps to drug #{drug_id} ({canonical}); {moved} report(s) re-linked.')
+
+
 @app.before_request
 def startup():
-    if not getattr(app, '_db_initialized', False):
-        init_db()
-        app._db_initialized = True
+    if getattr(app, '_schema_checked', False):
+        return
+    try:
+        with get_db_connection() as conn:
+            version = migrations.current_version(conn.cursor())
+    except psycopg2.Error:
+        app.logger.exception('Unable to check database schema version')
+        return
+    if version < migrations.LATEST_VERSION:
+        app.logger.warning(
+            'Database schema is at version %s but the app expects %s; run "flask migrate".',
+            version,
+            migrations.LATEST_VERSION,
+        )
+    app._schema_checked = True
+
+
+@app.before_request
+def route_reads_to_replica():
+    if not db.replicas_configured() or request.endpoint not in REPLICA_ENDPOINTS:
+        return
+    # A client that just wrote keeps reading from the primary until replicas have caught up.
+    if session.get('db_primary_until', 0) > time.time():
+        return
+    g.db_replica_token = db.prefer_replica()
+
+
+@app.after_request
+def pin_reads_after_write(response):
+    if db.replicas_configured() and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 500:
+        session['db_primary_until'] = time.time() + READ_YOUR_WRITES_SECONDS
+    return response
+
+
+@app.teardown_request
+def release_replica_preference(exc):
+    token = g.pop('db_replica_token', None)
+    if token is not None:
+        db.reset_replica_preference(token)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -359,39 +741,53 @@ def login():
             flash('Username and password are required.', 'warning')
             return render_template('login.html')
 
+        address = request.remote_addr or 'unknown'
+        retry_after = ratelimit.login_failures.retry_after(username, address)
+        if retry_after:
+            flash(f'Too many failed sign-in attempts. Try again in {int(retry_after // 60) + 1} minute(s).', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
+
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT id, username, password, role FROM users WHERE username = %s',
-                (username,),
-            )
-            user = cursor.fetchone()
+            started = time.perf_counter()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT id, username, password, role FROM users WHERE username = %s',
+                    (username,),
+                )
+                user = cursor.fetchone()
 
+            # The connection goes back to the pool before hashing; the check runs in the hasher's processes.
             if user:
-                stored_password = user[2]
-                valid = check_password_hash(stored_password, password)
-
-                if not valid and stored_password == password:
-                    valid = True
-                    cursor.execute(
-                        'UPDATE users SET password = %s WHERE id = %s',
-                        (generate_password_hash(password), user[0]),
-                    )
-                    conn.commit()
-
-                if valid:
-                    session.clear()
-                    session['user_id'] = user[0]
-                    session['username'] = user[1]
-                    session['role'] = user[3]
-                    conn.close()
-                    log_activity('LOGIN', f'User {user[1]} logged in')
-                    flash('Login successful.', 'success')
-                    return dashboard_redirect_for_role()
-
-            conn.close()
+                valid, new_hash = passwords.hasher.verify(user[2], password)
+            else:
+                valid, new_hash = passwords.hasher.reject_unknown(started), None
+
+            if valid:
+                # Recorded before the session exists: a failed strict-mode audit write leaves the user signed out.
+                if new_hash:
+                    with get_db_connection() as conn:
+                        conn.cursor().execute(
+                            'UPDATE users SET password = %s WHERE id = %s AND password = %s',
+                            (new_hash, user[0], user[2]),
+                        )
+                        log_activity('LOGIN', f'User {user[1]} logged in', conn=conn, user_id=user[0])
+                        conn.commit()
+                else:
+                    log_activity('LOGIN', f'User {user[1]} logged in', user_id=user[0])
+                ratelimit.login_failures.reset(username, address)
+                session.clear()
+                session['user_id'] = user[0]
+                session['username'] = user[1]
+                session['role'] = user[3]
+                flash('Login successful.', 'success')
+                return dashboard_redirect_for_role()
+
+            ratelimit.login_failures.record_failure(username, address)
             flash('Invalid username or password.', 'danger')
+        except passwords.HasherBusy:
+            flash('Sign-in is busy right now. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
         except psycopg2.Error:
             flash('Unable to authenticate at this time.', 'danger')
 
@@ -402,7 +798,11 @@ def login():
 @login_required
 def logout():
     username = session.get('username', 'Unknown')
-    log_activity('LOGOUT', f'User {username} logged out')
+    try:
+        log_activity('LOGOUT', f'User {username} logged out')
+    except psycopg2.Error:
+        # Only reachable in strict mode; ending the session still beats keeping it open.
+        app.logger.exception('Could not record logout for %s', username)
     session.clear()
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
@@ -425,98 +825,175 @@ def dashboard():
 @admin_required
 def admin_dashboard():
     filters = get_report_filters()
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        metrics = get_dashboard_metrics(cursor)
-        chart_data = get_chart_data(cursor)
-        adr_list = fetch_reports_with_filters(cursor, filters)
-
-        cursor.execute('SELECT id, username, role FROM users ORDER BY id ASC')
-        users = cursor.fetchall()
-
-        cursor.execute(
-            "SELECT DISTINCT severity FROM adr WHERE TRIM(COALESCE(severity, '')) <> '' ORDER BY severity ASC"
+    page_args = get_page_args()
+    scope = dashboard_scope()
+    watermark = dashboard_watermark()
+    # The user table marks the viewing admin's own row, so it is cached per viewer.
+    users_key = fragment_key('admin_users', watermark, session.get('user_id'))
+    reports_key = report_fragment_key('admin_reports', watermark, filters, page_args)
+    users_table = fragment_cache.get(scope, users_key)
+    reports_table = fragment_cache.get(scope, reports_key)
+
+    results, errors = load_dashboard(
+        filters, page_args, watermark, with_page=reports_table is None, with_users=users_table is None,
+    )
+    flash_dashboard_errors('admin', results, errors)
+    context = dashboard_context(results, page_args)
+    if users_table is None:
+        users_table = render_fragment(
+            scope, users_key, 'admin_users_table.html', cacheable='users' in results, users=results.get('users', []),
         )
-        severity_options = [row[0] for row in cursor.fetchall()]
-
-        conn.close()
-
-        return render_template(
-            'admin_dashboard.html',
-            metrics=metrics,
-            users=users,
-            adr_list=adr_list,
-            filters=filters,
-            severity_options=severity_options,
-            severity_labels=chart_data['severity_labels'],
-            severity_values=chart_data['severity_values'],
-            drug_labels=chart_data['drug_labels'],
-            drug_values=chart_data['drug_values'],
-        )
-    except psycopg2.Error:
-        flash('Unable to load admin dashboard.', 'danger')
-        return render_template(
-            'admin_dashboard.html',
-            metrics={'total_reports': 0, 'todays_reports': 0, 'severe_cases': 0, 'total_users': 0, 'total_drugs': 0},
-            users=[],
-            adr_list=[],
-            filters=filters,
-            severity_options=['Mild', 'Moderate', 'Severe'],
-            severity_labels=[],
-            severity_values=[],
-            drug_labels=[],
-            drug_values=[],
+    if reports_table is None:
+        reports_table = render_fragment(
+            scope, reports_key, 'admin_reports_table.html',
+            cacheable='page' in results and 'total' in results, filters=filters, **context,
         )
+    return render_template(
+        'admin_dashboard.html',
+        users_table=users_table,
+        reports_table=reports_table,
+        filters=filters,
+        **context,
+    )
 
 
 @app.route('/user')
 @user_required
 def user_dashboard():
     filters = get_report_filters()
+    page_args = get_page_args()
     user_id = session.get('user_id')
+    scope = dashboard_scope(user_id)
+    watermark = dashboard_watermark(user_id)
+    reports_key = report_fragment_key('user_reports', watermark, filters, page_args)
+    reports_table = fragment_cache.get(scope, reports_key)
+
+    results, errors = load_dashboard(filters, page_args, watermark, user_id=user_id, with_page=reports_table is None)
+    flash_dashboard_errors('user', results, errors)
+    context = dashboard_context(results, page_args)
+    if reports_table is None:
+        reports_table = render_fragment(
+            scope, reports_key, 'user_reports_table.html',
+            cacheable='page' in results and 'total' in results, filters=filters, **context,
+        )
+    return render_template(
+        'user_dashboard.html',
+        reports_table=reports_table,
+        filters=filters,
+        **context,
+    )
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        metrics = get_dashboard_metrics(cursor, user_id=user_id)
-        chart_data = get_chart_data(cursor, user_id=user_id)
-        adr_list = fetch_reports_with_filters(cursor, filters, user_id=user_id)
+def api_user_scope():
+    return None if session.get('role') == 'admin' else session.get('user_id')
 
-        cursor.execute(
-            "SELECT DISTINCT severity FROM adr WHERE user_id = %s AND TRIM(COALESCE(severity, '')) <> '' ORDER BY severity ASC",
-            (user_id,),
-        )
-        severity_options = [row[0] for row in cursor.fetchall()]
-
-        conn.close()
-
-        return render_template(
-            'user_dashboard.html',
-            metrics=metrics,
-            adr_list=adr_list,
-            filters=filters,
-            severity_options=severity_options,
-            severity_labels=chart_data['severity_labels'],
-            severity_values=chart_data['severity_values'],
-            drug_labels=chart_data['drug_labels'],
-            drug_values=chart_data['drug_values'],
-        )
+
+def data_version_scopes(user_id=None):
+    return [versions.user_scope(user_id) if user_id else versions.REPORTS_SCOPE, versions.USERS_SCOPE]
+
+
+def request_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+
+def conditional_json(user_id, build):
+    try:
+        with get_db_connection() as conn:
+            found, last_modified = versions.fetch_versions(conn.cursor(), data_version_scopes(user_id))
     except psycopg2.Error:
-        flash('Unable to load user dashboard.', 'danger')
-        return render_template(
-            'user_dashboard.html',
-            metrics={'total_reports': 0, 'todays_reports': 0, 'severe_cases': 0, 'total_users': 0, 'total_drugs': 0},
-            adr_list=[],
-            filters=filters,
-            severity_options=['Mild', 'Moderate', 'Severe'],
-            severity_labels=[],
-            severity_values=[],
-            drug_labels=[],
-            drug_values=[],
-        )
+        return jsonify({'error': 'Unable to load dashboard data.'}), 503
+
+    # Metrics count "today", so the tag also turns over at midnight without any write.
+    etag = versions.make_etag(
+        found, request.path, sorted(request.args.items(multi=True)), user_id or 'admin', datetime.now().date(),
+    )
+    if request_not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        try:
+            response = jsonify(build(versions.watermark(found)))
+        except psycopg2.Error:
+            return jsonify({'error': 'Unable to load dashboard data.'}), 503
+
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def versioned_dashboard_value(user_id, key, watermark, compute):
+    # Keyed by watermark, so another worker's write can never be hidden behind this worker's cache.
+    scope = dashboard_scope(user_id)
+    found, value = dashboard_cache.get(scope, f'{key}@{watermark}')
+    if found:
+        return value
+    with get_db_connection() as conn:
+        return cached_dashboard_task(scope, key, watermark, compute, user_id)(conn.cursor())
+
+
+def report_row_json(row):
+    return {
+        'id': row[0],
+        'name': row[1],
+        'age': row[2],
+        'drug': row[3],
+        'reaction': row[4],
+        'severity': row[5],
+        'created_at': row[6].isoformat(),
+        'reported_by': row[7],
+        'duplicate_of': row[8],
+    }
+
+
+@app.route('/api/dashboard/metrics')
+@login_required
+def api_dashboard_metrics():
+    user_id = api_user_scope()
+    return conditional_json(user_id, lambda watermark: {
+        'version': watermark,
+        'metrics': versioned_dashboard_value(user_id, 'metrics', watermark, get_dashboard_metrics),
+    })
+
+
+@app.route('/api/dashboard/charts')
+@login_required
+def api_dashboard_charts():
+    user_id = api_user_scope()
+
+    def build(watermark):
+        chart_data = versioned_dashboard_value(user_id, 'chart_data', watermark, get_chart_data)
+        severity_options = sorted(label for label in chart_data['severity_labels'] if label.strip())
+        return {'version': watermark, 'severity_options': severity_options, **chart_data}
+
+    return conditional_json(user_id, build)
+
+
+@app.route('/api/reports')
+@login_required
+def api_reports():
+    user_id = api_user_scope()
+    filters = get_report_filters()
+    page_args = get_page_args()
+    with_total = request.args.get('with_total') == '1'
+
+    def build(watermark):
+        with get_db_connection() as conn:
+            page = fetch_report_page(conn.cursor(), filters, page_args, user_id=user_id, with_total=with_total)
+        return {
+            'version': watermark,
+            'reports': [report_row_json(row) for row in page['rows']],
+            'per_page': page['per_page'],
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+            'total': page['total'],
+            'total_is_estimate': page['total_is_estimate'],
+        }
+
+    return conditional_json(user_id, build)
 
 
 @app.route('/add', methods=['POST'])
@@ -540,88 +1017,200 @@ def add():
         flash('Age must be a valid non-negative number.', 'warning')
         return dashboard_redirect_for_role()
 
+    user_id = session.get('user_id')
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-            INSERT INTO adr (user_id, name, age, drug, reaction, severity)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ''',
-            (session.get('user_id'), name, age_value, drug, reaction, severity),
-        )
-        conn.commit()
-        conn.close()
-        log_activity('ADD_REPORT', f'Added ADR report for patient {name}')
-        flash('ADR report added.', 'success')
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            duplicate_of = None
+            if duplicates.DUPLICATE_MODE != 'off':
+                duplicate_of = duplicates.find_duplicate(cursor, user_id, drug, reaction, age_value)
+            if duplicate_of and duplicates.DUPLICATE_MODE == 'reject':
+                flash(f'Possible duplicate of report #{duplicate_of}; the report was not added.', 'warning')
+                return dashboard_redirect_for_role()
+
+            cursor.execute(
+                '''
+                INSERT INTO adr (user_id, name, age, drug, drug_id, reaction, severity, duplicate_of)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+                ''',
+                (user_id, name, age_value, drug, drugs.dictionary.resolve_id(drug), reaction, severity, duplicate_of),
+            )
+            adr_id = cursor.fetchone()[0]
+            log_activity('ADD_REPORT', f'Added ADR report for patient {name}', conn=conn)
+            conn.commit()
+        if duplicates.DUPLICATE_MODE != 'off':
+            duplicates.remember(user_id, drug, reaction, age_value, adr_id)
+        invalidate_dashboard_cache(user_id)
+        if duplicate_of:
+            flash(f'ADR report added and flagged as a possible duplicate of report #{duplicate_of}.', 'warning')
+        else:
+            flash('ADR report added.', 'success')
     except psycopg2.Error:
         flash('Could not add ADR report.', 'danger')
 
     return dashboard_redirect_for_role()
 
 
-@app.route('/reports/edit/<int:adr_id>', methods=['GET', 'POST'])
+@app.route('/api/reports/batch', methods=['POST'])
 @login_required
-def edit_report(adr_id):
+def api_submit_reports():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': 'Send the reports as a JSON body.'}), 400
+    try:
+        reports = submissions.batch_reports(payload)
+    except submissions.BatchFormatError as exc:
+        return jsonify({'error': str(exc)}), 400
+
     user_id = session.get('user_id')
-    role = session.get('role')
+
+    def audit_batch(conn, summary):
+        log_activity(
+            'BATCH_ADD_REPORTS',
+            f"Added {summary['created']} ADR reports via the batch API ({summary['rejected']} rejected)",
+            conn=conn,
+        )
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with get_db_connection() as conn:
+            summary, created = submissions.submit_batch(conn, reports, user_id, before_commit=audit_batch)
+    except psycopg2.Error:
+        return jsonify({'error': 'Could not add ADR reports.'}), 503
 
-        if not can_access_report(cursor, adr_id, user_id, role):
-            conn.close()
-            flash('You do not have permission to edit this ADR report.', 'danger')
-            return dashboard_redirect_for_role()
+    if created:
+        if duplicates.DUPLICATE_MODE != 'off':
+            for adr_id, values in created:
+                duplicates.remember(user_id, values['drug'], values['reaction'], values['age'], adr_id)
+        invalidate_dashboard_cache(user_id)
+    return jsonify(summary), 201 if created else 200
 
-        if request.method == 'POST':
-            name = request.form.get('name', '').strip()
-            age = request.form.get('age', '').strip()
-            drug = request.form.get('drug', '').strip()
-            reaction = request.form.get('reaction', '').strip()
-            severity = request.form.get('severity', '').strip()
 
-            if not all([name, age, drug, reaction, severity]):
-                flash('All ADR fields are required.', 'warning')
-                return redirect(url_for('edit_report', adr_id=adr_id))
+def wants_json_response():
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
 
-            try:
-                age_value = int(age)
-                if age_value < 0:
-                    raise ValueError
-            except ValueError:
-                flash('Age must be a valid non-negative number.', 'warning')
-                return redirect(url_for('edit_report', adr_id=adr_id))
+
+def import_summary_message(summary):
+    message = f"Imported {summary['imported']} ADR report(s); {summary['rejected']} row(s) rejected."
+    if summary['duplicates'] and duplicates.DUPLICATE_MODE == 'flag':
+        message += f" {summary['duplicates']} flagged as possible duplicates."
+    details = [f"row {error['row']}: {' '.join(error['errors'])}" for error in summary['errors'][:5]]
+    if details:
+        message += ' ' + '; '.join(details)
+        if summary['rejected'] > len(details):
+            message += '; ...'
+    return message
+
+
+@app.route('/reports/import', methods=['POST'])
+@login_required
+def import_reports():
+    upload = request.files.get('file')
+    user_id = session.get('user_id')
+    error = None
+    summary = None
+
+    if not upload or not upload.filename:
+        error = 'Choose a CSV or XLSX file to import.'
+    else:
+        def audit_import(conn, summary):
+            log_activity(
+                'BULK_IMPORT',
+                f"Imported {summary['imported']} ADR reports from {upload.filename} ({summary['rejected']} rejected)",
+                conn=conn,
+            )
+
+        try:
+            with get_db_connection() as conn:
+                summary = importer.import_reports(
+                    conn, upload.stream, upload.filename, user_id, before_commit=audit_import,
+                )
+        except importer.ImportFormatError as exc:
+            error = str(exc)
+        except (ValueError, BadZipFile):
+            error = 'Could not read the uploaded file.'
+        except psycopg2.Error:
+            error = 'Could not import ADR reports.'
+
+    if error:
+        if wants_json_response():
+            return jsonify({'error': error}), 400
+        flash(error, 'danger')
+        return dashboard_redirect_for_role()
+
+    if summary['imported']:
+        invalidate_dashboard_cache(user_id)
+
+    if wants_json_response():
+        return jsonify(summary)
+    flash(import_summary_message(summary), 'warning' if summary['rejected'] or summary['duplicates'] else 'success')
+    return dashboard_redirect_for_role()
+
+
+@app.route('/reports/edit/<int:adr_id>', methods=['GET', 'POST'])
+@login_required
+def edit_report(adr_id):
+    user_id = session.get('user_id')
+    role = session.get('role')
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            if not can_access_report(cursor, adr_id, user_id, role):
+                flash('You do not have permission to edit this ADR report.', 'danger')
+                return dashboard_redirect_for_role()
+
+            if request.method == 'POST':
+                name = request.form.get('name', '').strip()
+                age = request.form.get('age', '').strip()
+                drug = request.form.get('drug', '').strip()
+                reaction = request.form.get('reaction', '').strip()
+                severity = request.form.get('severity', '').strip()
+
+                if not all([name, age, drug, reaction, severity]):
+                    flash('All ADR fields are required.', 'warning')
+                    return redirect(url_for('edit_report', adr_id=adr_id))
+
+                try:
+                    age_value = int(age)
+                    if age_value < 0:
+                        raise ValueError
+                except ValueError:
+                    flash('Age must be a valid non-negative number.', 'warning')
+                    return redirect(url_for('edit_report', adr_id=adr_id))
+
+                drug_id = drugs.dictionary.resolve_id(drug)
+                if role == 'admin':
+                    cursor.execute(
+                        'UPDATE adr SET name = %s, age = %s, drug = %s, drug_id = %s, reaction = %s, severity = %s WHERE id = %s RETURNING user_id',
+                        (name, age_value, drug, drug_id, reaction, severity, adr_id),
+                    )
+                else:
+                    cursor.execute(
+                        'UPDATE adr SET name = %s, age = %s, drug = %s, drug_id = %s, reaction = %s, severity = %s WHERE id = %s AND user_id = %s RETURNING user_id',
+                        (name, age_value, drug, drug_id, reaction, severity, adr_id, user_id),
+                    )
+                updated = cursor.fetchone()
+                log_activity('EDIT_REPORT', f'Edited ADR report #{adr_id}', conn=conn)
+                conn.commit()
+                if updated:
+                    invalidate_dashboard_cache(updated[0])
+                    duplicates.window.discard_report(adr_id)
+                flash('ADR report updated successfully.', 'success')
+                return dashboard_redirect_for_role()
 
             if role == 'admin':
                 cursor.execute(
-                    'UPDATE adr SET name = %s, age = %s, drug = %s, reaction = %s, severity = %s WHERE id = %s',
-                    (name, age_value, drug, reaction, severity, adr_id),
+                    'SELECT id, name, age, drug, reaction, severity, created_at FROM adr WHERE id = %s',
+                    (adr_id,),
                 )
             else:
                 cursor.execute(
-                    'UPDATE adr SET name = %s, age = %s, drug = %s, reaction = %s, severity = %s WHERE id = %s AND user_id = %s',
-                    (name, age_value, drug, reaction, severity, adr_id, user_id),
+                    'SELECT id, name, age, drug, reaction, severity, created_at FROM adr WHERE id = %s AND user_id = %s',
+                    (adr_id, user_id),
                 )
-            conn.commit()
-            conn.close()
-            log_activity('EDIT_REPORT', f'Edited ADR report #{adr_id}')
-            flash('ADR report updated successfully.', 'success')
-            return dashboard_redirect_for_role()
-
-        if role == 'admin':
-            cursor.execute(
-                'SELECT id, name, age, drug, reaction, severity, created_at FROM adr WHERE id = %s',
-                (adr_id,),
-            )
-        else:
-            cursor.execute(
-                'SELECT id, name, age, drug, reaction, severity, created_at FROM adr WHERE id = %s AND user_id = %s',
-                (adr_id, user_id),
-            )
-        adr = cursor.fetchone()
-        conn.close()
+            adr = cursor.fetchone()
 
         if not adr:
             flash('ADR record not found.', 'warning')
@@ -640,19 +1229,21 @@ def delete_report(adr_id):
     role = session.get('role')
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        if role == 'admin':
-            cursor.execute('DELETE FROM adr WHERE id = %s', (adr_id,))
-        else:
-            cursor.execute('DELETE FROM adr WHERE id = %s AND user_id = %s', (adr_id, user_id))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if role == 'admin':
+                cursor.execute('DELETE FROM adr WHERE id = %s RETURNING user_id', (adr_id,))
+            else:
+                cursor.execute('DELETE FROM adr WHERE id = %s AND user_id = %s RETURNING user_id', (adr_id, user_id))
 
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+            deleted = cursor.fetchone()
+            if deleted:
+                log_activity('DELETE_REPORT', f'Deleted ADR report #{adr_id}', conn=conn)
+            conn.commit()
 
         if deleted:
-            log_activity('DELETE_REPORT', f'Deleted ADR report #{adr_id}')
+            invalidate_dashboard_cache(deleted[0])
+            duplicates.window.discard_report(adr_id)
             flash('ADR report deleted.', 'warning')
         else:
             flash('ADR record not found or not permitted.', 'warning')
@@ -668,18 +1259,18 @@ def create_user():
     username = request.form.get('username', '').strip()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        if not username:
-            username = generate_unique_username(cursor)
-        password = generate_random_password()
-        cursor.execute(
-            'INSERT INTO users (username, password, role) VALUES (%s, %s, %s)',
-            (username, generate_password_hash(password), 'user'),
-        )
-        conn.commit()
-        conn.close()
-        log_activity('CREATE_USER', f'Created user {username} with role user')
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if not username:
+                username = provisioning.reserve_usernames(cursor, 1)[0]
+            password = passwords.generate_password()
+            cursor.execute(
+                'INSERT INTO users (username, password, role) VALUES (%s, %s, %s)',
+                (username, passwords.hash_password(password), 'user'),
+            )
+            log_activity('CREATE_USER', f'Created user {username} with role user', conn=conn)
+            conn.commit()
+        invalidate_dashboard_cache()
         flash(f'User created: {username} | Temporary password: {password}', 'success')
     except psycopg2.Error:
         flash('Unable to create user. Username may already exist.', 'danger')
@@ -690,19 +1281,19 @@ def create_user():
 @app.route('/users/reset-password/<int:user_id>', methods=['POST'])
 @admin_required
 def reset_user_password(user_id):
-    new_password = generate_random_password()
+    new_password = passwords.generate_password()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE users SET password = %s WHERE id = %s',
-            (generate_password_hash(new_password), user_id),
-        )
-        updated = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET password = %s WHERE id = %s',
+                (passwords.hash_password(new_password), user_id),
+            )
+            updated = cursor.rowcount
+            if updated:
+                log_activity('RESET_PASSWORD', f'Reset password for user #{user_id}', conn=conn)
+            conn.commit()
         if updated:
-            log_activity('RESET_PASSWORD', f'Reset password for user #{user_id}')
             flash(f'Password reset successfully. New temporary password: {new_password}', 'success')
         else:
             flash('User not found.', 'warning')
@@ -719,15 +1310,17 @@ def delete_user(user_id):
         return redirect(url_for('admin_dashboard'))
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+            deleted = cursor.rowcount
+            if deleted:
+                log_activity('DELETE_USER', f'Deleted user id #{user_id}', conn=conn)
+            conn.commit()
 
         if deleted:
-            log_activity('DELETE_USER', f'Deleted user id #{user_id}')
+            dashboard_cache.invalidate()
+            fragment_cache.invalidate()
             flash('User deleted.', 'info')
         else:
             flash('User not found.', 'warning')
@@ -750,15 +1343,16 @@ def update_user_role(user_id):
         return redirect(url_for('admin_dashboard'))
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET role = %s WHERE id = %s', (new_role, user_id))
-        updated = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE users SET role = %s WHERE id = %s', (new_role, user_id))
+            updated = cursor.rowcount
+            if updated:
+                log_activity('CHANGE_ROLE', f'Changed user #{user_id} role to {new_role}', conn=conn)
+            conn.commit()
 
         if updated:
-            log_activity('CHANGE_ROLE', f'Changed user #{user_id} role to {new_role}')
+            fragment_cache.invalidate(dashboard_scope())
             flash('User role updated.', 'success')
         else:
             flash('User not found.', 'warning')
@@ -768,40 +1362,443 @@ def update_user_role(user_id):
     return redirect(url_for('admin_dashboard'))
 
 
+def credentials_download(accounts, name):
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        provisioning.credentials_csv(accounts),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'Cache-Control': 'no-store'},
+    )
+
+
+@app.route('/users/bulk-create', methods=['POST'])
+@admin_required
+def bulk_create_users():
+    role = request.form.get('role', 'user').strip().lower()
+    base = request.form.get('prefix', '').strip() or 'user'
+    try:
+        count = int(request.form.get('count', '').strip() or 0)
+    except ValueError:
+        count = -1
+
+    error = None
+    if role not in ALLOWED_ROLES:
+        error = 'Invalid role selected.'
+    elif count < 0:
+        error = 'Number of users must be a non-negative number.'
+
+    def audit_created(conn, accounts):
+        log_activity('BULK_CREATE_USERS', f'Created {len(accounts)} users with role {role}', conn=conn)
+
+    accounts = []
+    if not error:
+        try:
+            usernames = provisioning.clean_usernames(request.form.get('usernames', '').splitlines())
+            with get_db_connection() as conn:
+                accounts = provisioning.provision_users(
+                    conn, usernames, count, role=role, base=base, before_commit=audit_created,
+                )
+        except provisioning.ProvisioningError as exc:
+            error = str(exc)
+        except psycopg2.Error:
+            error = 'Unable to create users.'
+
+    if error:
+        if wants_json_response():
+            return jsonify({'error': error}), 400
+        flash(error, 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    invalidate_dashboard_cache()
+    if wants_json_response():
+        return jsonify({'created': [
+            {'id': user_id, 'username': username, 'role': role, 'temporary_password': password}
+            for user_id, username, role, password in accounts
+        ]})
+    return credentials_download(accounts, 'new_users')
+
+
+@app.route('/users/bulk', methods=['POST'])
+@admin_required
+def bulk_update_users():
+    action = request.form.get('action', '').strip()
+    user_ids = provisioning.selected_user_ids(request.form.getlist('user_ids'), session.get('user_id'))
+    new_role = request.form.get('role', '').strip().lower()
+    if action not in ('role', 'reset_password', 'delete'):
+        flash('Choose a bulk action.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+    if not user_ids:
+        flash('Select at least one user other than yourself.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+    if action == 'role' and new_role not in ALLOWED_ROLES:
+        flash('Invalid role selected.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if action == 'role':
+                changed = provisioning.change_roles(cursor, user_ids, new_role)
+                log_activity('BULK_CHANGE_ROLE', f'Changed {len(changed)} users to role {new_role}', conn=conn)
+            elif action == 'delete':
+                changed = provisioning.delete_users(cursor, user_ids)
+                listed = ', '.join(f'#{user_id}' for user_id in changed[:20]) + (' ...' if len(changed) > 20 else '')
+                log_activity('BULK_DELETE_USERS', f'Deleted {len(changed)} users: {listed}', conn=conn)
+            else:
+                changed = provisioning.reset_passwords(cursor, user_ids)
+                log_activity('BULK_RESET_PASSWORD', f'Reset passwords for {len(changed)} users', conn=conn)
+            conn.commit()
+    except psycopg2.Error:
+        flash('Unable to update the selected users.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+
+    if action == 'role':
+        if changed:
+            fragment_cache.invalidate(dashboard_scope())
+        flash(f'Changed the role of {len(changed)} user(s) to {new_role}.', 'success')
+    elif action == 'delete':
+        if changed:
+            dashboard_cache.invalidate()
+            fragment_cache.invalidate()
+        flash(f'Deleted {len(changed)} user(s).', 'info')
+    else:
+        if changed:
+            return credentials_download(changed, 'password_resets')
+        flash('None of the selected users were found.', 'warning')
+    return redirect(url_for('admin_dashboard'))
+
+
+@app.route('/admin/signals')
+@admin_required
+def signal_dashboard():
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            signals = signal_detection.fetch_signals(cursor)
+            state = signal_detection.fetch_signal_state(cursor)
+    except psycopg2.Error:
+        if wants_json_response():
+            return jsonify({'error': 'Unable to load signals.'}), 503
+        flash('Unable to load signals.', 'danger')
+        signals, state = [], None
+
+    if wants_json_response():
+        return jsonify({'state': state, 'signals': signals})
+    return render_template('signals.html', signals=signals, state=state, min_count=signal_detection.SIGNAL_MIN_COUNT)
+
+
+@app.route('/admin/signals/run', methods=['POST'])
+@admin_required
+def run_signal_detection():
+    full = request.form.get('mode') == 'full'
+
+    def audit_run(conn, summary):
+        log_activity('RUN_SIGNALS', f"{summary['mode']} signal detection flagged {summary['flagged']} pairs", conn=conn)
+
+    try:
+        with get_db_connection() as conn:
+            summary = signal_detection.run_signal_detection(conn, full=full, before_commit=audit_run)
+        flash(
+            f"Signal detection ({summary['mode']}) updated {summary['touched_pairs']} pair(s); "
+            f"{summary['flagged']} of {summary['pairs']} pairs flagged.",
+            'success',
+        )
+    except psycopg2.Error:
+        flash('Unable to run signal detection.', 'danger')
+    return redirect(url_for('signal_dashboard'))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.METRICS_ENABLED:
+        return Response('Metrics are disabled; set METRICS_ENABLED=1.\n', status=404, mimetype='text/plain')
+    if not metrics.token_authorized(request.headers.get('Authorization')):
+        if session.get('role') != 'admin' or not ensure_session_identity():
+            return Response('Admin access required.\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(db.pool_stats(), db.replica_stats()), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/slow-queries')
+@admin_required
+def slow_queries():
+    try:
+        days = min(max(int(request.args.get('days', '7')), 1), slowlog.SLOW_QUERY_RETENTION_DAYS)
+    except ValueError:
+        days = 7
+    summary = []
+    try:
+        with get_db_connection() as conn:
+            summary = slowlog.fetch_summary(conn.cursor(), days=days)
+    except psycopg2.Error:
+        flash('Unable to load the slow query log.', 'danger')
+
+    if wants_json_response():
+        return jsonify({'days': days, 'queries': summary, 'stats': slowlog.log.stats()})
+    return render_template(
+        'slow_queries.html',
+        queries=summary,
+        recent=list(reversed(slowlog.log.recent())),
+        stats=slowlog.log.stats(),
+        days=days,
+    )
+
+
+def get_audit_filters():
+    return {
+        'username': request.args.get('username', '').strip(),
+        'action': request.args.get('action', '').strip(),
+        'date_from': request.args.get('date_from', '').strip(),
+        'date_to': request.args.get('date_to', '').strip(),
+    }
+
+
+def fetch_audit_page(cursor, filters, page_args):
+    query = {'action': filters['action'] or None, 'date_from': parse_filter_date(filters['date_from'])}
+    date_to = parse_filter_date(filters['date_to'])
+    if date_to:
+        query['date_to'] = date_to + timedelta(days=1)
+    if filters['username']:
+        cursor.execute('SELECT id FROM users WHERE username = %s', (filters['username'],))
+        user = cursor.fetchone()
+        if not user:
+            return {'rows': [], 'per_page': page_args['per_page'], 'next_cursor': None, 'prev_cursor': None}
+        query['user_id'] = user[0]
+
+    after = decode_page_cursor(page_args['after'])
+    before = None if after else decode_page_cursor(page_args['before'])
+    rows, has_more = activity.fetch_activity_page(cursor, query, after, before, page_args['per_page'])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if before or has_more:
+            next_cursor = encode_keyset_cursor(rows[-1][1], rows[-1][0])
+        if after or (before and has_more):
+            prev_cursor = encode_keyset_cursor(rows[0][1], rows[0][0])
+    return {'rows': rows, 'per_page': page_args['per_page'], 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+@app.route('/admin/audit')
+@admin_required
+def audit_log():
+    filters = get_audit_filters()
+    page_args = get_page_args()
+    page = {'rows': [], 'per_page': page_args['per_page'], 'next_cursor': None, 'prev_cursor': None}
+    try:
+        with get_db_connection() as conn:
+            page = fetch_audit_page(conn.cursor(), filters, page_args)
+    except psycopg2.Error:
+        flash('Unable to load the audit log.', 'danger')
+
+    if wants_json_response():
+        return jsonify({
+            'entries': [
+                {'id': row[0], 'created_at': row[1].isoformat(), 'username': row[2], 'action': row[3], 'details': row[4]}
+                for row in page['rows']
+            ],
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+        })
+    return render_template('audit_log.html', page=page, filters=filters, actions=activity.ACTIONS)
+
+
+def get_trend_args():
+    today = datetime.now().date()
+    end = parse_filter_date(request.args.get('end', '').strip())
+    end = end.date() if end else today
+    start = parse_filter_date(request.args.get('start', '').strip())
+    start = start.date() if start else end - timedelta(days=89)
+    interval = request.args.get('interval', 'day').strip()
+    group = request.args.get('group', 'severity').strip()
+    try:
+        moving_window = min(max(int(request.args.get('ma', '0')), 0), 90)
+    except ValueError:
+        moving_window = 0
+    return {
+        'start': start,
+        'end': end,
+        'interval': interval if interval in trends.INTERVALS else 'day',
+        'group': group if group in trends.GROUPS else 'severity',
+        'drug': request.args.get('drug', '').strip(),
+        'severity': request.args.get('severity', '').strip(),
+        'ma': moving_window,
+    }
+
+
+def trend_args_error(args):
+    if args['start'] > args['end']:
+        return 'Start date must not be after end date.'
+    if len(trends.bucket_starts(args['start'], args['end'], args['interval'])) > trends.TREND_MAX_BUCKETS:
+        return f"Range too long for {args['interval']} buckets; pick a shorter range or a coarser interval."
+    return None
+
+
+def load_trend(args):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # The first request after midnight closes out yesterday; other workers skip while it holds the lock.
+        if trends.close_is_due(cursor):
+            trends.close_out(cursor, max_days=trends.TREND_LAZY_CLOSE_DAYS)
+            conn.commit()
+        drug_ids = drugs.dictionary.matching_ids(args['drug']) if args['drug'] else None
+        return trends.fetch_trend(
+            cursor,
+            args['start'],
+            args['end'],
+            interval=args['interval'],
+            group=args['group'],
+            drug_ids=drug_ids,
+            severity=args['severity'] or None,
+            moving_window=args['ma'],
+        )
+
+
+@app.route('/api/trends')
+@admin_required
+def api_trends():
+    args = get_trend_args()
+    error = trend_args_error(args)
+    if error:
+        return jsonify({'error': error}), 400
+    return conditional_json(None, lambda watermark: {'version': watermark, **load_trend(args)})
+
+
+@app.route('/admin/trends')
+@admin_required
+def trend_dashboard():
+    args = get_trend_args()
+    trend = None
+    error = trend_args_error(args)
+    if error:
+        flash(error, 'warning')
+    else:
+        try:
+            trend = load_trend(args)
+        except psycopg2.Error:
+            flash('Unable to load trends.', 'danger')
+    return render_template('trends.html', trend=trend, args=args, intervals=trends.INTERVALS, groups=trends.GROUPS)
+
+
+@app.route('/admin/stats/pool')
+@admin_required
+def pool_statistics():
+    return jsonify({'pid': os.getpid(), 'pool': db.pool_stats(), 'replicas': db.replica_stats()})
+
+
+@app.route('/admin/stats/cache')
+@admin_required
+def cache_statistics():
+    return jsonify({'pid': os.getpid(), 'dashboard': dashboard_cache.stats(), 'fragments': fragment_cache.stats()})
+
+
+@app.route('/admin/stats/loader')
+@admin_required
+def dashboard_loader_statistics():
+    return jsonify({'pid': os.getpid(), 'loader': loader.dashboard.stats()})
+
+
+@app.route('/admin/stats/passwords')
+@admin_required
+def password_hasher_statistics():
+    return jsonify({
+        'pid': os.getpid(),
+        'passwords': passwords.hasher.stats(),
+        'login_failures': ratelimit.login_failures.stats(),
+    })
+
+
+@app.route('/admin/stats/duplicates')
+@admin_required
+def duplicate_statistics():
+    return jsonify({'pid': os.getpid(), 'duplicates': duplicates.window.stats()})
+
+
+@app.route('/admin/stats/drugs')
+@admin_required
+def drug_dictionary_statistics():
+    return jsonify({'pid': os.getpid(), 'drugs': drugs.dictionary.stats()})
+
+
+@app.route('/admin/stats/audit')
+@admin_required
+def audit_statistics():
+    return jsonify({'pid': os.getpid(), 'audit': audit.writer.stats()})
+
+
+def export_query_for_request():
+    filters = get_report_filters()
+    owner_id = None if session.get('role') == 'admin' else session.get('user_id')
+    return build_report_query(filters, user_id=owner_id)
+
+
+def export_filename(extension):
+    return f"adr_reports_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
 @app.route('/export/csv')
 @login_required
 def export_adr_csv():
-    filters = get_report_filters()
-    role = session.get('role')
-    owner_id = None if role == 'admin' else session.get('user_id')
+    compress = request.args.get('gzip') == '1'
+    query, params = export_query_for_request()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        rows = fetch_reports_with_filters(cursor, filters, user_id=owner_id)
-        conn.close()
-
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['ID', 'Patient Name', 'Age', 'Drug', 'Reaction', 'Severity', 'Reported At', 'Owner'])
-
-        for row in rows:
-            writer.writerow([
-                row[0], row[1], row[2], row[3], row[4], row[5],
-                row[6].strftime('%Y-%m-%d %H:%M:%S') if row[6] else '',
-                row[7],
-            ])
-
-        mem = BytesIO()
-        mem.write(output.getvalue().encode('utf-8'))
-        mem.seek(0)
-
-        filename = f"adr_reports_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
-        return send_file(mem, as_attachment=True, download_name=filename, mimetype='text/csv')
+        batches = exports.open_row_batches(query, params)
+        chunks = exports.csv_chunks(batches)
+        filename = export_filename('csv')
+        mimetype = 'text/csv'
+        if compress:
+            chunks = exports.gzip_chunks(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        return Response(
+            chunks,
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'},
+        )
     except psycopg2.Error:
         flash('Unable to export CSV right now.', 'danger')
         return dashboard_redirect_for_role()
 
 
+@app.route('/export/xlsx')
+@login_required
+def export_adr_xlsx():
+    query, params = export_query_for_request()
+    try:
+        spooled = exports.spool_export(exports.write_xlsx, exports.open_row_batches(query, params))
+    except psycopg2.Error:
+        flash('Unable to export XLSX right now.', 'danger')
+        return dashboard_redirect_for_role()
+
+    return send_file(
+        spooled,
+        as_attachment=True,
+        download_name=export_filename('xlsx'),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+@app.route('/export/parquet')
+@login_required
+def export_adr_parquet():
+    if not exports.parquet_available():
+        flash('Parquet export requires the pyarrow package.', 'warning')
+        return dashboard_redirect_for_role()
+
+    query, params = export_query_for_request()
+    try:
+        spooled = exports.spool_export(exports.write_parquet, exports.open_row_batches(query, params))
+    except psycopg2.Error:
+        flash('Unable to export Parquet right now.', 'danger')
+        return dashboard_redirect_for_role()
+
+    return send_file(
+        spooled,
+        as_attachment=True,
+        download_name=export_filename('parquet'),
+        mimetype='application/vnd.apache.parquet',
+    )
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
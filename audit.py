@@ -0,0 +1,199 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+import activity
+import db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def write_entries(cursor, entries):
+    execute_values(
+        cursor,
+        'INSERT INTO activity_logs (user_id, action, details) VALUES %s',
+        entries,
+        page_size=len(entries),
+    )
+
+
+class AuditLogWriter:
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=1.0, strict=False):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.strict = strict
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._maintain_at = 0.0
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written': 0,
+            'batches': 0,
+            'write_errors': 0,
+            'flush_seconds_last': 0.0,
+            'flush_seconds_max': 0.0,
+            'flush_seconds_total': 0.0,
+        }
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                # Queued entries copied across fork belong to the parent; start empty.
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def log(self, user_id, action, details='', conn=None):
+        entry = (user_id, action, details)
+        if self.strict:
+            if conn is not None:
+                self._write_in_transaction(conn, [entry])
+            else:
+                self._write([entry])
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+            with self._lock:
+                self._stats['enqueued'] += 1
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def _write_in_transaction(self, conn, entries):
+        # Part of the caller's transaction: the change and its audit row commit or fail together.
+        cursor = conn.cursor()
+        cursor.execute('SAVEPOINT audit_write')
+        try:
+            write_entries(cursor, entries)
+        except psycopg2.errors.CheckViolation:
+            # No partition covers the current time yet; the caller's commit creates it with the row.
+            cursor.execute('ROLLBACK TO SAVEPOINT audit_write')
+            activity.ensure_partitions(cursor)
+            write_entries(cursor, entries)
+        except psycopg2.Error:
+            with self._lock:
+                self._stats['write_errors'] += 1
+            raise
+        cursor.execute('RELEASE SAVEPOINT audit_write')
+        with self._lock:
+            self._stats['written'] += len(entries)
+
+    def _write(self, entries):
+        started = time.monotonic()
+        try:
+            with db.connection() as conn:
+                if started >= self._maintain_at:
+                    self._maintain_at = started + 3600
+                    activity.maintain_partitions(conn)
+                try:
+                    write_entries(conn.cursor(), entries)
+                except psycopg2.errors.CheckViolation:
+                    # No partition covers the current time yet; create it and retry once.
+                    conn.rollback()
+                    activity.maintain_partitions(conn)
+                    write_entries(conn.cursor(), entries)
+                conn.commit()
+        except (psycopg2.Error, RuntimeError):
+            with self._lock:
+                self._stats['write_errors'] += 1
+            if self.strict:
+                # Strict callers write inline; failing the request beats an unaudited change.
+                raise
+            logger.exception('Failed to write %s activity log entries', len(entries))
+            with self._lock:
+                self._stats['dropped'] += len(entries)
+            return
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['written'] += len(entries)
+            self._stats['batches'] += 1
+            self._stats['flush_seconds_last'] = elapsed
+            self._stats['flush_seconds_total'] += elapsed
+            self._stats['flush_seconds_max'] = max(self._stats['flush_seconds_max'], elapsed)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stopping = item is _STOP
+            if item is not None and not stopping:
+                batch.append(item)
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+            if stopping:
+                return
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning('Activity log queue still full at shutdown; pending entries are lost')
+            return
+        thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            queue_depth=self._queue.qsize(),
+            queue_capacity=self.max_queue,
+            strict=self.strict,
+            running=self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+        )
+        stats['flush_seconds_avg'] = stats['flush_seconds_total'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+writer = AuditLogWriter(
+    max_queue=int(os.environ.get('AUDIT_QUEUE_SIZE', '10000')),
+    batch_size=int(os.environ.get('AUDIT_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('AUDIT_FLUSH_INTERVAL', '1.0')),
+    strict=os.environ.get('AUDIT_LOG_STRICT') == '1',
+)
+atexit.register(writer.stop)
@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from werkzeug.security import generate_password_hash
+
+import activity
+import drugs
+import migrations
+import rollups
+import trends
+
+DRUGS = [
+    'Aspirin', 'Ibuprofen', 'Paracetamol', 'Amoxicillin', 'Metformin', 'Atorvastatin', 'Lisinopril',
+    'Amlodipine', 'Omeprazole', 'Simvastatin', 'Losartan', 'Levothyroxine', 'Azithromycin', 'Ciprofloxacin',
+    'Prednisone', 'Warfarin', 'Clopidogrel', 'Sertraline', 'Fluoxetine', 'Gabapentin', 'Tramadol',
+    'Hydrochlorothiazide', 'Furosemide', 'Pantoprazole', 'Montelukast', 'Cetirizine', 'Doxycycline',
+    'Insulin Glargine', 'Methotrexate', 'Allopurinol', 'Carbamazepine', 'Lamotrigine', 'Phenytoin',
+    'Vancomycin', 'Ceftriaxone', 'Diclofenac', 'Naproxen', 'Codeine', 'Morphine', 'Enalapril',
+]
+REACTIONS = [
+    'Rash', 'Nausea', 'Vomiting', 'Headache', 'Dizziness', 'Diarrhoea', 'Pruritus', 'Urticaria',
+    'Fatigue', 'Abdominal pain', 'Angioedema', 'Anaphylaxis', 'Hypotension', 'Tachycardia',
+    'Myalgia', 'Insomnia', 'Somnolence', 'Dry cough', 'Constipation', 'Elevated liver enzymes',
+    'Stevens-Johnson syndrome', 'Gastrointestinal bleeding', 'Hypoglycaemia', 'Hyperkalaemia',
+    'Photosensitivity', 'Tinnitus', 'Peripheral oedema', 'Confusion', 'Seizure', 'Blurred vision',
+]
+# Planted associations so signal detection has something to find at every scale.
+SIGNALS = {
+    'Clopidogrel': 'Gastrointestinal bleeding', 'Lisinopril': 'Dry cough', 'Carbamazepine': 'Stevens-Johnson syndrome',
+    'Atorvastatin': 'Myalgia', 'Metformin': 'Diarrhoea', 'Amlodipine': 'Peripheral oedema',
+}
+SEVERITIES = ['Mild', 'Moderate', 'Severe']
+SEVERITY_WEIGHTS = [0.55, 0.35, 0.10]
+FIRST_NAMES = ['Aarav', 'Maya', 'John', 'Priya', 'Liam', 'Sofia', 'Noah', 'Zara', 'Omar', 'Emma', 'Ravi', 'Chen']
+LAST_NAMES = ['Sharma', 'Smith', 'Patel', 'Garcia', 'Khan', 'Nguyen', 'Brown', 'Singh', 'Lopez', 'Okafor']
+ACTIONS = ['LOGIN', 'ADD_REPORT', 'EDIT_REPORT', 'DELETE_REPORT', 'BULK_IMPORT', 'LOGOUT']
+ACTION_WEIGHTS = [0.35, 0.40, 0.10, 0.03, 0.02, 0.10]
+
+
+def zipf_choice(rng, size, count, exponent=1.1):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return rng.choice(count, size=size, p=weights / weights.sum())
+
+
+def spelling_variants(rng, names):
+    # Real reports mix case and stray whitespace; the drug dictionary has to fold these.
+    variant = rng.random(len(names))
+    names = np.where(variant < 0.08, np.char.lower(names.astype(str)), names)
+    names = np.where((variant >= 0.08) & (variant < 0.12), np.char.upper(names.astype(str)), names)
+    return np.where((variant >= 0.12) & (variant < 0.15), np.char.add(names.astype(str), ' '), names)
+
+
+def copy_frame(cursor, table, frame):
+    buffer = StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def create_users(cursor, count, password, prefix):
+    # One hash for every synthetic account: hashing 10^4 passwords would dominate generation time.
+    password_hash = generate_password_hash(password)
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM users')
+    first_id = cursor.fetchone()[0] + 1
+    frame = pd.DataFrame({
+        'username': [f'{prefix}{first_id + index}' for index in range(count)],
+        'password': password_hash,
+        'role': 'user',
+    })
+    copy_frame(cursor, 'users', frame)
+    cursor.execute('SELECT id FROM users WHERE username LIKE %s ORDER BY id', (f'{prefix}%',))
+    return np.array([row[0] for row in cursor.fetchall()])
+
+
+def report_chunk(rng, size, user_ids, days, drug_ids):
+    drug_index = zipf_choice(rng, size, len(DRUGS))
+    drug_names = np.array(DRUGS)[drug_index]
+    reaction_index = zipf_choice(rng, size, len(REACTIONS), exponent=0.8)
+    reactions = np.array(REACTIONS, dtype=object)[reaction_index]
+    planted = rng.random(size) < 0.3
+    for drug, reaction in SIGNALS.items():
+        reactions[planted & (drug_names == drug)] = reaction
+
+    # Skew towards recent days, like a live system.
+    age_days = np.minimum(rng.exponential(days / 3, size), days - 1)
+    created_at = pd.Timestamp.now().floor('s') - pd.to_timedelta(age_days * 86400, unit='s')
+    first = np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), size)]
+    last = np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), size)]
+
+    return pd.DataFrame({
+        'user_id': user_ids[zipf_choice(rng, size, len(user_ids), exponent=0.9)],
+        'name': np.char.add(np.char.add(first, ' '), last),
+        'age': np.clip(rng.normal(52, 18, size), 0, 100).astype(int),
+        'drug': spelling_variants(rng, drug_names),
+        'drug_id': np.array([drug_ids[drugs.normalize_drug(name)] for name in DRUGS])[drug_index],
+        'reaction': reactions,
+        'severity': rng.choice(SEVERITIES, size=size, p=SEVERITY_WEIGHTS),
+        'created_at': created_at,
+    })
+
+
+def log_chunk(rng, size, user_ids, days):
+    age_days = np.minimum(rng.exponential(days / 3, size), days - 1)
+    actions = rng.choice(ACTIONS, size=size, p=ACTION_WEIGHTS)
+    return pd.DataFrame({
+        'user_id': user_ids[rng.integers(0, len(user_ids), size)],
+        'action': actions,
+        'details': np.char.add('synthetic ', np.char.lower(actions.astype(str))),
+        'created_at': pd.Timestamp.now().floor('s') - pd.to_timedelta(age_days * 86400, unit='s'),
+    })
+
+
+def generate(conn, users, reports, logs, days, seed, password, prefix, chunk_size, log=print):
+    rng = np.random.default_rng(seed)
+    cursor = conn.cursor()
+    started = time.perf_counter()
+
+    user_ids = create_users(cursor, users, password, prefix)
+    drug_ids = drugs.create_drugs(cursor, {drugs.normalize_drug(name): name for name in DRUGS})
+    conn.commit()
+    log(f'{len(user_ids)} users ready ({time.perf_counter() - started:.1f}s)')
+
+    # The rollup triggers would run once per chunk; rebuilding once at the end is cheaper.
+    cursor.execute('ALTER TABLE adr DISABLE TRIGGER adr_rollup_insert')
+    conn.commit()
+    for offset in range(0, reports, chunk_size):
+        copy_frame(cursor, 'adr', report_chunk(rng, min(chunk_size, reports - offset), user_ids, days, drug_ids))
+        conn.commit()
+        log(f'{min(offset + chunk_size, reports)}/{reports} reports ({time.perf_counter() - started:.1f}s)')
+    cursor.execute('ALTER TABLE adr ENABLE TRIGGER adr_rollup_insert')
+    rollups.rebuild_rollups(cursor)
+    # Backdated rows marked every past day dirty; close them out so trend reads hit the bucket table.
+    trends.close_out(cursor)
+    conn.commit()
+
+    activity.ensure_partitions(cursor, start=pd.Timestamp.now() - pd.Timedelta(days=days))
+    for offset in range(0, logs, chunk_size):
+        copy_frame(cursor, 'activity_logs', log_chunk(rng, min(chunk_size, logs - offset), user_ids, days))
+        conn.commit()
+    log(f'{logs} activity log rows ({time.perf_counter() - started:.1f}s)')
+
+    cursor.execute('ANALYZE')
+    conn.commit()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Fill a local, disposable Postgres with synthetic ADR data. Run from the repo root: '
+        'python -m bench.generate',
+    )
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--reports', type=int, default=100000, help='10^4 to 10^7 is the intended range.')
+    parser.add_argument('--logs', type=int, default=None, help='Defaults to twice the report count.')
+    parser.add_argument('--days', type=int, default=730, help='Spread created_at over this many days.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='benchpass', help='Password shared by every synthetic user.')
+    parser.add_argument('--prefix', default='bench_user_')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    logs = args.reports * 2 if args.logs is None else args.logs
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        migrations.run_migrations(conn)
+        elapsed = generate(
+            conn, args.users, args.reports, logs, args.days, args.seed,
+            args.password, args.prefix, args.chunk_size,
+        )
+    finally:
+        conn.close()
+    print(f'Generated {args.reports} reports for {args.users} users in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
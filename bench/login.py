@@ -0,0 +1,112 @@
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.run import _ms, percentile
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def http_login(args):
+    opener = urllib.request.build_opener(NoRedirect)
+
+    def login(username):
+        data = urllib.parse.urlencode({'username': username, 'password': args.password}).encode()
+        try:
+            with opener.open(f"{args.url.rstrip('/')}/login", data=data, timeout=args.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+        except (urllib.error.URLError, OSError):
+            return 0
+
+    return login
+
+
+def client_login(args):
+    import app as adr_app
+
+    local = threading.local()
+
+    def login(username):
+        if getattr(local, 'client', None) is None:
+            local.client = adr_app.app.test_client()
+        # A fresh cookie jar per attempt, as if every login came from a new browser.
+        local.client.delete_cookie('session')
+        response = local.client.post('/login', data={'username': username, 'password': args.password})
+        response.close()
+        return response.status_code
+
+    return login
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure sign-ins per second against the synthetic users. Run from the repo root: '
+                    'python -m bench.login',
+    )
+    parser.add_argument('--mode', choices=['client', 'http'], default='http')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL for --mode http.')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=100, help='Spread logins over this many synthetic users.')
+    parser.add_argument('--prefix', default='bench_user_')
+    parser.add_argument('--password', default='benchpass')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    login = (client_login if args.mode == 'client' else http_login)(args)
+    usernames = [f'{args.prefix}{index % args.users + 1}' for index in range(args.logins)]
+
+    def timed(username):
+        started = time.perf_counter()
+        status = login(username)
+        return time.perf_counter() - started, status
+
+    # Warm-up: starts the hash processes and rehashes any accounts stored with old parameters.
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(timed, usernames[:min(args.users, args.logins)]))
+        wall_started = time.perf_counter()
+        outcomes = list(pool.map(timed, usernames))
+        wall = time.perf_counter() - wall_started
+
+    latencies = sorted(outcome[0] for outcome in outcomes)
+    statuses = {}
+    for _, status in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    result = {
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'logins': len(outcomes),
+        'succeeded': statuses.get(302, 0),
+        'busy': statuses.get(503, 0),
+        'rate_limited': statuses.get(429, 0),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'logins_per_second': round(statuses.get(302, 0) / wall, 2) if wall else None,
+        'p50_ms': _ms(percentile(latencies, 0.50)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+    }
+    print(
+        f"{result['mode']} c={args.concurrency} logins={result['logins']} ok={result['succeeded']} "
+        f"busy={result['busy']} limited={result['rate_limited']} {result['logins_per_second']} logins/s "
+        f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms"
+    )
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump(result, target, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg2
+
+# (name, role, path, heavy): heavy endpoints use --heavy-requests, since a full export at 10^7 rows takes minutes.
+SCENARIOS = [
+    ('admin_dashboard', 'admin', '/admin', False),
+    ('admin_search', 'admin', '/admin?search=rash', False),
+    ('admin_search_ranked', 'admin', '/admin?search=rash&sort=relevance', False),
+    ('admin_drug_filter', 'admin', '/admin?drug=aspirin&severity=Severe', False),
+    ('admin_date_range', 'admin', '/admin?date_from={month_ago}&date_to={today}', False),
+    ('user_dashboard', 'user', '/user', False),
+    ('user_search', 'user', '/user?search=nausea', False),
+    ('export_csv', 'admin', '/export/csv', True),
+    ('export_csv_gzip', 'admin', '/export/csv?gzip=1', True),
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(name, mode, latencies, errors, wall_seconds, bytes_read, rss):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        'endpoint': name,
+        'mode': mode,
+        'requests': count,
+        'errors': errors,
+        'p50_ms': _ms(percentile(ordered, 0.50)),
+        'p95_ms': _ms(percentile(ordered, 0.95)),
+        'p99_ms': _ms(percentile(ordered, 0.99)),
+        'mean_ms': _ms(sum(ordered) / count) if count else None,
+        'max_ms': _ms(ordered[-1]) if count else None,
+        'throughput_rps': round(count / wall_seconds, 2) if wall_seconds else None,
+        'bytes_per_request': int(bytes_read / count) if count else 0,
+        **rss,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def read_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as children:
+            pids = [int(pid) for pid in children.read().split()]
+    except OSError:
+        return [master_pid]
+    return pids or [master_pid]
+
+
+def sample_rss(pids):
+    values = [value for value in (read_rss_kb(pid) for pid in pids) if value is not None]
+    if not values:
+        return {'rss_max_kb': None, 'rss_total_kb': None}
+    return {'rss_max_kb': max(values), 'rss_total_kb': sum(values)}
+
+
+def expand_path(path):
+    today = datetime.now().date()
+    return path.format(today=today.isoformat(), month_ago=(today.fromordinal(today.toordinal() - 30)).isoformat())
+
+
+def run_client(scenarios, args):
+    import app as adr_app
+
+    clients = {}
+    for role, (username, password) in credentials(args).items():
+        client = adr_app.app.test_client()
+        client.post('/login', data={'username': username, 'password': password})
+        with client.session_transaction() as session:
+            if session.get('role') != role:
+                raise SystemExit(f'Could not log in as {role} {username!r}')
+        clients[role] = client
+
+    results = []
+    pid = os.getpid()
+    for name, role, path, heavy in scenarios:
+        client = clients[role]
+        total = args.heavy_requests if heavy else args.requests
+        for _ in range(args.warmup):
+            client.get(expand_path(path)).close()
+
+        rss_before = read_rss_kb(pid)
+        latencies = []
+        errors = 0
+        bytes_read = 0
+        wall_started = time.perf_counter()
+        for _ in range(total):
+            started = time.perf_counter()
+            response = client.get(expand_path(path))
+            body = response.get_data()
+            latencies.append(time.perf_counter() - started)
+            bytes_read += len(body)
+            if response.status_code >= 400 or response.status_code == 302:
+                errors += 1
+            response.close()
+        wall = time.perf_counter() - wall_started
+        rss = {'rss_before_kb': rss_before, 'rss_after_kb': read_rss_kb(pid)}
+        results.append(summarize(name, 'client', latencies, errors, wall, bytes_read, rss))
+        print_result(results[-1])
+    return results
+
+
+class HttpSession:
+    def __init__(self, base_url, username, password, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+        with self.opener.open(f'{self.base_url}/login', data=data, timeout=timeout) as response:
+            response.read()
+            if '/login' in response.geturl():
+                raise SystemExit(f'Could not log in as {username!r} at {self.base_url}')
+
+    def get(self, path):
+        return self.request(path)
+
+    def request(self, path, data=None, headers=None):
+        request = urllib.request.Request(f'{self.base_url}{path}', data=data, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                body = response.read()
+                failed = '/login' in response.geturl()
+                return len(body), failed
+        except (urllib.error.URLError, OSError):
+            return 0, True
+
+
+def run_http(scenarios, args):
+    local = threading.local()
+    logins = credentials(args)
+
+    def session_for(role):
+        sessions = getattr(local, 'sessions', None)
+        if sessions is None:
+            sessions = local.sessions = {}
+        if role not in sessions:
+            username, password = logins[role]
+            sessions[role] = HttpSession(args.url, username, password, args.timeout)
+        return sessions[role]
+
+    def one_request(role, path):
+        session = session_for(role)
+        started = time.perf_counter()
+        size, failed = session.get(expand_path(path))
+        return time.perf_counter() - started, size, failed
+
+    results = []
+    pids = worker_pids(args.server_pid) if args.server_pid else []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for name, role, path, heavy in scenarios:
+            total = args.heavy_requests if heavy else args.requests
+            # Warm every thread's login and the server's caches before timing.
+            list(pool.map(lambda _: one_request(role, path), range(max(args.warmup, args.concurrency))))
+
+            rss_before = sample_rss(pids) if pids else {}
+            wall_started = time.perf_counter()
+            outcomes = list(pool.map(lambda _: one_request(role, path), range(total)))
+            wall = time.perf_counter() - wall_started
+
+            rss = {}
+            if pids:
+                after = sample_rss(worker_pids(args.server_pid))
+                rss = {
+                    'rss_before_max_kb': rss_before['rss_max_kb'],
+                    'rss_after_max_kb': after['rss_max_kb'],
+                    'rss_after_total_kb': after['rss_total_kb'],
+                }
+            latencies = [outcome[0] for outcome in outcomes]
+            errors = sum(1 for outcome in outcomes if outcome[2])
+            bytes_read = sum(outcome[1] for outcome in outcomes)
+            result = summarize(name, 'http', latencies, errors, wall, bytes_read, rss)
+            result['concurrency'] = args.concurrency
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def credentials(args):
+    return {
+        'admin': (args.admin_username, args.admin_password),
+        'user': (args.user_username, args.user_password),
+    }
+
+
+def print_result(result):
+    print(
+        f"{result['mode']:6} {result['endpoint']:22} n={result['requests']:<5} err={result['errors']:<3} "
+        f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+        f"rps={result['throughput_rps']}",
+        flush=True,
+    )
+
+
+def dataset_meta(database_url):
+    if not database_url:
+        return {}
+    try:
+        conn = psycopg2.connect(database_url)
+    except psycopg2.Error:
+        return {}
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            SELECT relname, reltuples::bigint FROM pg_class
+            WHERE relname IN ('adr', 'users', 'activity_logs', 'drugs') AND relkind IN ('r', 'p')
+            '''
+        )
+        return {f'{name}_rows': rows for name, rows in cursor.fetchall()}
+    finally:
+        conn.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as source:
+        baseline = {(row['mode'], row['endpoint']): row for row in json.load(source)['results']}
+    print(f'\nAgainst {baseline_path} (p95, negative is faster):')
+    for row in results:
+        before = baseline.get((row['mode'], row['endpoint']))
+        if not before or not before.get('p95_ms') or row['p95_ms'] is None:
+            continue
+        change = (row['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        print(f"  {row['mode']:6} {row['endpoint']:22} {before['p95_ms']:>9}ms -> {row['p95_ms']:>9}ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time the ADR routes. Run from the repo root: python -m bench.run',
+    )
+    parser.add_argument('--mode', choices=['client', 'http', 'both'], default='client')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL for --mode http.')
+    parser.add_argument('--server-pid', type=int, help='gunicorn master pid; worker RSS is sampled from its children.')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint.')
+    parser.add_argument('--heavy-requests', type=int, default=3, help='Timed requests for export endpoints.')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--only', action='append', help='Endpoint name to run; repeatable.')
+    parser.add_argument('--skip-heavy', action='store_true', help='Leave out the export endpoints.')
+    parser.add_argument('--admin-username', default=os.environ.get('ADMIN_USERNAME', 'admin'))
+    parser.add_argument('--admin-password', default=os.environ.get('ADMIN_PASSWORD', 'admin1234'))
+    parser.add_argument('--user-username', default='bench_user_2')
+    parser.add_argument('--user-password', default='benchpass')
+    parser.add_argument('--label', default='', help='Free-form tag stored with the results.')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier --output file to diff p95 latencies against.')
+    args = parser.parse_args(argv)
+
+    scenarios = [
+        scenario for scenario in SCENARIOS
+        if (not args.only or scenario[0] in args.only) and not (args.skip_heavy and scenario[3])
+    ]
+    if not scenarios:
+        parser.error('no endpoints selected')
+
+    results = []
+    if args.mode in ('client', 'both'):
+        results.extend(run_client(scenarios, args))
+    if args.mode in ('http', 'both'):
+        results.extend(run_http(scenarios, args))
+
+    report = {
+        'meta': {
+            'label': args.label,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'requests': args.requests,
+            'heavy_requests': args.heavy_requests,
+            'concurrency': args.concurrency,
+            **dataset_meta(os.environ.get('DATABASE_URL')),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump(report, target, indent=2)
+        print(f'Wrote {args.output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from bench.generate import DRUGS, REACTIONS, SEVERITIES
+from bench.run import HttpSession
+
+NAME_PREFIX = 'bench-submit'
+
+
+def make_reports(count, seed, tag):
+    rng = random.Random(seed)
+    # A unique reaction per report keeps the duplicate check from rejecting repeats.
+    return [
+        {
+            'name': f'{NAME_PREFIX} {tag} {index}',
+            'age': rng.randint(1, 95),
+            'drug': rng.choice(DRUGS),
+            'reaction': rng.choice(REACTIONS) + f' #{tag}-{seed}-{index}',
+            'severity': rng.choice(SEVERITIES),
+        }
+        for index in range(count)
+    ]
+
+
+def batches(reports, size):
+    return [reports[start:start + size] for start in range(0, len(reports), size)]
+
+
+def client_session(args):
+    import app as adr_app
+
+    client = adr_app.app.test_client()
+    client.post('/login', data={'username': args.username, 'password': args.password})
+    with client.session_transaction() as session:
+        if not session.get('user_id'):
+            raise SystemExit(f'Could not log in as {args.username!r}')
+
+    def form(report):
+        response = client.post('/add', data=report)
+        response.close()
+        return response.status_code != 302
+
+    def batch(reports):
+        response = client.post('/api/reports/batch', json=reports)
+        failed = response.status_code >= 400 or response.get_json()['created'] != len(reports)
+        response.close()
+        return failed
+
+    return form, batch
+
+
+def http_session(args):
+    local = threading.local()
+
+    def session():
+        # urllib openers are not thread-safe; one logged-in session per thread.
+        if getattr(local, 'session', None) is None:
+            local.session = HttpSession(args.url, args.username, args.password, args.timeout)
+        return local.session
+
+    def form(report):
+        _, failed = session().request('/add', data=urllib.parse.urlencode(report).encode())
+        return failed
+
+    def batch(reports):
+        _, failed = session().request(
+            '/api/reports/batch', data=json.dumps(reports).encode(), headers={'Content-Type': 'application/json'},
+        )
+        return failed
+
+    return form, batch
+
+
+def timed(name, send, items, reports, concurrency):
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            failures = sum(pool.map(send, items))
+    else:
+        failures = sum(send(item) for item in items)
+    wall = time.perf_counter() - started
+    result = {
+        'path': name,
+        'requests': len(items),
+        'reports': reports,
+        'failed_requests': failures,
+        'seconds': round(wall, 3),
+        'reports_per_second': round(reports / wall, 1) if wall else None,
+        'ms_per_request': round(wall / len(items) * 1000, 2) if items else None,
+    }
+    print(
+        f"{name:6} requests={result['requests']:<6} reports={reports:<6} failed={failures:<4} "
+        f"{result['seconds']}s  {result['reports_per_second']} reports/s",
+        flush=True,
+    )
+    return result
+
+
+def cleanup(database_url):
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM adr WHERE name LIKE %s', (NAME_PREFIX + ' %',))
+        conn.commit()
+        print(f'Removed {cursor.rowcount} benchmark reports.')
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare report submission through the /add form and the batch JSON API. '
+                    'Run from the repo root: python -m bench.submit',
+    )
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL for --mode http.')
+    parser.add_argument('--reports', type=int, default=1000, help='Reports submitted through each path.')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=int(time.time()))
+    parser.add_argument('--username', default='bench_user_2')
+    parser.add_argument('--password', default='benchpass')
+    parser.add_argument('--keep', action='store_true', help='Leave the submitted reports in the database.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    form, batch = (client_session if args.mode == 'client' else http_session)(args)
+    form_reports = make_reports(args.reports, args.seed, 'form')
+    batch_reports = make_reports(args.reports, args.seed, 'batch')
+    results = [
+        timed('form', form, form_reports, args.reports, args.concurrency),
+        timed('batch', batch, batches(batch_reports, args.batch_size), args.reports, args.concurrency),
+    ]
+    if results[0]['reports_per_second'] and results[1]['reports_per_second']:
+        print(f"batch/form throughput: {results[1]['reports_per_second'] / results[0]['reports_per_second']:.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as target:
+            json.dump({'mode': args.mode, 'batch_size': args.batch_size, 'results': results}, target, indent=2)
+        print(f'Wrote {args.output}')
+    if not args.keep and os.environ.get('DATABASE_URL'):
+        cleanup(os.environ['DATABASE_URL'])
+
+
+if __name__ == '__main__':
+    main()
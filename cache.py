@@ -0,0 +1,133 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionedCache:
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidations': 0, 'evictions': 0, 'stale_discards': 0}
+
+    def _version(self, scope):
+        return self._generation, self._versions.get(scope, 0)
+
+    def get(self, scope, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is not None:
+                version, expires_at, value = entry
+                if version == self._version(scope) and expires_at > now:
+                    self._entries.move_to_end((scope, key))
+                    self._stats['hits'] += 1
+                    return True, value
+                del self._entries[(scope, key)]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return False, None
+
+    def get_or_compute(self, scope, key, compute):
+        found, value = self.get(scope, key)
+        if found:
+            return value
+        return self.fill(scope, key, compute)
+
+    def fill(self, scope, key, compute):
+        with self._lock:
+            version = self._version(scope)
+        value = compute()
+
+        with self._lock:
+            # A write landed while we were computing; serve the value but do not cache it.
+            if version != self._version(scope):
+                self._stats['stale_discards'] += 1
+                return value
+            self._entries[(scope, key)] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((scope, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, scope=None):
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if scope is None:
+                self._generation += 1
+                self._entries.clear()
+                return
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == scope]:
+                del self._entries[entry_key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0, 'oversize': 0}
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, scope, key):
+        if key is None or not self.enabled():
+            return None
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end((scope, key))
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, scope, key, value):
+        if key is None or not self.enabled():
+            return
+        size = sys.getsizeof(value)
+        with self._lock:
+            if size > self.max_bytes:
+                self._stats['oversize'] += 1
+                return
+            previous = self._entries.pop((scope, key), None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[(scope, key)] = (value, size)
+            self._bytes += size
+            self._stats['stores'] += 1
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats['evictions'] += 1
+
+    def invalidate(self, scope=None):
+        with self._lock:
+            self._stats['invalidations'] += 1
+            for entry_key in [k for k in self._entries if scope is None or k[0] == scope]:
+                self._bytes -= self._entries.pop(entry_key)[1]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,439 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+import metrics
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+DATABASE_READ_URLS = [url.strip() for url in os.environ.get('DATABASE_READ_URLS', '').split(',') if url.strip()]
+REPLICA_POOL_MAX = int(os.environ.get('DB_REPLICA_POOL_MAX', str(POOL_MAX)))
+REPLICA_POOL_TIMEOUT = float(os.environ.get('DB_REPLICA_POOL_TIMEOUT', '2'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '10'))
+REPLICA_RETRY_AFTER = float(os.environ.get('DB_REPLICA_RETRY_AFTER', '30'))
+
+# Replica lag in seconds; zero when the replica has replayed everything it has received,
+# so an idle primary does not make a caught-up replica look stale.
+REPLICA_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+_prefer_replica = contextvars.ContextVar('db_prefer_replica', default=False)
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=30.0, check_interval=30.0):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError('invalid pool size')
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._stats = {
+            'connects': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'liveness_failures': 0,
+            'resets': 0,
+            'discarded': 0,
+            'max_in_use': 0,
+        }
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=metrics.cursor_factory())
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_alive(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError('connection pool is closed')
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolError(f'no database connection available after {self.timeout:g}s')
+                if not waited:
+                    waited = True
+                    self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and not self._is_alive(conn, last_used):
+                with self._cond:
+                    self._stats['liveness_failures'] += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        wait = time.monotonic() - started
+        with self._cond:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['wait_seconds_total'] += wait
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], wait)
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._in_use)
+        return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                    with self._cond:
+                        self._stats['resets'] += 1
+                except psycopg2.Error:
+                    broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or conn.closed or self._closed:
+                self._size -= 1
+                self._stats['discarded'] += 1
+                discard = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                discard = False
+            self._cond.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
+        checkouts = stats['checkouts']
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts if checkouts else 0.0
+        return stats
+
+
+def replica_name(url):
+    try:
+        params = psycopg2.extensions.parse_dsn(url)
+    except psycopg2.ProgrammingError:
+        return 'replica'
+    return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+
+class ReplicaRouter:
+    def __init__(self, urls, check_interval=5.0, max_lag=10.0, retry_after=30.0, pool_max=10, pool_timeout=2.0):
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.pool_max = pool_max
+        self.pool_timeout = pool_timeout
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._replicas = [
+            {
+                'name': replica_name(url),
+                'url': url,
+                'pool': None,
+                'healthy': True,
+                'down_until': 0.0,
+                'checked_at': 0.0,
+                'lag_seconds': None,
+                'last_error': None,
+                'checkouts': 0,
+                'failures': 0,
+            }
+            for url in urls
+        ]
+        self._stats = {'replica_checkouts': 0, 'primary_fallbacks': 0}
+
+    def _mark_down(self, replica, reason):
+        with self._lock:
+            replica['healthy'] = False
+            replica['down_until'] = time.monotonic() + self.retry_after
+            replica['checked_at'] = 0.0
+            replica['last_error'] = reason
+            replica['failures'] += 1
+        metrics.observe_replica_failure(replica['name'], reason.split(':')[0])
+
+    def _pool(self, replica):
+        with self._lock:
+            if replica['pool'] is None:
+                # Replica pools start empty; a replica that is down at boot must not stop the worker.
+                replica['pool'] = ConnectionPool(
+                    replica['url'],
+                    minconn=0,
+                    maxconn=self.pool_max,
+                    timeout=self.pool_timeout,
+                    check_interval=POOL_CHECK_INTERVAL,
+                )
+            return replica['pool']
+
+    def _check(self, replica, conn):
+        now = time.monotonic()
+        if now - replica['checked_at'] < self.check_interval:
+            return replica['healthy']
+        with conn.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = float(cursor.fetchone()[0])
+        conn.rollback()
+        with self._lock:
+            replica['checked_at'] = now
+            replica['lag_seconds'] = lag
+            replica['healthy'] = lag <= self.max_lag
+        return replica['healthy']
+
+    def checkout(self):
+        # Round-robin over replicas that are not backing off; returns (replica, pool, conn) or None.
+        now = time.monotonic()
+        candidates = [replica for replica in self._replicas if replica['healthy'] or replica['down_until'] <= now]
+        if not candidates:
+            return None
+        start = next(self._turn)
+        for offset in range(len(candidates)):
+            replica = candidates[(start + offset) % len(candidates)]
+            try:
+                pool = self._pool(replica)
+                conn = pool.getconn()
+            except PoolError:
+                # Busy, not broken: let this read fall through without taking the replica out.
+                continue
+            except psycopg2.Error as error:
+                self._mark_down(replica, f'connect: {error}'.strip())
+                continue
+            try:
+                healthy = self._check(replica, conn)
+            except psycopg2.Error as error:
+                pool.putconn(conn, broken=True)
+                self._mark_down(replica, f'check: {error}'.strip())
+                continue
+            if not healthy:
+                pool.putconn(conn)
+                self._mark_down(replica, f"lag: {replica['lag_seconds']:.1f}s")
+                continue
+            with self._lock:
+                replica['checkouts'] += 1
+                self._stats['replica_checkouts'] += 1
+            return replica, pool, conn
+        return None
+
+    def fell_back(self):
+        with self._lock:
+            self._stats['primary_fallbacks'] += 1
+
+    def closeall(self):
+        for replica in self._replicas:
+            if replica['pool'] is not None:
+                replica['pool'].closeall()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            replicas = [
+                {
+                    'name': replica['name'],
+                    'healthy': replica['healthy'],
+                    'retry_in_seconds': max(replica['down_until'] - now, 0.0) if not replica['healthy'] else 0.0,
+                    'lag_seconds': replica['lag_seconds'],
+                    'last_error': replica['last_error'],
+                    'checkouts': replica['checkouts'],
+                    'failures': replica['failures'],
+                }
+                for replica in self._replicas
+            ]
+            stats = dict(self._stats)
+        for entry, replica in zip(replicas, self._replicas):
+            entry['pool'] = replica['pool'].stats() if replica['pool'] is not None else None
+        stats['replicas'] = replicas
+        return stats
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_router = None
+_router_pid = None
+
+
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            if not DATABASE_URL:
+                raise RuntimeError('DATABASE_URL is not set')
+            # A pool inherited across fork shares sockets with the parent; never reuse it.
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                minconn=POOL_MIN,
+                maxconn=POOL_MAX,
+                timeout=POOL_TIMEOUT,
+                check_interval=POOL_CHECK_INTERVAL,
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def get_router():
+    global _router, _router_pid
+    if not DATABASE_READ_URLS:
+        return None
+    pid = os.getpid()
+    if _router is not None and _router_pid == pid:
+        return _router
+
+    with _pool_lock:
+        if _router is None or _router_pid != pid:
+            _router = ReplicaRouter(
+                DATABASE_READ_URLS,
+                check_interval=REPLICA_CHECK_INTERVAL,
+                max_lag=REPLICA_MAX_LAG,
+                retry_after=REPLICA_RETRY_AFTER,
+                pool_max=REPLICA_POOL_MAX,
+                pool_timeout=REPLICA_POOL_TIMEOUT,
+            )
+            _router_pid = pid
+    return _router
+
+
+def replicas_configured():
+    return bool(DATABASE_READ_URLS)
+
+
+def close_pool():
+    global _pool, _pool_pid, _router, _router_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        if _router is not None and _router_pid == os.getpid():
+            _router.closeall()
+        _pool = None
+        _pool_pid = None
+        _router = None
+        _router_pid = None
+
+
+def pool_stats():
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
+
+
+def replica_stats():
+    if _router is None or _router_pid != os.getpid():
+        return None
+    return _router.stats()
+
+
+def prefer_replica(enabled=True):
+    # Returns a token for reset_replica_preference(); threads started with a copied context inherit it.
+    return _prefer_replica.set(enabled)
+
+
+def reset_replica_preference(token):
+    _prefer_replica.reset(token)
+
+
+@contextmanager
+def connection(primary=False):
+    # Reads go to a replica only when the caller opted in; anything that writes passes primary=True
+    # or runs outside a replica-preferring context.
+    started = time.perf_counter()
+    router = None if primary or not _prefer_replica.get() else get_router()
+    routed = router.checkout() if router is not None else None
+    if routed is not None:
+        replica, pool, conn = routed
+        target = replica['name']
+    else:
+        if router is not None:
+            router.fell_back()
+        pool = get_pool()
+        conn = pool.getconn()
+        target = 'primary'
+    metrics.observe_connection_wait(time.perf_counter() - started)
+    metrics.observe_route(target)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
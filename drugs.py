@@ -0,0 +1,233 @@
+import os
+import re
+import threading
+import time
+
+import db
+import versions
+
+DRUG_NAME_MAX = 120
+DRUG_BACKFILL_BATCH = int(os.environ.get('DRUG_BACKFILL_BATCH', '10000'))
+
+_WHITESPACE_RE = re.compile(r'\s+', re.ASCII)
+
+# Must match normalize_drug() so rows resolved in SQL and in Python share keys.
+DRUG_KEY_SQL = r"LEFT(lower(btrim(regexp_replace({column}, '\s+', ' ', 'g'))), 120)"
+
+
+def normalize_drug(value):
+    return _WHITESPACE_RE.sub(' ', str(value or '')).strip(' ').lower()[:DRUG_NAME_MAX]
+
+
+def create_drugs(cursor, names_by_key):
+    keys = list(names_by_key)
+    cursor.execute(
+        '''
+        INSERT INTO drugs (name, name_key)
+        SELECT t.name, t.name_key
+        FROM unnest(%s::text[], %s::text[]) AS t(name, name_key)
+        WHERE NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.synonym_key = t.name_key)
+        ON CONFLICT (name_key) DO NOTHING
+        ''',
+        ([names_by_key[key][:DRUG_NAME_MAX] for key in keys], keys),
+    )
+    cursor.execute(
+        '''
+        INSERT INTO drug_synonyms (synonym_key, drug_id)
+        SELECT name_key, id FROM drugs WHERE name_key = ANY(%s)
+        ON CONFLICT (synonym_key) DO NOTHING
+        ''',
+        (keys,),
+    )
+    cursor.execute('SELECT synonym_key, drug_id FROM drug_synonyms WHERE synonym_key = ANY(%s)', (keys,))
+    return dict(cursor.fetchall())
+
+
+class DrugDictionary:
+    def __init__(self, ttl=300.0, check_interval=5.0):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = {}
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = None
+        self._stats = {'hits': 0, 'misses': 0, 'created': 0, 'reloads': 0, 'version_checks': 0}
+
+    def _load(self):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            # Version first: a change committed in between only costs one extra reload later.
+            found, _ = versions.fetch_versions(cursor, [versions.DRUGS_SCOPE])
+            cursor.execute(
+                '''
+                SELECT s.synonym_key, s.drug_id, d.name
+                FROM drug_synonyms s
+                JOIN drugs d ON d.id = s.drug_id
+                '''
+            )
+            rows = cursor.fetchall()
+        ids = {}
+        names = {}
+        for key, drug_id, name in rows:
+            ids[key] = drug_id
+            names[drug_id] = name
+        with self._lock:
+            self._ids = ids
+            self._names = names
+            self._version = found[0][1]
+            self._loaded_at = self._checked_at = time.monotonic()
+            self._stats['reloads'] += 1
+
+    def _changed(self):
+        with db.connection() as conn:
+            found, _ = versions.fetch_versions(conn.cursor(), [versions.DRUGS_SCOPE])
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._stats['version_checks'] += 1
+        return found[0][1] != self._version
+
+    def _fresh(self):
+        # Another worker's synonym edit bumps the drugs data version; a cheap version read every few
+        # seconds picks it up, and the TTL remains a backstop.
+        now = time.monotonic()
+        loaded_at = self._loaded_at
+        if loaded_at is None or now - loaded_at > self.ttl:
+            self._load()
+        elif now - self._checked_at > self.check_interval and self._changed():
+            self._load()
+        return self._ids
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def resolve_ids(self, names):
+        keys = [normalize_drug(name) for name in names]
+        ids = self._fresh()
+        missing = {}
+        for key, name in zip(keys, names):
+            if key and key not in ids and key not in missing:
+                missing[key] = _WHITESPACE_RE.sub(' ', str(name)).strip(' ')
+
+        with self._lock:
+            self._stats['hits'] += len(keys) - len(missing)
+            self._stats['misses'] += len(missing)
+
+        if missing:
+            # New dictionary entries commit on their own connection, so an ID cached
+            # here never points at a row that the caller's transaction rolled back.
+            with db.connection(primary=True) as conn:
+                created = create_drugs(conn.cursor(), missing)
+                conn.commit()
+            with self._lock:
+                self._ids.update(created)
+                for key, drug_id in created.items():
+                    self._names.setdefault(drug_id, missing[key])
+                self._stats['created'] += len(created)
+        return [self._ids.get(key) if key else None for key in keys]
+
+    def resolve_id(self, name):
+        return self.resolve_ids([name])[0]
+
+    def matching_ids(self, term):
+        key = normalize_drug(term)
+        ids = self._fresh()
+        if key in ids:
+            return [ids[key]]
+        return sorted({drug_id for synonym, drug_id in list(ids.items()) if key in synonym})
+
+    def name(self, drug_id):
+        self._fresh()
+        return self._names.get(drug_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['synonyms'] = len(self._ids)
+            stats['drugs'] = len(self._names)
+        stats['ttl'] = self.ttl
+        stats['check_interval'] = self.check_interval
+        stats['version'] = self._version
+        return stats
+
+
+dictionary = DrugDictionary(
+    ttl=float(os.environ.get('DRUG_DICTIONARY_TTL', '300')),
+    check_interval=float(os.environ.get('DRUG_DICTIONARY_CHECK_INTERVAL', '5')),
+)
+
+
+def backfill_drug_ids(cursor, after_id=0, up_to_id=None):
+    key_sql = DRUG_KEY_SQL.format(column='a.drug')
+    range_sql = 'a.drug_id IS NULL AND a.id > %s' + (' AND a.id <= %s' if up_to_id is not None else '')
+    params = (after_id, up_to_id) if up_to_id is not None else (after_id,)
+
+    cursor.execute(
+        f'''
+        INSERT INTO drugs (name, name_key)
+        SELECT DISTINCT ON (key) LEFT(btrim(regexp_replace(drug, '\\s+', ' ', 'g')), 120), key
+        FROM (SELECT a.drug, {key_sql} AS key FROM adr a WHERE {range_sql}) pending
+        WHERE key <> ''
+          AND NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.synonym_key = pending.key)
+        ORDER BY key, drug
+        ON CONFLICT (name_key) DO NOTHING
+        ''',
+        params,
+    )
+    cursor.execute(
+        '''
+        INSERT INTO drug_synonyms (synonym_key, drug_id)
+        SELECT d.name_key, d.id FROM drugs d
+        WHERE NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.synonym_key = d.name_key)
+        ON CONFLICT (synonym_key) DO NOTHING
+        '''
+    )
+    cursor.execute(
+        f'''
+        UPDATE adr a SET drug_id = s.drug_id
+        FROM drug_synonyms s
+        WHERE {range_sql} AND s.synonym_key = {key_sql}
+        ''',
+        params,
+    )
+    return cursor.rowcount
+
+
+def add_synonym(cursor, synonym, canonical):
+    synonym_key = normalize_drug(synonym)
+    canonical_key = normalize_drug(canonical)
+    if not synonym_key or not canonical_key:
+        raise ValueError('Synonym and canonical drug name are required.')
+
+    drug_id = create_drugs(cursor, {canonical_key: canonical.strip()})[canonical_key]
+    cursor.execute('SELECT drug_id FROM drug_synonyms WHERE synonym_key = %s', (synonym_key,))
+    row = cursor.fetchone()
+    previous_id = row[0] if row else None
+    cursor.execute(
+        '''
+        INSERT INTO drug_synonyms (synonym_key, drug_id) VALUES (%s, %s)
+        ON CONFLICT (synonym_key) DO UPDATE SET drug_id = EXCLUDED.drug_id
+        ''',
+        (synonym_key, drug_id),
+    )
+
+    moved = 0
+    if previous_id and previous_id != drug_id:
+        cursor.execute(
+            f'UPDATE adr a SET drug_id = %s WHERE a.drug_id = %s AND {DRUG_KEY_SQL.format(column="a.drug")} = %s',
+            (drug_id, previous_id, synonym_key),
+        )
+        moved = cursor.rowcount
+        # An auto-created entry left without any synonym is merged away entirely.
+        cursor.execute(
+            '''
+            DELETE FROM drugs d
+            WHERE d.id = %s
+              AND NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.drug_id = d.id)
+              AND NOT EXISTS (SELECT 1 FROM adr a WHERE a.drug_id = d.id)
+            ''',
+            (previous_id,),
+        )
+    return drug_id, moved
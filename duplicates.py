@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+DUPLICATE_MODES = {'off', 'flag', 'reject'}
+DUPLICATE_MODE = os.environ.get('DUPLICATE_MODE', 'flag').strip().lower()
+if DUPLICATE_MODE not in DUPLICATE_MODES:
+    DUPLICATE_MODE = 'flag'
+DUPLICATE_WINDOW_DAYS = int(os.environ.get('DUPLICATE_WINDOW_DAYS', '30'))
+DUPLICATE_LOCK_CLASS = 4242002
+# Fingerprints share this many advisory lock keys, so a large import holds a bounded number of locks.
+DUPLICATE_LOCK_SLOTS = int(os.environ.get('DUPLICATE_LOCK_SLOTS', '1024'))
+
+_WHITESPACE_RE = re.compile(r'\s+', re.ASCII)
+
+
+def normalize_text(value):
+    return _WHITESPACE_RE.sub(' ', str(value)).strip(' ').lower()
+
+
+def fingerprint(user_id, drug, reaction, age):
+    key = f'{user_id or 0}|{normalize_text(drug)}|{normalize_text(reaction)}|{int(age)}'
+    return hashlib.md5(key.encode('utf-8')).digest()
+
+
+class DuplicateWindow:
+    def __init__(self, max_entries=50000, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'stale': 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                adr_id, expires_at = entry
+                if expires_at > now:
+                    self._stats['hits'] += 1
+                    return adr_id
+                del self._entries[key]
+            self._stats['misses'] += 1
+            return None
+
+    def add(self, key, adr_id):
+        with self._lock:
+            self._entries[key] = (adr_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def discard(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats['stale'] += 1
+
+    def discard_report(self, adr_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] == adr_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats.update(capacity=self.max_entries, ttl=self.ttl, mode=DUPLICATE_MODE, window_days=DUPLICATE_WINDOW_DAYS)
+        return stats
+
+
+window = DuplicateWindow(
+    max_entries=int(os.environ.get('DUPLICATE_CACHE_SIZE', '50000')),
+    ttl=float(os.environ.get('DUPLICATE_CACHE_TTL', '600')),
+)
+
+
+def find_duplicate(cursor, user_id, drug, reaction, age):
+    key = fingerprint(user_id, drug, reaction, age)
+    adr_id = window.get(key)
+    if adr_id is not None:
+        # Another worker may have edited or deleted the report since it was cached; a primary-key
+        # probe is far cheaper than the fingerprint lookup it replaces.
+        cursor.execute(
+            '''
+            SELECT 1 FROM adr
+            WHERE id = %s AND fingerprint = adr_fingerprint(%s, %s, %s, %s)
+              AND created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+            ''',
+            (adr_id, user_id, drug, reaction, age, DUPLICATE_WINDOW_DAYS),
+        )
+        if cursor.fetchone() is not None:
+            return adr_id
+        window.discard(key)
+
+    # Held until commit so two workers cannot both miss and insert the same report.
+    cursor.execute(
+        'SELECT pg_advisory_xact_lock(%s, mod(hashtext(adr_fingerprint(%s, %s, %s, %s)::text), %s))',
+        (DUPLICATE_LOCK_CLASS, user_id, drug, reaction, age, DUPLICATE_LOCK_SLOTS),
+    )
+    cursor.execute(
+        '''
+        SELECT id FROM adr
+        WHERE fingerprint = adr_fingerprint(%s, %s, %s, %s)
+          AND created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+        ORDER BY created_at DESC
+        LIMIT 1
+        ''',
+        (user_id, drug, reaction, age, DUPLICATE_WINDOW_DAYS),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    window.add(key, row[0])
+    return row[0]
+
+
+def remember(user_id, drug, reaction, age, adr_id):
+    window.add(fingerprint(user_id, drug, reaction, age), adr_id)
+
+
+def find_chunk_duplicates(cursor, frame, user_id):
+    columns = (frame['drug'].tolist(), frame['reaction'].tolist(), [int(age) for age in frame['age']])
+    # Same locks as find_duplicate, taken in key order so two overlapping chunks cannot deadlock.
+    cursor.execute(
+        '''
+        SELECT pg_advisory_xact_lock(%s, slot)
+        FROM (
+            SELECT DISTINCT mod(hashtext(adr_fingerprint(%s, t.drug, t.reaction, t.age)::text), %s) AS slot
+            FROM unnest(%s::text[], %s::text[], %s::int[]) AS t(drug, reaction, age)
+            ORDER BY slot
+        ) slots
+        ''',
+        (DUPLICATE_LOCK_CLASS, user_id, DUPLICATE_LOCK_SLOTS, *columns),
+    )
+    # One indexed probe per chunk; rows are matched back by their position in the frame.
+    cursor.execute(
+        '''
+        SELECT t.position, match.id
+        FROM unnest(%s::text[], %s::text[], %s::int[]) WITH ORDINALITY AS t(drug, reaction, age, position)
+        CROSS JOIN LATERAL (
+            SELECT a.id FROM adr a
+            WHERE a.fingerprint = adr_fingerprint(%s, t.drug, t.reaction, t.age)
+              AND a.created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+            ORDER BY a.created_at DESC
+            LIMIT 1
+        ) match
+        ''',
+        (*columns, user_id, DUPLICATE_WINDOW_DAYS),
+    )
+    return {int(position) - 1: adr_id for position, adr_id in cursor.fetchall()}
@@ -0,0 +1,135 @@
+import csv
+import os
+import tempfile
+import zlib
+from io import StringIO
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '2000'))
+EXPORT_TMP_DIR = os.environ.get('EXPORT_TMP_DIR') or None
+EXPORT_HEADERS = ['ID', 'Patient Name', 'Age', 'Drug', 'Reaction', 'Severity', 'Reported At', 'Owner']
+
+
+def format_export_row(row):
+    return [
+        row[0], row[1], row[2], row[3], row[4], row[5],
+        row[6].strftime('%Y-%m-%d %H:%M:%S') if row[6] else '',
+        row[7],
+    ]
+
+
+def iter_row_batches(query, params, batch_size=EXPORT_BATCH_SIZE):
+    with db.connection() as conn:
+        with conn.cursor(name='adr_export') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, tuple(params))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def open_row_batches(query, params, batch_size=EXPORT_BATCH_SIZE):
+    # Pull the first batch eagerly so query errors surface before any response bytes are sent.
+    batches = iter_row_batches(query, params, batch_size)
+    first = next(batches, None)
+
+    def chained():
+        try:
+            if first is not None:
+                yield first
+                yield from batches
+        finally:
+            batches.close()
+
+    return chained()
+
+
+def csv_chunks(batches):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+
+    for rows in batches:
+        for row in rows:
+            writer.writerow(format_export_row(row))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _xlsx_value(value):
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def write_xlsx(batches, target):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('ADR Reports')
+    sheet.append(EXPORT_HEADERS)
+    for rows in batches:
+        for row in rows:
+            sheet.append([_xlsx_value(value) for value in row[:len(EXPORT_HEADERS)]])
+    workbook.save(target)
+
+
+def parquet_available():
+    return pq is not None
+
+
+def parquet_schema():
+    return pa.schema([
+        ('ID', pa.int64()),
+        ('Patient Name', pa.string()),
+        ('Age', pa.int64()),
+        ('Drug', pa.string()),
+        ('Reaction', pa.string()),
+        ('Severity', pa.string()),
+        ('Reported At', pa.timestamp('us')),
+        ('Owner', pa.string()),
+    ])
+
+
+def write_parquet(batches, target):
+    schema = parquet_schema()
+    with pq.ParquetWriter(target, schema, compression='snappy') as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            arrays = [pa.array(columns[index], type=field.type) for index, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def spool_export(write, batches):
+    # XLSX is a zip container written with seeks; spool on disk so memory stays bounded.
+    target = tempfile.TemporaryFile(dir=EXPORT_TMP_DIR)
+    try:
+        write(batches, target)
+        target.seek(0)
+    except BaseException:
+        target.close()
+        raise
+    return target
@@ -0,0 +1,43 @@
+import glob
+import os
+
+import psycopg2
+
+# A login waits on the password hasher's processes; threaded workers keep serving other requests
+# meanwhile, and passwords.PASSWORD_VERIFY_QUEUE caps how many threads may wait at once.
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+
+def on_starting(server):
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        # Worker snapshots from a previous run would otherwise be merged into new totals.
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+            os.remove(path)
+
+    # Runs once in the master before any worker forks, so schema changes never race.
+    if os.environ.get('MIGRATE_ON_START', '1') != '1':
+        return
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        server.log.warning('DATABASE_URL is not set; skipping migrations')
+        return
+
+    import migrations
+
+    conn = psycopg2.connect(database_url)
+    try:
+        applied = migrations.run_migrations(conn, log=server.log.info)
+    finally:
+        conn.close()
+    server.log.info('Schema at version %s (%s migration(s) applied)', migrations.LATEST_VERSION, len(applied))
+
+
+def worker_exit(server, worker):
+    import audit
+    import passwords
+
+    audit.writer.stop()
+    passwords.hasher.shutdown()
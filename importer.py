@@ -0,0 +1,184 @@
+import os
+from io import StringIO
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import drugs
+import duplicates
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '5000'))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '1000'))
+REPORT_FIELDS = ['name', 'age', 'drug', 'reaction', 'severity']
+FIELD_LIMITS = {'name': 120, 'drug': 120, 'severity': 50}
+COLUMN_ALIASES = {
+    'patient name': 'name',
+    'patient': 'name',
+    'patient age': 'age',
+    'drug name': 'drug',
+    'adverse reaction': 'reaction',
+}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def normalize_column(column):
+    key = str(column or '').strip().lower()
+    return COLUMN_ALIASES.get(key, key)
+
+
+def _prepare_frame(frame):
+    frame = frame.rename(columns=normalize_column)
+    missing = [field for field in REPORT_FIELDS if field not in frame.columns]
+    if missing:
+        raise ImportFormatError(f"Missing required column(s): {', '.join(missing)}")
+    return frame[REPORT_FIELDS]
+
+
+def iter_csv_chunks(stream, chunk_size):
+    reader = pd.read_csv(stream, dtype=str, keep_default_na=False, chunksize=chunk_size, encoding='utf-8-sig')
+    for chunk in reader:
+        yield _prepare_frame(chunk)
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def iter_xlsx_chunks(stream, chunk_size):
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [normalize_column(cell) for cell in header]
+        buffer = []
+        for row in rows:
+            buffer.append([_cell_text(value) for value in row])
+            if len(buffer) >= chunk_size:
+                yield _prepare_frame(pd.DataFrame(buffer, columns=columns))
+                buffer = []
+        if buffer:
+            yield _prepare_frame(pd.DataFrame(buffer, columns=columns))
+    finally:
+        workbook.close()
+
+
+def iter_chunks(stream, filename, chunk_size=IMPORT_CHUNK_SIZE):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return iter_csv_chunks(stream, chunk_size)
+    if extension in ('.xlsx', '.xlsm'):
+        return iter_xlsx_chunks(stream, chunk_size)
+    raise ImportFormatError('Upload a .csv or .xlsx file.')
+
+
+def validate_chunk(frame, first_row):
+    frame = frame.fillna('').astype(str).apply(lambda column: column.str.strip())
+
+    missing = (frame == '').any(axis=1)
+    age_text = frame['age']
+    age_valid = age_text.str.fullmatch(r'[+-]?\d+')
+    age = pd.to_numeric(age_text.where(age_valid), errors='coerce')
+    bad_age = ~missing & (age.isna() | (age < 0))
+
+    over_limit = {field: frame[field].str.len() > limit for field, limit in FIELD_LIMITS.items()}
+    too_long = pd.DataFrame(over_limit).any(axis=1)
+
+    invalid = missing | bad_age | too_long
+    errors = []
+    for position in invalid.to_numpy().nonzero()[0]:
+        messages = []
+        if missing.iat[position]:
+            messages.append('All ADR fields are required.')
+        elif bad_age.iat[position]:
+            messages.append('Age must be a valid non-negative number.')
+        for field, over in over_limit.items():
+            if over.iat[position]:
+                messages.append(f'{field.capitalize()} must be at most {FIELD_LIMITS[field]} characters.')
+        errors.append({'row': first_row + int(position), 'errors': messages})
+
+    valid = frame[~invalid].copy()
+    valid['age'] = age[~invalid].astype('int64')
+    return valid, errors
+
+
+def copy_reports(cursor, frame, user_id):
+    buffer = StringIO()
+    frame.insert(0, 'user_id', user_id)
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY adr ({', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def store_chunk(cursor, frame, user_id, first_row):
+    if duplicates.DUPLICATE_MODE == 'off':
+        copy_reports(cursor, frame, user_id)
+        return len(frame), 0, []
+
+    keys = pd.Series(
+        [duplicates.fingerprint(user_id, *values) for values in zip(frame['drug'], frame['reaction'], frame['age'])],
+        index=frame.index,
+    )
+    repeated = keys.duplicated()
+    imported = flagged = 0
+    errors = []
+    # Repeats within the chunk go second so the probe sees the first copy, already in this transaction.
+    for part in (frame[~repeated], frame[repeated]):
+        if part.empty:
+            continue
+        matches = duplicates.find_chunk_duplicates(cursor, part, user_id)
+        duplicate_of = pd.Series(
+            {part.index[position]: adr_id for position, adr_id in matches.items()},
+            index=part.index,
+            dtype='Int64',
+        )
+        flagged += len(matches)
+        if duplicates.DUPLICATE_MODE == 'reject':
+            for label, adr_id in duplicate_of.dropna().items():
+                errors.append({'row': first_row + int(label), 'errors': [f'Possible duplicate of report #{adr_id}.']})
+            part = part[duplicate_of.isna()]
+        else:
+            part = part.assign(duplicate_of=duplicate_of)
+        if not part.empty:
+            copy_reports(cursor, part.copy(), user_id)
+            imported += len(part)
+    return imported, flagged, errors
+
+
+def import_reports(conn, stream, filename, user_id, chunk_size=IMPORT_CHUNK_SIZE, before_commit=None):
+    cursor = conn.cursor()
+    summary = {'rows': 0, 'imported': 0, 'rejected': 0, 'duplicates': 0, 'errors': []}
+    # Row numbers follow the spreadsheet: the header is row 1.
+    next_row = 2
+
+    for chunk in iter_chunks(stream, filename, chunk_size):
+        chunk = chunk.reset_index(drop=True)
+        valid, errors = validate_chunk(chunk, next_row)
+        if not valid.empty:
+            valid['drug_id'] = pd.array(drugs.dictionary.resolve_ids(valid['drug'].tolist()), dtype='Int64')
+            imported, flagged, duplicate_errors = store_chunk(cursor, valid, user_id, next_row)
+            summary['imported'] += imported
+            summary['duplicates'] += flagged
+            errors = sorted(errors + duplicate_errors, key=lambda error: error['row'])
+        next_row += len(chunk)
+        summary['rows'] += len(chunk)
+        summary['rejected'] += len(errors)
+        room = IMPORT_MAX_ERRORS - len(summary['errors'])
+        if room > 0:
+            summary['errors'].extend(errors[:room])
+
+    if before_commit:
+        before_commit(conn, summary)
+    conn.commit()
+    return summary
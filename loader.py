@@ -0,0 +1,109 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import psycopg2
+
+import db
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_QUERY_WORKERS = int(os.environ.get('DASHBOARD_QUERY_WORKERS', '4'))
+DASHBOARD_QUERY_TIMEOUT = float(os.environ.get('DASHBOARD_QUERY_TIMEOUT', '10'))
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryLoader:
+    def __init__(self, max_workers=4, timeout=10.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stats = {
+            'loads': 0,
+            'queries': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'load_seconds_total': 0.0,
+            'load_seconds_max': 0.0,
+        }
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                # Executor threads do not survive fork; each worker builds its own.
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dashboard-query')
+                self._pid = pid
+        return self._executor
+
+    def _run_task(self, task):
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            if self.timeout > 0:
+                cursor.execute('SET LOCAL statement_timeout = %s', (int(self.timeout * 1000),))
+            try:
+                return task(cursor)
+            finally:
+                conn.rollback()
+
+    def run(self, tasks):
+        # Each task gets its own pooled connection; failed or slow tasks are reported, never raised.
+        started = time.perf_counter()
+        results = {}
+        errors = {}
+        if self.max_workers <= 1 or len(tasks) <= 1:
+            for name, task in tasks.items():
+                try:
+                    results[name] = self._run_task(task)
+                except psycopg2.Error as error:
+                    errors[name] = error
+        else:
+            executor = self._get_executor()
+            # A copied context keeps the request visible to the slow query log in pool threads.
+            futures = {
+                name: executor.submit(contextvars.copy_context().run, self._run_task, task)
+                for name, task in tasks.items()
+            }
+            deadline = started + self.timeout if self.timeout > 0 else None
+            for name, future in futures.items():
+                try:
+                    remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+                    results[name] = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    future.cancel()
+                    errors[name] = QueryTimeout(f'{name} did not finish within {self.timeout:g}s')
+                except psycopg2.Error as error:
+                    errors[name] = error
+
+        elapsed = time.perf_counter() - started
+        for name, error in errors.items():
+            logger.warning('Dashboard query %s failed: %s', name, error)
+        with self._lock:
+            self._stats['loads'] += 1
+            self._stats['queries'] += len(tasks)
+            self._stats['failures'] += len(errors)
+            self._stats['timeouts'] += sum(1 for error in errors.values() if isinstance(error, QueryTimeout))
+            self._stats['load_seconds_total'] += elapsed
+            self._stats['load_seconds_max'] = max(self._stats['load_seconds_max'], elapsed)
+        return results, errors
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(max_workers=self.max_workers, timeout=self.timeout)
+        stats['load_seconds_avg'] = stats['load_seconds_total'] / stats['loads'] if stats['loads'] else 0.0
+        return stats
+
+
+dashboard = QueryLoader(max_workers=DASHBOARD_QUERY_WORKERS, timeout=DASHBOARD_QUERY_TIMEOUT)
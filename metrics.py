@@ -0,0 +1,339 @@
+import bisect
+import glob
+import json
+import os
+import secrets
+import sys
+import tempfile
+import threading
+import time
+
+import psycopg2.extensions
+from flask import before_render_template, g, request, template_rendered
+
+import slowlog
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROW_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum; cumulated at render time.
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {label_values: list(series) for label_values, series in self._series.items()}
+
+    def render(self, series_by_labels):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(series_by_labels.items()):
+            pairs = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'{self.name}_bucket{_labels(pairs + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(pairs)} {series[-1]!r}')
+            lines.append(f'{self.name}_count{_labels(pairs)} {cumulative}')
+        return lines
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    def render(self, series_by_labels):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(series_by_labels.items()):
+            lines.append(f'{self.name}{_labels(list(zip(self.labels, label_values)))} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+REQUEST_SECONDS = Histogram(
+    'adr_http_request_duration_seconds', 'Time spent serving a request, including streamed bodies.',
+    ('endpoint', 'method', 'status'),
+)
+QUERY_SECONDS = Histogram(
+    'adr_db_query_duration_seconds', 'Statement execution time by calling function.', ('query',),
+)
+QUERY_ROWS = Histogram(
+    'adr_db_query_rows', 'Rows returned or affected per statement by calling function.', ('query',), ROW_BUCKETS,
+)
+CONNECTION_WAIT_SECONDS = Histogram(
+    'adr_db_connection_acquire_seconds', 'Time spent acquiring a pooled database connection.',
+)
+TEMPLATE_SECONDS = Histogram(
+    'adr_template_render_seconds', 'Jinja template render time.', ('template',),
+)
+QUERY_ERRORS = Counter('adr_db_query_errors_total', 'Statements that raised a database error.', ('query',))
+ROUTED_CONNECTIONS = Counter(
+    'adr_db_routed_connections_total', 'Connection checkouts by target database (primary or replica).', ('target',),
+)
+REPLICA_FAILURES = Counter(
+    'adr_db_replica_failures_total', 'Replicas taken out of rotation, by reason.', ('replica', 'reason'),
+)
+
+REGISTRY = [
+    REQUEST_SECONDS, QUERY_SECONDS, QUERY_ROWS, QUERY_ERRORS, CONNECTION_WAIT_SECONDS, TEMPLATE_SECONDS,
+    ROUTED_CONNECTIONS, REPLICA_FAILURES,
+]
+
+_SKIP_MODULES = ('psycopg2',)
+
+
+def query_name():
+    # Label statements by the application function that issued them; skip psycopg2.extras helpers.
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__', '').startswith(_SKIP_MODULES):
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _observe_statement(cursor, elapsed, name):
+    QUERY_SECONDS.observe(elapsed, name)
+    QUERY_ROWS.observe(max(cursor.rowcount, 0), name)
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except psycopg2.Error:
+            if METRICS_ENABLED:
+                QUERY_ERRORS.inc(1, query_name())
+            raise
+        elapsed = time.perf_counter() - started
+        # Resolving the caller walks frames; only pay for it when something will use the name.
+        if METRICS_ENABLED or elapsed >= slowlog.log.threshold:
+            name = query_name()
+            if METRICS_ENABLED:
+                _observe_statement(self, elapsed, name)
+            slowlog.log.observe(self, query, vars, elapsed, name)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        if not METRICS_ENABLED:
+            return super().copy_expert(sql, file, size)
+        name = query_name()
+        started = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except psycopg2.Error:
+            QUERY_ERRORS.inc(1, name)
+            raise
+        _observe_statement(self, time.perf_counter() - started, name)
+        return result
+
+
+def cursor_factory():
+    return InstrumentedCursor if METRICS_ENABLED or slowlog.enabled() else None
+
+
+def observe_connection_wait(seconds):
+    if METRICS_ENABLED:
+        CONNECTION_WAIT_SECONDS.observe(seconds)
+
+
+def observe_route(target):
+    if METRICS_ENABLED:
+        ROUTED_CONNECTIONS.inc(1, target)
+
+
+def observe_replica_failure(replica, reason):
+    if METRICS_ENABLED:
+        REPLICA_FAILURES.inc(1, replica, reason)
+
+
+def _before_request():
+    ensure_flusher()
+    g.metrics_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method
+    status = str(response.status_code)
+    # Streamed exports finish long after the view returns; time until the body is closed.
+    response.call_on_close(
+        lambda: REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, method, status)
+    )
+    return response
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    stack = g.get('metrics_templates')
+    if stack:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template.name or 'string')
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+    app.before_request_funcs.setdefault(None, []).insert(0, _before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def token_authorized(header):
+    if not METRICS_TOKEN or not header or not header.startswith('Bearer '):
+        return False
+    return secrets.compare_digest(header[7:].strip(), METRICS_TOKEN)
+
+
+def _snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def _encode(snapshot):
+    return {name: [[list(labels), value] for labels, value in series.items()] for name, series in snapshot.items()}
+
+
+def _decode(payload):
+    return {name: {tuple(labels): value for labels, value in series} for name, series in payload.items()}
+
+
+_flush_state = {'pid': None, 'thread': None}
+_flush_lock = threading.Lock()
+
+
+def write_snapshot():
+    path = os.path.join(METRICS_DIR, f'metrics-{os.getpid()}.json')
+    handle, temp_path = tempfile.mkstemp(dir=METRICS_DIR, prefix='.metrics-')
+    with os.fdopen(handle, 'w') as target:
+        json.dump(_encode(_snapshot()), target)
+    os.replace(temp_path, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def ensure_flusher():
+    # Each worker publishes its totals so a scrape on any worker sees all of them.
+    if not (METRICS_ENABLED and METRICS_DIR):
+        return
+    pid = os.getpid()
+    if _flush_state['pid'] == pid:
+        return
+    with _flush_lock:
+        if _flush_state['pid'] != pid:
+            thread = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+            thread.start()
+            _flush_state.update(pid=pid, thread=thread)
+
+
+def _merge(target, series, kind):
+    for labels, value in series.items():
+        if labels not in target:
+            target[labels] = list(value) if kind == 'histogram' else value
+        elif kind == 'histogram':
+            target[labels] = [left + right for left, right in zip(target[labels], value)]
+        else:
+            target[labels] += value
+
+
+def collect():
+    if not METRICS_DIR:
+        return _snapshot()
+    write_snapshot()
+    merged = {metric.name: {} for metric in REGISTRY}
+    kinds = {metric.name: metric.kind for metric in REGISTRY}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        try:
+            with open(path) as source:
+                payload = _decode(json.load(source))
+        except (OSError, ValueError):
+            continue
+        for name, series in payload.items():
+            if name in merged:
+                _merge(merged[name], series, kinds[name])
+    return merged
+
+
+def render(pool_stats=None, replica_stats=None):
+    snapshot = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(snapshot.get(metric.name, {})))
+    pid = os.getpid()
+    if pool_stats:
+        for key in ('size', 'idle', 'in_use', 'maxconn'):
+            name = f'adr_db_pool_{key}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{_labels([("pid", pid)])} {pool_stats[key]}')
+    if replica_stats:
+        lines.append('# TYPE adr_db_replica_healthy gauge')
+        for replica in replica_stats['replicas']:
+            labels = _labels([('pid', pid), ('replica', replica['name'])])
+            lines.append(f"adr_db_replica_healthy{labels} {int(replica['healthy'])}")
+        lines.append('# TYPE adr_db_replica_lag_seconds gauge')
+        for replica in replica_stats['replicas']:
+            if replica['lag_seconds'] is not None:
+                labels = _labels([('pid', pid), ('replica', replica['name'])])
+                lines.append(f"adr_db_replica_lag_seconds{labels} {replica['lag_seconds']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,845 @@
+import os
+
+import psycopg2
+
+import passwords
+
+MIGRATION_LOCK_ID = 4242001
+
+
+def _install_triggers(cursor, table, function, triggers):
+    for name, timing in triggers:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+        cursor.execute(f'CREATE TRIGGER {name} {timing} FOR EACH STATEMENT EXECUTE FUNCTION {function}()')
+
+
+def _try(cursor, name, statements):
+    cursor.execute(f'SAVEPOINT {name}')
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+    except psycopg2.Error:
+        cursor.execute(f'ROLLBACK TO SAVEPOINT {name}')
+        return False
+    cursor.execute(f'RELEASE SAVEPOINT {name}')
+    return True
+
+
+ADR_STATEMENT_TRIGGERS = [
+    ('insert', 'AFTER INSERT ON adr REFERENCING NEW TABLE AS new_rows'),
+    ('update', 'AFTER UPDATE ON adr REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    ('delete', 'AFTER DELETE ON adr REFERENCING OLD TABLE AS old_rows'),
+]
+
+
+def _adr_triggers(prefix):
+    return [(f'{prefix}_{event}', timing) for event, timing in ADR_STATEMENT_TRIGGERS]
+
+
+# Each migration below holds the SQL exactly as it was when that version shipped. Later changes go
+# into a new version; editing an old one would leave fresh and upgraded databases with different schemas.
+def _initial_schema(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(80) UNIQUE NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            role VARCHAR(20) NOT NULL DEFAULT 'user'
+        )
+        '''
+    )
+
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS adr (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            name VARCHAR(120) NOT NULL,
+            age INTEGER NOT NULL,
+            drug VARCHAR(120) NOT NULL,
+            reaction TEXT NOT NULL,
+            severity VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    cursor.execute('ALTER TABLE adr ADD COLUMN IF NOT EXISTS user_id INTEGER')
+    cursor.execute(
+        '''
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conname = 'adr_user_id_fkey'
+            ) THEN
+                ALTER TABLE adr
+                ADD CONSTRAINT adr_user_id_fkey
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+            END IF;
+        END $$;
+        '''
+    )
+
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS activity_logs (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            action VARCHAR(80) NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    cursor.execute("UPDATE users SET role = 'user' WHERE role = 'viewer'")
+
+
+def _report_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_user_created_idx ON adr (user_id, created_at DESC, id DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_created_idx ON adr (created_at DESC, id DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_severity_idx ON adr (severity)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS activity_logs_created_idx ON activity_logs (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS activity_logs_user_idx ON activity_logs (user_id)')
+
+
+def _daily_rollup(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS adr_daily_rollup (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            drug_key VARCHAR(120) NOT NULL,
+            drug_label VARCHAR(120) NOT NULL,
+            severity VARCHAR(50) NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, drug_key, severity)
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_rollup_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE adr_daily_rollup r
+                SET report_count = r.report_count - removed.n
+                FROM (
+                    SELECT COALESCE(user_id, 0) AS user_id, created_at::date AS day,
+                           LOWER(TRIM(drug)) AS drug_key, severity, COUNT(*) AS n
+                    FROM old_rows
+                    GROUP BY 1, 2, 3, 4
+                ) removed
+                WHERE r.user_id = removed.user_id
+                  AND r.day = removed.day
+                  AND r.drug_key = removed.drug_key
+                  AND r.severity = removed.severity;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO adr_daily_rollup (user_id, day, drug_key, drug_label, severity, report_count)
+                SELECT COALESCE(user_id, 0), created_at::date, LOWER(TRIM(drug)), MIN(TRIM(drug)), severity, COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 5
+                ON CONFLICT (user_id, day, drug_key, severity)
+                DO UPDATE SET report_count = adr_daily_rollup.report_count + EXCLUDED.report_count;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(cursor, 'adr', 'adr_rollup_apply', _adr_triggers('adr_rollup'))
+    cursor.execute('LOCK TABLE adr IN SHARE MODE')
+    cursor.execute(
+        '''
+        INSERT INTO adr_daily_rollup (user_id, day, drug_key, drug_label, severity, report_count)
+        SELECT COALESCE(user_id, 0), created_at::date, LOWER(TRIM(drug)), MIN(TRIM(drug)), severity, COUNT(*)
+        FROM adr
+        WHERE NOT EXISTS (SELECT 1 FROM adr_daily_rollup)
+        GROUP BY 1, 2, 3, 5
+        '''
+    )
+
+
+def _report_search(cursor):
+    # Either piece may be unavailable (no CREATE EXTENSION privilege, pre-12 server);
+    # search then degrades to unindexed ILIKE instead of failing startup.
+    _try(cursor, 'search_trgm', [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS adr_name_trgm_idx ON adr USING gin (name gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS adr_drug_trgm_idx ON adr USING gin (drug gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS adr_reaction_trgm_idx ON adr USING gin (reaction gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS adr_severity_trgm_idx ON adr USING gin (severity gin_trgm_ops)',
+    ])
+    _try(cursor, 'search_fts', [
+        '''
+        ALTER TABLE adr ADD COLUMN IF NOT EXISTS reaction_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', COALESCE(reaction, ''))) STORED
+        ''',
+        'CREATE INDEX IF NOT EXISTS adr_reaction_tsv_idx ON adr USING gin (reaction_tsv)',
+    ])
+
+
+def _signal_detection(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS signal_pair_counts (
+            drug_key VARCHAR(120) NOT NULL,
+            reaction_key VARCHAR(200) NOT NULL,
+            report_count INTEGER NOT NULL,
+            PRIMARY KEY (drug_key, reaction_key)
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS signal_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_adr_id INTEGER NOT NULL DEFAULT 0,
+            last_mode VARCHAR(20),
+            last_run_at TIMESTAMP
+        )
+        '''
+    )
+    cursor.execute('INSERT INTO signal_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING')
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS adr_signals (
+            drug_key VARCHAR(120) NOT NULL,
+            reaction_key VARCHAR(200) NOT NULL,
+            a INTEGER NOT NULL,
+            b INTEGER NOT NULL,
+            c INTEGER NOT NULL,
+            d INTEGER NOT NULL,
+            prr DOUBLE PRECISION,
+            prr_lower DOUBLE PRECISION,
+            prr_upper DOUBLE PRECISION,
+            chi2 DOUBLE PRECISION,
+            ror DOUBLE PRECISION,
+            ror_lower DOUBLE PRECISION,
+            ror_upper DOUBLE PRECISION,
+            ic DOUBLE PRECISION,
+            ic025 DOUBLE PRECISION,
+            ic975 DOUBLE PRECISION,
+            prr_signal BOOLEAN NOT NULL,
+            ror_signal BOOLEAN NOT NULL,
+            ic_signal BOOLEAN NOT NULL,
+            PRIMARY KEY (drug_key, reaction_key)
+        )
+        '''
+    )
+
+
+def _duplicate_fingerprints(cursor):
+    cursor.execute(
+        r'''
+        CREATE OR REPLACE FUNCTION adr_fingerprint(p_user_id INTEGER, p_drug TEXT, p_reaction TEXT, p_age INTEGER)
+        RETURNS UUID AS $$
+            SELECT md5(
+                COALESCE(p_user_id, 0)::text
+                || '|' || lower(btrim(regexp_replace(p_drug, '\s+', ' ', 'g')))
+                || '|' || lower(btrim(regexp_replace(p_reaction, '\s+', ' ', 'g')))
+                || '|' || p_age::text
+            )::uuid
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+        '''
+    )
+    cursor.execute(
+        '''
+        ALTER TABLE adr ADD COLUMN IF NOT EXISTS fingerprint UUID
+        GENERATED ALWAYS AS (adr_fingerprint(user_id, drug, reaction, age)) STORED
+        '''
+    )
+    cursor.execute('ALTER TABLE adr ADD COLUMN IF NOT EXISTS duplicate_of INTEGER REFERENCES adr(id) ON DELETE SET NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_fingerprint_idx ON adr (fingerprint, created_at DESC)')
+
+
+def _drug_dictionary(cursor):
+    # Drop the rollup first so the backfill does not churn the old string-keyed table, then re-key it.
+    for name, _ in _adr_triggers('adr_rollup'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name} ON adr')
+    cursor.execute('DROP TABLE IF EXISTS adr_daily_rollup')
+
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS drugs (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(120) NOT NULL,
+            name_key VARCHAR(120) UNIQUE NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS drug_synonyms (
+            synonym_key VARCHAR(120) PRIMARY KEY,
+            drug_id INTEGER NOT NULL REFERENCES drugs(id) ON DELETE CASCADE
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS drug_synonyms_drug_idx ON drug_synonyms (drug_id)')
+    cursor.execute('ALTER TABLE adr ADD COLUMN IF NOT EXISTS drug_id INTEGER REFERENCES drugs(id) ON DELETE SET NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_drug_created_idx ON adr (drug_id, created_at DESC, id DESC)')
+
+    cursor.execute(
+        r'''
+        INSERT INTO drugs (name, name_key)
+        SELECT DISTINCT ON (key) LEFT(btrim(regexp_replace(drug, '\s+', ' ', 'g')), 120), key
+        FROM (
+            SELECT a.drug, LEFT(lower(btrim(regexp_replace(a.drug, '\s+', ' ', 'g'))), 120) AS key
+            FROM adr a WHERE a.drug_id IS NULL
+        ) pending
+        WHERE key <> ''
+          AND NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.synonym_key = pending.key)
+        ORDER BY key, drug
+        ON CONFLICT (name_key) DO NOTHING
+        '''
+    )
+    cursor.execute(
+        '''
+        INSERT INTO drug_synonyms (synonym_key, drug_id)
+        SELECT d.name_key, d.id FROM drugs d
+        WHERE NOT EXISTS (SELECT 1 FROM drug_synonyms s WHERE s.synonym_key = d.name_key)
+        ON CONFLICT (synonym_key) DO NOTHING
+        '''
+    )
+    cursor.execute(
+        r'''
+        UPDATE adr a SET drug_id = s.drug_id
+        FROM drug_synonyms s
+        WHERE a.drug_id IS NULL AND s.synonym_key = LEFT(lower(btrim(regexp_replace(a.drug, '\s+', ' ', 'g'))), 120)
+        '''
+    )
+
+    # drug_id 0 collects reports whose drug is blank or not yet in the drug dictionary.
+    cursor.execute(
+        '''
+        CREATE TABLE adr_daily_rollup (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            drug_id INTEGER NOT NULL,
+            severity VARCHAR(50) NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, drug_id, severity)
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_rollup_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE adr_daily_rollup r
+                SET report_count = r.report_count - removed.n
+                FROM (
+                    SELECT COALESCE(user_id, 0) AS user_id, created_at::date AS day,
+                           COALESCE(drug_id, 0) AS drug_id, severity, COUNT(*) AS n
+                    FROM old_rows
+                    GROUP BY 1, 2, 3, 4
+                ) removed
+                WHERE r.user_id = removed.user_id
+                  AND r.day = removed.day
+                  AND r.drug_id = removed.drug_id
+                  AND r.severity = removed.severity;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO adr_daily_rollup (user_id, day, drug_id, severity, report_count)
+                SELECT COALESCE(user_id, 0), created_at::date, COALESCE(drug_id, 0), severity, COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (user_id, day, drug_id, severity)
+                DO UPDATE SET report_count = adr_daily_rollup.report_count + EXCLUDED.report_count;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(cursor, 'adr', 'adr_rollup_apply', _adr_triggers('adr_rollup'))
+    cursor.execute('LOCK TABLE adr IN SHARE MODE')
+    cursor.execute(
+        '''
+        INSERT INTO adr_daily_rollup (user_id, day, drug_id, severity, report_count)
+        SELECT COALESCE(user_id, 0), created_at::date, COALESCE(drug_id, 0), severity, COUNT(*)
+        FROM adr
+        GROUP BY 1, 2, 3, 4
+        '''
+    )
+
+    # Signal pairs are now keyed by canonical drug name; the next run recounts everything.
+    cursor.execute('TRUNCATE signal_pair_counts')
+    cursor.execute('UPDATE signal_state SET last_adr_id = 0')
+
+
+def _slow_queries(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS slow_queries (
+            id BIGSERIAL PRIMARY KEY,
+            fingerprint CHAR(16) NOT NULL,
+            query_name VARCHAR(200) NOT NULL,
+            endpoint VARCHAR(120),
+            sql_template TEXT NOT NULL,
+            param_shape JSONB NOT NULL,
+            duration_ms DOUBLE PRECISION NOT NULL,
+            row_count INTEGER,
+            plan JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+    cursor.execute('CREATE INDEX IF NOT EXISTS slow_queries_fingerprint_idx ON slow_queries (fingerprint, created_at DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS slow_queries_created_idx ON slow_queries (created_at)')
+
+
+def _data_versions(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope VARCHAR(40) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 1,
+            modified_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_bump_data_version() RETURNS trigger AS $$
+        DECLARE
+            touched TEXT[] := ARRAY['reports'];
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                touched := touched || ARRAY(SELECT 'reports:user:' || user_id FROM new_rows WHERE user_id IS NOT NULL);
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                touched := touched || ARRAY(SELECT 'reports:user:' || user_id FROM old_rows WHERE user_id IS NOT NULL);
+            END IF;
+
+            INSERT INTO data_versions AS v (scope, version, modified_at)
+            SELECT DISTINCT scope, 1, clock_timestamp()
+            FROM unnest(touched) AS scope
+            ORDER BY scope
+            ON CONFLICT (scope) DO UPDATE SET version = v.version + 1, modified_at = EXCLUDED.modified_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION users_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO data_versions AS v (scope, version, modified_at)
+            VALUES ('users', 1, clock_timestamp())
+            ON CONFLICT (scope) DO UPDATE SET version = v.version + 1, modified_at = EXCLUDED.modified_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(cursor, 'adr', 'adr_bump_data_version', _adr_triggers('adr_version'))
+    _install_triggers(
+        cursor, 'users', 'users_bump_data_version',
+        [('users_version_change', 'AFTER INSERT OR UPDATE OR DELETE ON users')],
+    )
+    cursor.execute(
+        '''
+        INSERT INTO data_versions (scope) VALUES ('reports'), ('users')
+        ON CONFLICT (scope) DO NOTHING
+        '''
+    )
+
+
+def _report_trends(cursor):
+    # created_at follows insertion order, so a BRIN index covers wide range scans at a fraction of a btree's size.
+    cursor.execute('CREATE INDEX IF NOT EXISTS adr_created_brin_idx ON adr USING brin (created_at)')
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS adr_trend_daily (
+            day DATE NOT NULL,
+            drug_id INTEGER NOT NULL,
+            severity VARCHAR(50) NOT NULL,
+            report_count INTEGER NOT NULL,
+            PRIMARY KEY (day, drug_id, severity)
+        )
+        '''
+    )
+    cursor.execute('CREATE TABLE IF NOT EXISTS trend_dirty_days (day DATE PRIMARY KEY)')
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS trend_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            closed_through DATE NOT NULL,
+            closed_at TIMESTAMP
+        )
+        '''
+    )
+    cursor.execute(
+        '''
+        INSERT INTO trend_state (id, closed_through)
+        SELECT 1, COALESCE(MIN(created_at)::date, CURRENT_DATE) - 1 FROM adr
+        ON CONFLICT (id) DO NOTHING
+        '''
+    )
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_trend_mark_dirty() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO trend_dirty_days (day)
+                SELECT DISTINCT created_at::date FROM new_rows WHERE created_at::date < clock_timestamp()::date
+                ON CONFLICT (day) DO NOTHING;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO trend_dirty_days (day)
+                SELECT DISTINCT created_at::date FROM old_rows WHERE created_at::date < clock_timestamp()::date
+                ON CONFLICT (day) DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(cursor, 'adr', 'adr_trend_mark_dirty', _adr_triggers('adr_trend'))
+
+    # Initial close-out: bucket every day up to an hour behind yesterday's midnight.
+    cursor.execute(
+        '''
+        INSERT INTO adr_trend_daily (day, drug_id, severity, report_count)
+        SELECT a.created_at::date, COALESCE(a.drug_id, 0), a.severity, COUNT(*)
+        FROM adr a
+        JOIN trend_state s ON s.id = 1
+        WHERE a.created_at >= s.closed_through + 1
+          AND a.created_at < (clock_timestamp() - interval '1 hour')::date
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, drug_id, severity) DO UPDATE SET report_count = EXCLUDED.report_count
+        '''
+    )
+    cursor.execute(
+        '''
+        UPDATE trend_state
+        SET closed_through = (clock_timestamp() - interval '1 hour')::date - 1, closed_at = CURRENT_TIMESTAMP
+        WHERE id = 1 AND closed_through < (clock_timestamp() - interval '1 hour')::date - 1
+        '''
+    )
+
+
+def _partition_activity_logs(cursor):
+    # The id sequence outlives the old table so ids keep increasing across the switch.
+    cursor.execute('ALTER SEQUENCE activity_logs_id_seq OWNED BY NONE')
+    cursor.execute('ALTER SEQUENCE activity_logs_id_seq AS BIGINT')
+    cursor.execute('ALTER TABLE activity_logs RENAME TO activity_logs_unpartitioned')
+    for index in ('activity_logs_created_idx', 'activity_logs_user_idx', 'activity_logs_pkey'):
+        cursor.execute(f'ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned')
+    cursor.execute(
+        '''
+        CREATE TABLE activity_logs (
+            id BIGINT NOT NULL DEFAULT nextval('activity_logs_id_seq'),
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            action VARCHAR(80) NOT NULL,
+            details TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (created_at, id)
+        ) PARTITION BY RANGE (created_at)
+        '''
+    )
+    cursor.execute('ALTER SEQUENCE activity_logs_id_seq OWNED BY activity_logs.id')
+    cursor.execute('CREATE INDEX activity_logs_user_idx ON activity_logs (user_id, created_at)')
+    cursor.execute('CREATE INDEX activity_logs_action_idx ON activity_logs (action, created_at)')
+
+    # Monthly partitions from the oldest row through three months ahead.
+    cursor.execute(
+        '''
+        DO $$
+        DECLARE
+            part_start DATE;
+        BEGIN
+            FOR part_start IN
+                SELECT generate_series(
+                    date_trunc('month', COALESCE((SELECT MIN(created_at) FROM activity_logs_unpartitioned), LOCALTIMESTAMP)),
+                    date_trunc('month', LOCALTIMESTAMP) + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF activity_logs FOR VALUES FROM (%L) TO (%L)',
+                    'activity_logs_p' || to_char(part_start, 'YYYYMM'),
+                    part_start,
+                    (part_start + interval '1 month')::date
+                );
+            END LOOP;
+        END $$
+        '''
+    )
+    cursor.execute(
+        '''
+        INSERT INTO activity_logs (id, user_id, action, details, created_at)
+        SELECT id, user_id, action, details, created_at FROM activity_logs_unpartitioned
+        '''
+    )
+    cursor.execute('DROP TABLE activity_logs_unpartitioned')
+
+
+def _signal_pending_queue(cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS signal_pending (adr_id INTEGER NOT NULL)')
+    # Every inserted report is queued and consumed exactly once by the next run. An id watermark
+    # would skip reports whose SERIAL id was handed out before a run but committed after it.
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_signal_enqueue() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO signal_pending (adr_id) SELECT id FROM new_rows;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(
+        cursor, 'adr', 'adr_signal_enqueue',
+        [('adr_signal_enqueue', 'AFTER INSERT ON adr REFERENCING NEW TABLE AS new_rows')],
+    )
+    # Counts taken under the old id watermark may have skipped reports; queue everything for a recount.
+    cursor.execute('TRUNCATE signal_pair_counts, signal_pending')
+    cursor.execute('UPDATE signal_state SET last_adr_id = 0')
+    cursor.execute('INSERT INTO signal_pending (adr_id) SELECT id FROM adr')
+
+
+def _per_user_data_versions(cursor):
+    # No global report row any more: every writer would queue on its lock until commit.
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_bump_data_version() RETURNS trigger AS $$
+        DECLARE
+            touched TEXT[] := ARRAY[]::TEXT[];
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                touched := touched || ARRAY(SELECT 'reports:user:' || COALESCE(user_id::TEXT, 'none') FROM new_rows);
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                touched := touched || ARRAY(SELECT 'reports:user:' || COALESCE(user_id::TEXT, 'none') FROM old_rows);
+            END IF;
+
+            INSERT INTO data_versions AS v (scope, version, modified_at)
+            SELECT DISTINCT scope, 1, clock_timestamp()
+            FROM unnest(touched) AS scope
+            ORDER BY scope
+            ON CONFLICT (scope) DO UPDATE SET version = v.version + 1, modified_at = EXCLUDED.modified_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    cursor.execute("DELETE FROM data_versions WHERE scope = 'reports'")
+
+
+def _signal_pending_deltas(cursor):
+    cursor.execute(
+        '''
+        ALTER TABLE signal_pending
+            ADD COLUMN IF NOT EXISTS drug_id INTEGER,
+            ADD COLUMN IF NOT EXISTS drug TEXT,
+            ADD COLUMN IF NOT EXISTS reaction TEXT,
+            ADD COLUMN IF NOT EXISTS delta INTEGER NOT NULL DEFAULT 1
+        '''
+    )
+    # Entries queued so far are inserts that only carry the id; fill in the row they point at.
+    cursor.execute(
+        '''
+        UPDATE signal_pending p SET drug_id = a.drug_id, drug = a.drug, reaction = a.reaction
+        FROM adr a WHERE a.id = p.adr_id AND p.drug IS NULL
+        '''
+    )
+    cursor.execute('DELETE FROM signal_pending WHERE drug IS NULL')
+    # Inserts, edits and deletes queue +1/-1 deltas carrying the counted columns as they were, so a run
+    # can take back what an old row contributed even after the row has changed or gone.
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION adr_signal_enqueue() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO signal_pending (adr_id, drug_id, drug, reaction, delta)
+                SELECT id, drug_id, drug, reaction, 1 FROM new_rows;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO signal_pending (adr_id, drug_id, drug, reaction, delta)
+                SELECT id, drug_id, drug, reaction, -1 FROM old_rows;
+            ELSE
+                INSERT INTO signal_pending (adr_id, drug_id, drug, reaction, delta)
+                SELECT changed.*
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (
+                    VALUES (o.id, o.drug_id, o.drug, o.reaction, -1), (n.id, n.drug_id, n.drug, n.reaction, 1)
+                ) AS changed(adr_id, drug_id, drug, reaction, delta)
+                WHERE (o.drug_id, o.drug, o.reaction) IS DISTINCT FROM (n.drug_id, n.drug, n.reaction);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(cursor, 'adr', 'adr_signal_enqueue', [
+        ('adr_signal_enqueue', 'AFTER INSERT ON adr REFERENCING NEW TABLE AS new_rows'),
+        ('adr_signal_update', 'AFTER UPDATE ON adr REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+        ('adr_signal_delete', 'AFTER DELETE ON adr REFERENCING OLD TABLE AS old_rows'),
+    ])
+
+
+def _reports_watermark(cursor):
+    # The all-reports version is one row again, but it is bumped by a deferred trigger that runs once
+    # per transaction at commit time, so writers only hold its lock while they commit.
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION reports_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('adr.reports_version_bumped', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('adr.reports_version_bumped', 'on', true);
+            INSERT INTO data_versions AS v (scope, version, modified_at)
+            VALUES ('reports', 1, clock_timestamp())
+            ON CONFLICT (scope) DO UPDATE SET version = v.version + 1, modified_at = EXCLUDED.modified_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    cursor.execute('DROP TRIGGER IF EXISTS data_versions_reports_bump ON data_versions')
+    cursor.execute(
+        '''
+        CREATE CONSTRAINT TRIGGER data_versions_reports_bump
+        AFTER INSERT OR UPDATE ON data_versions
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW WHEN (NEW.scope LIKE 'reports:user:%')
+        EXECUTE FUNCTION reports_bump_data_version()
+        '''
+    )
+    # Start above the summed value clients were last given, so no old ETag can match again.
+    cursor.execute(
+        '''
+        INSERT INTO data_versions (scope, version, modified_at)
+        SELECT 'reports', COALESCE(SUM(version), 0) + 1, COALESCE(MAX(modified_at), CURRENT_TIMESTAMP)
+        FROM data_versions WHERE scope LIKE 'reports:user:%'
+        ON CONFLICT (scope) DO NOTHING
+        '''
+    )
+
+
+def _drug_data_version(cursor):
+    cursor.execute(
+        '''
+        CREATE OR REPLACE FUNCTION drugs_bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO data_versions AS v (scope, version, modified_at)
+            VALUES ('drugs', 1, clock_timestamp())
+            ON CONFLICT (scope) DO UPDATE SET version = v.version + 1, modified_at = EXCLUDED.modified_at;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    _install_triggers(
+        cursor, 'drugs', 'drugs_bump_data_version',
+        [('drugs_version_change', 'AFTER INSERT OR UPDATE OR DELETE ON drugs')],
+    )
+    _install_triggers(
+        cursor, 'drug_synonyms', 'drugs_bump_data_version',
+        [('drug_synonyms_version_change', 'AFTER INSERT OR UPDATE OR DELETE ON drug_synonyms')],
+    )
+    cursor.execute("INSERT INTO data_versions (scope) VALUES ('drugs') ON CONFLICT (scope) DO NOTHING")
+
+
+MIGRATIONS = [
+    (1, 'initial_schema', _initial_schema),
+    (2, 'adr_daily_rollup', _daily_rollup),
+    (3, 'report_search', _report_search),
+    (4, 'report_indexes', _report_indexes),
+    (5, 'signal_detection', _signal_detection),
+    (6, 'duplicate_fingerprints', _duplicate_fingerprints),
+    (7, 'drug_dictionary', _drug_dictionary),
+    (8, 'slow_queries', _slow_queries),
+    (9, 'data_versions', _data_versions),
+    (10, 'report_trends', _report_trends),
+    (11, 'partition_activity_logs', _partition_activity_logs),
+    (12, 'signal_pending_queue', _signal_pending_queue),
+    (13, 'per_user_data_versions', _per_user_data_versions),
+    (14, 'signal_pending_deltas', _signal_pending_deltas),
+    (15, 'reports_watermark', _reports_watermark),
+    (16, 'drug_data_version', _drug_data_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(120) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+
+def current_version(cursor):
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+
+def ensure_admin_user(cursor):
+    admin_user = os.environ.get('ADMIN_USERNAME', 'admin')
+    admin_password = os.environ.get('ADMIN_PASSWORD', 'admin1234')
+    cursor.execute(
+        '''
+        INSERT INTO users (username, password, role)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (username) DO NOTHING
+        ''',
+        (admin_user, passwords.hash_password(admin_password), 'admin'),
+    )
+
+
+def run_migrations(conn, log=print):
+    cursor = conn.cursor()
+    # Session-level advisory lock: concurrent runners (several hosts booting) wait instead of racing DDL.
+    cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    conn.commit()
+    applied = []
+    try:
+        ensure_migrations_table(cursor)
+        cursor.execute('SELECT version FROM schema_migrations')
+        done = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+
+        for version, name, apply in MIGRATIONS:
+            if version in done:
+                continue
+            log(f'Applying migration {version:04d}_{name}')
+            apply(cursor)
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                (version, name),
+            )
+            conn.commit()
+            applied.append(version)
+
+        ensure_admin_user(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied
@@ -0,0 +1,219 @@
+import multiprocessing
+import os
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Every gunicorn worker starts its own hasher pool, so the host's cores are split between them.
+WEB_CONCURRENCY = max(int(os.environ.get('WEB_CONCURRENCY', '1')), 1)
+GUNICORN_THREADS = max(int(os.environ.get('GUNICORN_THREADS', '8')), 1)
+PASSWORD_HASH_WORKERS = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', str(min(max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1), 4)))
+)
+# Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000". Stored hashes made
+# with other parameters are replaced on the user's next successful login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+# A waiting login holds one of the worker's request threads; at most half of them may wait on the pool.
+PASSWORD_VERIFY_QUEUE = int(
+    os.environ.get('PASSWORD_VERIFY_QUEUE', str(max(min(max(PASSWORD_HASH_WORKERS, 1) * 2, GUNICORN_THREADS // 2), 1)))
+)
+PASSWORD_VERIFY_TIMEOUT = float(os.environ.get('PASSWORD_VERIFY_TIMEOUT', '5'))
+PASSWORD_LENGTH = 12
+# No '=', '+', '-' or '@': a generated password leading a spreadsheet cell would be read as a formula.
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + '!#$%^&*'
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def hash_password(password, method=PASSWORD_HASH_METHOD):
+    return generate_password_hash(password, method=method)
+
+
+def hash_parameters(stored_hash):
+    return stored_hash.split('$', 1)[0] if '$' in stored_hash else None
+
+
+def generate_password(length=PASSWORD_LENGTH):
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def generate_credentials(count, length=PASSWORD_LENGTH, method=PASSWORD_HASH_METHOD):
+    # Runs inside a pool process: the password and its hash are both produced there.
+    generated = [generate_password(length) for _ in range(count)]
+    return [(password, hash_password(password, method)) for password in generated]
+
+
+def verify_password(stored_hash, password, current_parameters, method=PASSWORD_HASH_METHOD):
+    # Runs inside a pool process. Returns (valid, replacement hash or None, seconds spent checking).
+    started = time.perf_counter()
+    try:
+        valid = check_password_hash(stored_hash, password)
+    except ValueError:
+        valid = False
+    elapsed = time.perf_counter() - started
+    if not valid and secrets.compare_digest(stored_hash.encode('utf-8'), password.encode('utf-8')):
+        # Accounts created before passwords were hashed store them in plain text.
+        return True, hash_password(password, method), elapsed
+    if valid and hash_parameters(stored_hash) != current_parameters:
+        return True, hash_password(password, method), elapsed
+    return valid, None, elapsed
+
+
+class PasswordHasher:
+    def __init__(self, max_workers=4, method='scrypt', verify_queue=16, verify_timeout=5.0):
+        self.max_workers = max_workers
+        self.method = method
+        self.verify_timeout = verify_timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # Bounds verifications queued or running in this worker; beyond it logins are turned away
+        # immediately instead of piling up behind the pool.
+        self._slots = threading.BoundedSemaphore(max(verify_queue, 1))
+        self._parameters = None
+        self._dummy_hash = None
+        self._verify_seconds = None
+        self._stats = {
+            'batches': 0,
+            'hashed': 0,
+            'seconds_total': 0.0,
+            'seconds_max': 0.0,
+            'verified': 0,
+            'rejected_busy': 0,
+            'rehashed': 0,
+            'padded': 0,
+            'pool_restarts': 0,
+        }
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor is not None and self._pid == pid:
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                # forkserver children start from a clean single-threaded process, never a copy of a
+                # worker holding pool connections and executor threads.
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method),
+                )
+                self._pid = pid
+        return self._executor
+
+    def _discard_executor(self, executor):
+        # A pool whose process died rejects every later task; the next call builds a fresh one.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._pid = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def credentials(self, count):
+        # Returns count (password, hash) pairs; hashing is CPU-bound, so it is spread over processes.
+        if count <= 0:
+            return []
+        started = time.perf_counter()
+        if self.max_workers <= 1 or count == 1:
+            credentials = generate_credentials(count, method=self.method)
+        else:
+            workers = min(self.max_workers, count)
+            sizes = [count // workers + (1 if index < count % workers else 0) for index in range(workers)]
+            executor = self._get_executor()
+            try:
+                chunks = executor.map(generate_credentials, sizes, [PASSWORD_LENGTH] * workers, [self.method] * workers)
+                credentials = [pair for chunk in chunks for pair in chunk]
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['hashed'] += count
+            self._stats['seconds_total'] += elapsed
+            self._stats['seconds_max'] = max(self._stats['seconds_max'], elapsed)
+        return credentials
+
+    def current_parameters(self):
+        # The method string werkzeug writes for self.method, e.g. "scrypt" -> "scrypt:32768:8:1".
+        if self._parameters is None:
+            started = time.perf_counter()
+            self._dummy_hash = hash_password(generate_password(), self.method)
+            # One hash costs about what one check does; it seeds the estimate reject_unknown pads to.
+            self._verify_seconds = self._verify_seconds or time.perf_counter() - started
+            self._parameters = hash_parameters(self._dummy_hash)
+        return self._parameters
+
+    def verify(self, stored_hash, password):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected_busy'] += 1
+            raise HasherBusy('too many password checks queued')
+        try:
+            parameters = self.current_parameters()
+            if self.max_workers < 1:
+                valid, new_hash, elapsed = verify_password(stored_hash, password, parameters, self.method)
+            else:
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(verify_password, stored_hash, password, parameters, self.method)
+                    valid, new_hash, elapsed = future.result(timeout=self.verify_timeout)
+                except FutureTimeoutError:
+                    future.cancel()
+                    raise HasherBusy('password check timed out')
+                except BrokenProcessPool:
+                    self._discard_executor(executor)
+                    with self._lock:
+                        self._stats['pool_restarts'] += 1
+                    raise HasherBusy('password hasher restarting')
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self._stats['verified'] += 1
+            self._stats['rehashed'] += 1 if new_hash else 0
+            if hash_parameters(stored_hash) == parameters:
+                self._verify_seconds = self._verify_seconds * 0.9 + elapsed * 0.1
+        return valid, new_hash
+
+    def reject_unknown(self, started):
+        # Unknown usernames skip the hash entirely, but answer no sooner than a real check would,
+        # so response times do not reveal which accounts exist.
+        self.current_parameters()
+        remaining = self._verify_seconds - (time.perf_counter() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        with self._lock:
+            self._stats['padded'] += 1
+        return False
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pid = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_workers'] = self.max_workers
+        stats['method'] = self.method
+        stats['verify_seconds_estimate'] = self._verify_seconds
+        stats['seconds_avg'] = stats['seconds_total'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+hasher = PasswordHasher(
+    max_workers=PASSWORD_HASH_WORKERS,
+    method=PASSWORD_HASH_METHOD,
+    verify_queue=PASSWORD_VERIFY_QUEUE,
+    verify_timeout=PASSWORD_VERIFY_TIMEOUT,
+)
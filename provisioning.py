@@ -0,0 +1,164 @@
+import csv
+import os
+import secrets
+from io import StringIO
+
+from psycopg2.extras import execute_values
+
+import passwords
+
+BULK_USER_MAX = int(os.environ.get('BULK_USER_MAX', '1000'))
+USERNAME_MAX_LENGTH = 80
+# Generated names are the prefix plus "_" and six digits.
+PREFIX_MAX_LENGTH = USERNAME_MAX_LENGTH - len('_000000')
+
+
+class ProvisioningError(ValueError):
+    pass
+
+
+def candidate_username(base):
+    return f'{base}_{secrets.randbelow(900000) + 100000}'
+
+
+def taken_usernames(cursor, usernames):
+    cursor.execute('SELECT username FROM users WHERE username = ANY(%s)', (list(usernames),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def reserve_usernames(cursor, count, base='user', exclude=()):
+    # One set-based lookup per round; with a 900k name space a second round is rare.
+    names = []
+    seen = set(exclude)
+    while len(names) < count:
+        wanted = count - len(names)
+        candidates = set()
+        while len(candidates) < wanted * 2:
+            candidate = candidate_username(base)
+            if candidate not in seen:
+                candidates.add(candidate)
+        seen |= candidates
+        names.extend(sorted(candidates - taken_usernames(cursor, candidates))[:wanted])
+    return names
+
+
+def clean_usernames(lines):
+    usernames = []
+    seen = set()
+    for line in lines:
+        username = line.strip()
+        if not username:
+            continue
+        if len(username) > USERNAME_MAX_LENGTH:
+            raise ProvisioningError(f'Usernames must be at most {USERNAME_MAX_LENGTH} characters: {username[:20]}...')
+        if username in seen:
+            raise ProvisioningError(f'Username {username} is listed more than once.')
+        seen.add(username)
+        usernames.append(username)
+    return usernames
+
+
+def provision_users(conn, usernames=(), count=0, role='user', base='user', before_commit=None):
+    usernames = list(usernames)
+    total = len(usernames) + count
+    if total < 1:
+        raise ProvisioningError('Give a number of users to create or a list of usernames.')
+    if total > BULK_USER_MAX:
+        raise ProvisioningError(f'At most {BULK_USER_MAX} users can be created at once.')
+    if count and len(base) > PREFIX_MAX_LENGTH:
+        raise ProvisioningError(f'Username prefix must be at most {PREFIX_MAX_LENGTH} characters.')
+
+    cursor = conn.cursor()
+    taken = sorted(taken_usernames(cursor, usernames)) if usernames else []
+    if taken:
+        raise ProvisioningError(f"Already taken: {', '.join(taken[:10])}{' ...' if len(taken) > 10 else ''}")
+
+    names = usernames + reserve_usernames(cursor, count, base, exclude=usernames)
+    pending = list(zip(names, passwords.hasher.credentials(len(names))))
+    requested = set(usernames)
+    created = []
+    while pending:
+        # A concurrent request can still claim a generated name; those are re-drawn, never overwritten.
+        rows = execute_values(
+            cursor,
+            '''
+            INSERT INTO users (username, password, role) VALUES %s
+            ON CONFLICT (username) DO NOTHING
+            RETURNING id, username
+            ''',
+            [(username, password_hash, role) for username, (_, password_hash) in pending],
+            page_size=len(pending),
+            fetch=True,
+        )
+        inserted = {username: user_id for user_id, username in rows}
+        created.extend(
+            (inserted[username], username, password) for username, (password, _) in pending if username in inserted
+        )
+        lost = [entry for entry in pending if entry[0] not in inserted]
+        lost_requested = sorted(username for username, _ in lost if username in requested)
+        if lost_requested:
+            conn.rollback()
+            raise ProvisioningError(f"Already taken: {', '.join(lost_requested[:10])}")
+        names.extend(username for username, _ in lost)
+        fresh = reserve_usernames(cursor, len(lost), base, exclude=names)
+        pending = [(username, credentials) for username, (_, credentials) in zip(fresh, lost)]
+
+    accounts = [(user_id, username, role, password) for user_id, username, password in created]
+    if before_commit:
+        before_commit(conn, accounts)
+    conn.commit()
+    return accounts
+
+
+def selected_user_ids(values, current_user_id):
+    user_ids = set()
+    for value in values:
+        try:
+            user_ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    user_ids.discard(current_user_id)
+    return sorted(user_ids)
+
+
+def change_roles(cursor, user_ids, role):
+    cursor.execute(
+        'UPDATE users SET role = %s WHERE id = ANY(%s) AND role <> %s RETURNING id', (role, user_ids, role),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def delete_users(cursor, user_ids):
+    cursor.execute('DELETE FROM users WHERE id = ANY(%s) RETURNING id', (user_ids,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def reset_passwords(cursor, user_ids):
+    # Lock the rows first so only accounts that still exist are hashed for.
+    cursor.execute('SELECT id FROM users WHERE id = ANY(%s) ORDER BY id FOR UPDATE', (user_ids,))
+    found = [row[0] for row in cursor.fetchall()]
+    if not found:
+        return []
+    credentials = passwords.hasher.credentials(len(found))
+    rows = execute_values(
+        cursor,
+        '''
+        UPDATE users AS u SET password = v.password
+        FROM (VALUES %s) AS v(id, password)
+        WHERE u.id = v.id
+        RETURNING u.id, u.username, u.role
+        ''',
+        [(user_id, password_hash) for user_id, (_, password_hash) in zip(found, credentials)],
+        page_size=len(found),
+        fetch=True,
+    )
+    plain = {user_id: password for user_id, (password, _) in zip(found, credentials)}
+    return sorted((user_id, username, role, plain[user_id]) for user_id, username, role in rows)
+
+
+def credentials_csv(accounts):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'username', 'role', 'temporary_password'])
+    writer.writerows(accounts)
+    return buffer.getvalue()
@@ -0,0 +1,133 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LOGIN_LIMIT_PATH = os.environ.get(
+    'LOGIN_LIMIT_PATH', os.path.join(tempfile.gettempdir(), 'adr_login_attempts.sqlite3'),
+)
+LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', '5'))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('LOGIN_MAX_FAILURES_PER_IP', '50'))
+LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.environ.get('LOGIN_MAX_FAILURES_PER_ACCOUNT', '100'))
+LOGIN_FAILURE_WINDOW = float(os.environ.get('LOGIN_FAILURE_WINDOW', '900'))
+
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS login_failures (
+        key TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        window_start REAL NOT NULL
+    )
+'''
+
+# Counts restart once the window since the first failure has passed; both CASEs read the old row.
+RECORD_SQL = '''
+    INSERT INTO login_failures (key, failures, window_start) VALUES (?, 1, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        failures = CASE WHEN excluded.window_start - window_start >= ? THEN 1 ELSE failures + 1 END,
+        window_start = CASE WHEN excluded.window_start - window_start >= ? THEN excluded.window_start
+                            ELSE window_start END
+'''
+
+
+class FailureLimiter:
+    # Failed sign-ins per username from one client address, per address overall, and per username
+    # across all addresses, kept in a SQLite file so every worker on the host shares one count.
+    # The tight limit is tied to the address so nobody can lock a user out from elsewhere by guessing
+    # wrong on purpose; the much higher account-wide limit still caps a guesser spread over many
+    # addresses. Store errors fail open: they are logged, never block a login.
+    def __init__(self, path, max_per_user=5, max_per_ip=50, max_per_account=100, window=900.0):
+        self.path = path
+        self.limits = {'user': max_per_user, 'ip': max_per_ip, 'account': max_per_account}
+        self.window = window
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._purge_at = 0.0
+        self._stats = {'checks': 0, 'blocked': 0, 'failures': 0, 'resets': 0, 'store_errors': 0}
+
+    def _connection(self):
+        pid = os.getpid()
+        cached = getattr(self._local, 'conn', None)
+        if cached is not None and cached[0] == pid:
+            return cached[1]
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(SCHEMA_SQL)
+        self._local.conn = (pid, conn)
+        return conn
+
+    def _keys(self, username, address):
+        return [
+            ('user', f'user:{address}|{username.lower()}'),
+            ('ip', f'ip:{address}'),
+            ('account', f'account:{username.lower()}'),
+        ]
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def retry_after(self, username, address):
+        self._count('checks')
+        keys = self._keys(username, address)
+        try:
+            rows = self._connection().execute(
+                'SELECT key, failures, window_start FROM login_failures WHERE key IN (?, ?, ?)',
+                [key for _, key in keys],
+            ).fetchall()
+        except sqlite3.Error:
+            self._count('store_errors')
+            logger.exception('Login failure store is unavailable')
+            return 0
+        now = time.time()
+        wait = 0.0
+        for key, failures, window_start in rows:
+            if failures >= self.limits[key.split(':', 1)[0]] and now - window_start < self.window:
+                wait = max(wait, self.window - (now - window_start))
+        if wait:
+            self._count('blocked')
+        return wait
+
+    def record_failure(self, username, address):
+        self._count('failures')
+        now = time.time()
+        try:
+            conn = self._connection()
+            for _, key in self._keys(username, address):
+                conn.execute(RECORD_SQL, (key, now, self.window, self.window))
+            if now >= self._purge_at:
+                self._purge_at = now + self.window
+                conn.execute('DELETE FROM login_failures WHERE window_start < ?', (now - self.window,))
+        except sqlite3.Error:
+            self._count('store_errors')
+            logger.exception('Login failure store is unavailable')
+
+    def reset(self, username, address):
+        # A successful sign-in clears the account's count from that address; the address and the
+        # account-wide count keep their history, so a guesser cannot reset them by signing in elsewhere.
+        self._count('resets')
+        try:
+            self._connection().execute(
+                'DELETE FROM login_failures WHERE key = ?', (self._keys(username, address)[0][1],),
+            )
+        except sqlite3.Error:
+            self._count('store_errors')
+            logger.exception('Login failure store is unavailable')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(path=self.path, window=self.window, **{f'max_per_{kind}': limit for kind, limit in self.limits.items()})
+        return stats
+
+
+login_failures = FailureLimiter(
+    LOGIN_LIMIT_PATH,
+    max_per_user=LOGIN_MAX_FAILURES_PER_USER,
+    max_per_ip=LOGIN_MAX_FAILURES_PER_IP,
+    max_per_account=LOGIN_MAX_FAILURES_PER_ACCOUNT,
+    window=LOGIN_FAILURE_WINDOW,
+)
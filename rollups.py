@@ -0,0 +1,13 @@
+def rebuild_rollups(cursor):
+    # SHARE mode blocks concurrent writers so no trigger delta is lost between TRUNCATE and refill.
+    cursor.execute('LOCK TABLE adr IN SHARE MODE')
+    cursor.execute('TRUNCATE adr_daily_rollup')
+    cursor.execute(
+        '''
+        INSERT INTO adr_daily_rollup (user_id, day, drug_id, severity, report_count)
+        SELECT COALESCE(user_id, 0), created_at::date, COALESCE(drug_id, 0), severity, COUNT(*)
+        FROM adr
+        GROUP BY 1, 2, 3, 4
+        '''
+    )
+    return cursor.rowcount
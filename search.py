@@ -0,0 +1,57 @@
+import threading
+
+BASIC_CAPABILITIES = {'trgm': False, 'fts': False}
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def detect_capabilities(cursor):
+    cursor.execute(
+        '''
+        SELECT
+            EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'),
+            EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'adr' AND column_name = 'reaction_tsv'
+            )
+        '''
+    )
+    trgm, fts = cursor.fetchone()
+    return {'trgm': trgm, 'fts': fts}
+
+
+def capabilities(cursor=None):
+    global _capabilities
+    if _capabilities is not None:
+        return _capabilities
+    if cursor is None:
+        return BASIC_CAPABILITIES
+    detected = detect_capabilities(cursor)
+    with _capabilities_lock:
+        _capabilities = detected
+    return detected
+
+
+def search_condition(term, caps):
+    pattern = f'%{term}%'
+    sql = 'a.name ILIKE %s OR a.drug ILIKE %s OR a.reaction ILIKE %s OR a.severity ILIKE %s'
+    params = [pattern] * 4
+    if caps['fts']:
+        sql += " OR a.reaction_tsv @@ websearch_to_tsquery('english', %s)"
+        params.append(term)
+    return f'({sql})', params
+
+
+def rank_expression(term, caps):
+    parts = []
+    params = []
+    if caps['fts']:
+        parts.append("ts_rank(a.reaction_tsv, websearch_to_tsquery('english', %s))")
+        params.append(term)
+    if caps['trgm']:
+        parts.append('GREATEST(similarity(a.name, %s), similarity(a.drug, %s), word_similarity(%s, a.reaction))')
+        params.extend([term] * 3)
+    if not parts:
+        return None, []
+    return f"({' + '.join(parts)})::float8", params
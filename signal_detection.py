@@ -0,0 +1,175 @@
+import os
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+SIGNAL_MIN_COUNT = int(os.environ.get('SIGNAL_MIN_COUNT', '3'))
+Z_95 = 1.959964
+
+# Synonyms share a drug_id, so pairs are counted per canonical dictionary name.
+DRUG_KEY_SQL = 'LOWER(COALESCE(d.name, TRIM(a.drug)))'
+REACTION_KEY_SQL = 'LEFT(LOWER(TRIM(a.reaction)), 200)'
+
+SIGNAL_COLUMNS = [
+    'drug_key', 'reaction_key', 'a', 'b', 'c', 'd',
+    'prr', 'prr_lower', 'prr_upper', 'chi2',
+    'ror', 'ror_lower', 'ror_upper',
+    'ic', 'ic025', 'ic975',
+    'prr_signal', 'ror_signal', 'ic_signal',
+]
+
+
+def compute_statistics(pairs, min_count=SIGNAL_MIN_COUNT):
+    if pairs.empty:
+        return pd.DataFrame(columns=SIGNAL_COLUMNS)
+
+    a = pairs['a'].to_numpy(dtype=float)
+    drug_totals = pairs.groupby('drug_key')['a'].transform('sum').to_numpy(dtype=float)
+    reaction_totals = pairs.groupby('reaction_key')['a'].transform('sum').to_numpy(dtype=float)
+    n = a.sum()
+    b = drug_totals - a
+    c = reaction_totals - a
+    d = n - a - b - c
+
+    # Haldane-Anscombe correction only where a cell of the 2x2 table is empty.
+    zero = (b == 0) | (c == 0) | (d == 0)
+    ac, bc, cc, dc = (np.where(zero, cell + 0.5, cell) for cell in (a, b, c, d))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prr = (ac / (ac + bc)) / (cc / (cc + dc))
+        prr_se = np.sqrt(1 / ac - 1 / (ac + bc) + 1 / cc - 1 / (cc + dc))
+        ror = (ac * dc) / (bc * cc)
+        ror_se = np.sqrt(1 / ac + 1 / bc + 1 / cc + 1 / dc)
+        chi2 = n * (np.maximum(np.abs(a * d - b * c) - n / 2, 0)) ** 2 / ((a + b) * (c + d) * (a + c) * (b + d))
+
+        # Shrunk information component with the Noren et al. closed-form credibility interval.
+        expected = (a + b) * (a + c) / n
+        ic = np.log2((a + 0.5) / (expected + 0.5))
+        ic025 = ic - 3.3 * (a + 0.5) ** -0.5 - 2 * (a + 0.5) ** -1.5
+        ic975 = ic + 2.4 * (a + 0.5) ** -0.5 - 0.5 * (a + 0.5) ** -1.5
+
+    enough = a >= min_count
+    result = pd.DataFrame({
+        'drug_key': pairs['drug_key'].to_numpy(),
+        'reaction_key': pairs['reaction_key'].to_numpy(),
+        'a': a.astype('int64'),
+        'b': b.astype('int64'),
+        'c': c.astype('int64'),
+        'd': d.astype('int64'),
+        'prr': prr,
+        'prr_lower': np.exp(np.log(prr) - Z_95 * prr_se),
+        'prr_upper': np.exp(np.log(prr) + Z_95 * prr_se),
+        'chi2': chi2,
+        'ror': ror,
+        'ror_lower': np.exp(np.log(ror) - Z_95 * ror_se),
+        'ror_upper': np.exp(np.log(ror) + Z_95 * ror_se),
+        'ic': ic,
+        'ic025': ic025,
+        'ic975': ic975,
+    })
+    result['prr_signal'] = enough & (prr >= 2) & (chi2 >= 4)
+    result['ror_signal'] = enough & (result['ror_lower'].to_numpy() > 1)
+    result['ic_signal'] = enough & (ic025 > 0)
+    return result.replace([np.inf, -np.inf], np.nan)
+
+
+def refresh_pair_counts(cursor, full=False):
+    cursor.execute('SELECT last_adr_id FROM signal_state WHERE id = 1 FOR UPDATE')
+    last_adr_id = 0 if full else cursor.fetchone()[0]
+
+    if full:
+        cursor.execute('TRUNCATE signal_pair_counts')
+
+    # One statement, one snapshot: the queue entries it consumes are exactly the committed changes it
+    # applies. Entries committed meanwhile stay queued for the next run. A full run drains the queue too.
+    if full:
+        source, delta = 'adr a', 'COUNT(*)'
+        high_water = '(SELECT MAX(id) FROM adr)'
+    else:
+        source, delta = 'pending a', 'SUM(a.delta)'
+        high_water = '(SELECT MAX(adr_id) FILTER (WHERE delta > 0) FROM pending)'
+    cursor.execute(
+        f'''
+        WITH pending AS (
+            DELETE FROM signal_pending RETURNING adr_id, drug_id, drug, reaction, delta
+        ), counted AS (
+            INSERT INTO signal_pair_counts (drug_key, reaction_key, report_count)
+            SELECT {DRUG_KEY_SQL}, {REACTION_KEY_SQL}, {delta}
+            FROM {source}
+            LEFT JOIN drugs d ON d.id = a.drug_id
+            WHERE TRIM(a.drug) <> '' AND TRIM(a.reaction) <> ''
+            GROUP BY 1, 2
+            HAVING {delta} <> 0
+            ON CONFLICT (drug_key, reaction_key)
+            DO UPDATE SET report_count = signal_pair_counts.report_count + EXCLUDED.report_count
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM counted), {high_water}
+        '''
+    )
+    touched, high_water = cursor.fetchone()
+
+    cursor.execute(
+        'UPDATE signal_state SET last_adr_id = %s, last_mode = %s, last_run_at = CURRENT_TIMESTAMP WHERE id = 1',
+        (max(last_adr_id, high_water or 0), 'full' if full else 'incremental'),
+    )
+    return touched
+
+
+def load_pairs(cursor):
+    cursor.execute('SELECT drug_key, reaction_key, report_count FROM signal_pair_counts WHERE report_count > 0')
+    return pd.DataFrame(cursor.fetchall(), columns=['drug_key', 'reaction_key', 'a'])
+
+
+def store_signals(cursor, statistics):
+    flagged = statistics[statistics['prr_signal'] | statistics['ror_signal'] | statistics['ic_signal']]
+    cursor.execute('TRUNCATE adr_signals')
+    if flagged.empty:
+        return 0
+
+    buffer = StringIO()
+    flagged[SIGNAL_COLUMNS].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY adr_signals ({', '.join(SIGNAL_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return len(flagged)
+
+
+def run_signal_detection(conn, full=False, before_commit=None):
+    cursor = conn.cursor()
+    touched = refresh_pair_counts(cursor, full=full)
+    pairs = load_pairs(cursor)
+    statistics = compute_statistics(pairs)
+    flagged = store_signals(cursor, statistics)
+    summary = {
+        'mode': 'full' if full else 'incremental',
+        'touched_pairs': touched,
+        'pairs': len(pairs),
+        'reports': int(pairs['a'].sum()) if not pairs.empty else 0,
+        'flagged': flagged,
+    }
+    if before_commit:
+        before_commit(conn, summary)
+    conn.commit()
+    return summary
+
+
+def fetch_signals(cursor, limit=500):
+    cursor.execute(
+        f'''
+        SELECT {', '.join(SIGNAL_COLUMNS)}
+        FROM adr_signals
+        ORDER BY ic025 DESC NULLS LAST, a DESC
+        LIMIT %s
+        ''',
+        (limit,),
+    )
+    return [dict(zip(SIGNAL_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def fetch_signal_state(cursor):
+    cursor.execute('SELECT last_adr_id, last_mode, last_run_at FROM signal_state WHERE id = 1')
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'last_adr_id': row[0], 'last_mode': row[1], 'last_run_at': row[2]}
@@ -0,0 +1,299 @@
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from flask import has_request_context, request
+from psycopg2.extras import Json, execute_values
+
+import db
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '500'))
+# 'plan' only plans the statement. 'analyze' runs a slow query a second time in the request thread,
+# so it is opt-in for debugging sessions. 'off' disables both.
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'plan').strip().lower()
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '600'))
+SLOW_QUERY_BUFFER = int(os.environ.get('SLOW_QUERY_BUFFER', '200'))
+SLOW_QUERY_RETENTION_DAYS = int(os.environ.get('SLOW_QUERY_RETENTION_DAYS', '14'))
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_QUOTED_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w$.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])')
+# Row lists that execute_values inlined, once their literals are gone: "(?, ?), (?, ?), ..." -> "(?, ?), ...".
+_VALUES_LIST_RE = re.compile(r'(\([?, ]*\))(?:, ?\1)+')
+# Side effects that a savepoint rollback would not undo.
+_NO_EXPLAIN_RE = re.compile(r'pg_advisory|nextval|setval', re.IGNORECASE)
+
+
+def enabled():
+    return SLOW_QUERY_MS > 0
+
+
+def normalize_sql(query):
+    return _WHITESPACE_RE.sub(' ', query).strip()
+
+
+def strip_literals(sql):
+    # execute_values and mogrify put row values into the statement text itself; the template keeps
+    # only its shape, so batches of any size share one fingerprint and no values are stored.
+    sql = _NUMBER_RE.sub('?', _QUOTED_RE.sub('?', sql))
+    return _VALUES_LIST_RE.sub(r'\1, ...', sql)
+
+
+def fingerprint(sql_template):
+    return hashlib.sha1(sql_template.encode('utf-8')).hexdigest()[:16]
+
+
+def _value_shape(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, (float, decimal.Decimal)):
+        return 'number'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return type(value).__name__
+    if isinstance(value, (list, tuple)):
+        inner = sorted({_value_shape(item) for item in value})
+        return f"array[{len(value)}]<{'|'.join(inner)}>" if inner else 'array[0]'
+    if isinstance(value, (str, bytes)):
+        return 'text'
+    return type(value).__name__
+
+
+def param_shape(params):
+    # Types and sizes only: parameter values are patient data and never leave the process.
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: _value_shape(value) for key, value in params.items()}
+    return [_value_shape(value) for value in params]
+
+
+def scrub_plan(node):
+    if isinstance(node, dict):
+        return {key: scrub_plan(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [scrub_plan(value) for value in node]
+    if isinstance(node, str):
+        return _NUMBER_RE.sub('?', _QUOTED_RE.sub("'?'", node))
+    return node
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=500.0, buffer_size=200, explain='plan', explain_interval=600.0):
+        self.threshold = threshold_ms / 1000.0
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=buffer_size)
+        self._pending = queue.Queue(maxsize=buffer_size * 5)
+        self._explained_at = {}
+        self._local = threading.local()
+        self._thread = None
+        self._pid = None
+        self._stats = {'recorded': 0, 'explained': 0, 'explain_errors': 0, 'dropped': 0, 'written': 0}
+
+    def observe(self, cursor, query, params, elapsed, name):
+        if self.threshold <= 0 or elapsed < self.threshold or getattr(self._local, 'busy', False):
+            return
+        self._local.busy = True
+        try:
+            self._record(cursor, query, params, elapsed, name)
+        finally:
+            self._local.busy = False
+
+    def _record(self, cursor, query, params, elapsed, name):
+        if hasattr(query, 'as_string'):
+            query = query.as_string(cursor.connection)
+        elif isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        sql_template = strip_literals(normalize_sql(query))
+        key = fingerprint(sql_template)
+        entry = {
+            'fingerprint': key,
+            'query_name': name[:200],
+            'endpoint': request.endpoint if has_request_context() else None,
+            'sql_template': sql_template,
+            'param_shape': param_shape(params),
+            'duration_ms': round(elapsed * 1000, 3),
+            'row_count': cursor.rowcount if cursor.rowcount >= 0 else None,
+            'plan': None,
+            'created_at': datetime.datetime.now(),
+        }
+        if self._should_explain(key, sql_template, cursor):
+            entry['plan'] = self._explain(cursor.connection, query, params)
+
+        with self._lock:
+            self._recent.append(entry)
+            self._stats['recorded'] += 1
+        self._ensure_started()
+        try:
+            self._pending.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def _should_explain(self, key, sql_template, cursor):
+        if self.explain not in ('analyze', 'plan') or cursor.name or cursor.connection.autocommit:
+            return False
+        if sql_template.split(' ', 1)[0].upper() not in ('SELECT', 'WITH'):
+            return False
+        if _NO_EXPLAIN_RE.search(sql_template):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained_at.get(key, -self.explain_interval) < self.explain_interval:
+                return False
+            self._explained_at[key] = now
+        return True
+
+    def _explain(self, conn, query, params):
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if self.explain == 'analyze' else 'FORMAT JSON'
+        # Same connection and snapshot as the slow statement; the savepoint undoes anything ANALYZE ran.
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute('SAVEPOINT slowlog_explain')
+            except psycopg2.Error:
+                return None
+            try:
+                cursor.execute(f'EXPLAIN ({options}) {query}', params)
+                plan = cursor.fetchone()[0]
+            except psycopg2.Error:
+                plan = None
+                with self._lock:
+                    self._stats['explain_errors'] += 1
+            cursor.execute('ROLLBACK TO SAVEPOINT slowlog_explain')
+            cursor.execute('RELEASE SAVEPOINT slowlog_explain')
+        if plan is None:
+            return None
+        with self._lock:
+            self._stats['explained'] += 1
+        return scrub_plan(plan)
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._pending = queue.Queue(maxsize=self._pending.maxsize)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='slow-query-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self._local.busy = True
+        last_prune = 0.0
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db.connection() as conn:
+                    cursor = conn.cursor()
+                    write_entries(cursor, batch)
+                    if time.monotonic() - last_prune > 3600:
+                        prune(cursor)
+                        last_prune = time.monotonic()
+                    conn.commit()
+            except (psycopg2.Error, RuntimeError):
+                logger.exception('Failed to store %s slow query samples', len(batch))
+                with self._lock:
+                    self._stats['dropped'] += len(batch)
+                continue
+            with self._lock:
+                self._stats['written'] += len(batch)
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['buffered'] = len(self._recent)
+        stats.update(threshold_ms=self.threshold * 1000, explain=self.explain, pending=self._pending.qsize())
+        return stats
+
+
+def write_entries(cursor, entries):
+    execute_values(
+        cursor,
+        '''
+        INSERT INTO slow_queries
+            (fingerprint, query_name, endpoint, sql_template, param_shape, duration_ms, row_count, plan, created_at)
+        VALUES %s
+        ''',
+        [
+            (
+                entry['fingerprint'], entry['query_name'], entry['endpoint'], entry['sql_template'],
+                Json(entry['param_shape']), entry['duration_ms'], entry['row_count'],
+                Json(entry['plan']) if entry['plan'] is not None else None, entry['created_at'],
+            )
+            for entry in entries
+        ],
+    )
+
+
+def prune(cursor):
+    cursor.execute(
+        'DELETE FROM slow_queries WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => %s)',
+        (SLOW_QUERY_RETENTION_DAYS,),
+    )
+
+
+def fetch_summary(cursor, days=7, limit=100):
+    cursor.execute(
+        '''
+        SELECT
+            s.fingerprint,
+            MIN(s.query_name) AS query_name,
+            COUNT(*) AS samples,
+            AVG(s.duration_ms) AS avg_ms,
+            percentile_cont(0.95) WITHIN GROUP (ORDER BY s.duration_ms) AS p95_ms,
+            MAX(s.duration_ms) AS max_ms,
+            MAX(s.created_at) AS last_seen,
+            array_agg(DISTINCT s.endpoint) FILTER (WHERE s.endpoint IS NOT NULL) AS endpoints,
+            (ARRAY_AGG(s.sql_template ORDER BY s.created_at DESC))[1] AS sql_template,
+            (ARRAY_AGG(s.param_shape::text ORDER BY s.created_at DESC))[1] AS param_shape,
+            (ARRAY_AGG(s.plan ORDER BY s.created_at DESC) FILTER (WHERE s.plan IS NOT NULL))[1] AS plan
+        FROM slow_queries s
+        WHERE s.created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+        GROUP BY s.fingerprint
+        ORDER BY SUM(s.duration_ms) DESC
+        LIMIT %s
+        ''',
+        (days, limit),
+    )
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for row in rows:
+        row['param_shape'] = json.loads(row['param_shape']) if row['param_shape'] else []
+        row['endpoints'] = row['endpoints'] or []
+    return rows
+
+
+log = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_MS,
+    buffer_size=SLOW_QUERY_BUFFER,
+    explain=SLOW_QUERY_EXPLAIN,
+    explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL,
+)
@@ -0,0 +1,136 @@
+import os
+
+import pandas as pd
+
+import drugs
+import duplicates
+from importer import FIELD_LIMITS, REPORT_FIELDS
+
+BATCH_MAX_REPORTS = int(os.environ.get('BATCH_MAX_REPORTS', '1000'))
+
+# RETURNING order is not guaranteed to follow the input, so ids are drawn up front, one per input
+# position, and the result pairs each position with its id.
+INSERT_SQL = '''
+    WITH batch AS (
+        SELECT nextval(pg_get_serial_sequence('adr', 'id')) AS id, t.*
+        FROM unnest(%s::text[], %s::int[], %s::text[], %s::int[], %s::text[], %s::text[], %s::int[])
+            WITH ORDINALITY AS t(name, age, drug, drug_id, reaction, severity, duplicate_of, position)
+    ), inserted AS (
+        INSERT INTO adr (id, user_id, name, age, drug, drug_id, reaction, severity, duplicate_of)
+        SELECT id, %s, name, age, drug, drug_id, reaction, severity, duplicate_of FROM batch
+        RETURNING id
+    )
+    SELECT batch.position, batch.id FROM batch JOIN inserted ON inserted.id = batch.id
+'''
+
+
+class BatchFormatError(ValueError):
+    pass
+
+
+def batch_reports(payload):
+    reports = payload.get('reports') if isinstance(payload, dict) else payload
+    if not isinstance(reports, list):
+        raise BatchFormatError('Send a JSON array of reports, or an object with a "reports" array.')
+    if not reports:
+        raise BatchFormatError('The batch contains no reports.')
+    if len(reports) > BATCH_MAX_REPORTS:
+        raise BatchFormatError(f'A batch may contain at most {BATCH_MAX_REPORTS} reports.')
+    return reports
+
+
+def validate_report(item):
+    # Same rules as the /add form, plus the column limits the importer enforces.
+    if not isinstance(item, dict):
+        return None, ['Each report must be a JSON object.']
+    values = {}
+    for field in REPORT_FIELDS:
+        value = item.get(field)
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            value = ''
+        values[field] = str(value).strip()
+    if not all(values.values()):
+        return None, ['All ADR fields are required.']
+
+    errors = []
+    try:
+        values['age'] = int(values['age'])
+        if values['age'] < 0:
+            raise ValueError
+    except ValueError:
+        errors.append('Age must be a valid non-negative number.')
+    for field, limit in FIELD_LIMITS.items():
+        if len(values[field]) > limit:
+            errors.append(f'{field.capitalize()} must be at most {limit} characters.')
+    return (None, errors) if errors else (values, [])
+
+
+def insert_reports(cursor, user_id, part):
+    rows = [
+        (values['name'], values['age'], values['drug'], drug_id, values['reaction'], values['severity'], duplicate_of)
+        for _, values, drug_id, duplicate_of in part
+    ]
+    # One array per column; unnest turns them back into rows numbered in input order.
+    cursor.execute(INSERT_SQL, [list(column) for column in zip(*rows)] + [user_id])
+    ids = dict(cursor.fetchall())
+    return [ids[position] for position in range(1, len(rows) + 1)]
+
+
+def submit_batch(conn, reports, user_id, before_commit=None):
+    cursor = conn.cursor()
+    results = [None] * len(reports)
+    valid = []
+    for index, item in enumerate(reports):
+        values, errors = validate_report(item)
+        if errors:
+            results[index] = {'index': index, 'errors': errors}
+        else:
+            valid.append((index, values))
+
+    created = []
+    flagged = 0
+    if valid:
+        drug_ids = drugs.dictionary.resolve_ids([values['drug'] for _, values in valid])
+        pending = [(index, values, drug_id) for (index, values), drug_id in zip(valid, drug_ids)]
+        if duplicates.DUPLICATE_MODE == 'off':
+            parts = [pending]
+        else:
+            # Repeats within the batch go second so the probe sees the first copy, already in this transaction.
+            seen = set()
+            firsts, repeats = [], []
+            for entry in pending:
+                values = entry[1]
+                key = duplicates.fingerprint(user_id, values['drug'], values['reaction'], values['age'])
+                (repeats if key in seen else firsts).append(entry)
+                seen.add(key)
+            parts = [part for part in (firsts, repeats) if part]
+
+        for part in parts:
+            matches = {}
+            if duplicates.DUPLICATE_MODE != 'off':
+                frame = pd.DataFrame([values for _, values, _ in part], columns=REPORT_FIELDS)
+                matches = duplicates.find_chunk_duplicates(cursor, frame, user_id)
+                flagged += len(matches)
+            rows = []
+            for position, (index, values, drug_id) in enumerate(part):
+                duplicate_of = matches.get(position)
+                if duplicate_of and duplicates.DUPLICATE_MODE == 'reject':
+                    results[index] = {'index': index, 'errors': [f'Possible duplicate of report #{duplicate_of}.']}
+                else:
+                    rows.append((index, values, drug_id, duplicate_of))
+            if rows:
+                for (index, values, _, duplicate_of), adr_id in zip(rows, insert_reports(cursor, user_id, rows)):
+                    results[index] = {'index': index, 'id': adr_id, 'duplicate_of': duplicate_of}
+                    created.append((adr_id, values))
+
+    summary = {
+        'submitted': len(reports),
+        'created': len(created),
+        'rejected': sum(1 for result in results if 'errors' in result),
+        'duplicates': flagged,
+        'results': results,
+    }
+    if before_commit:
+        before_commit(conn, summary)
+    conn.commit()
+    return summary, created
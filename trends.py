@@ -0,0 +1,236 @@
+import os
+from datetime import timedelta
+
+import drugs
+
+TREND_LOCK_ID = 4242003
+TREND_LAZY_CLOSE_DAYS = int(os.environ.get('TREND_LAZY_CLOSE_DAYS', '7'))
+TREND_MAX_BUCKETS = int(os.environ.get('TREND_MAX_BUCKETS', '1000'))
+TREND_TOP_DRUGS = int(os.environ.get('TREND_TOP_DRUGS', '8'))
+
+INTERVALS = ('day', 'week', 'month')
+GROUPS = ('total', 'severity', 'drug')
+
+
+def day_ranges(days):
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return ranges
+
+
+def ranges_condition(ranges):
+    # Plain created_at ranges (no casts) so the planner can use the BRIN or btree index.
+    if not ranges:
+        return 'FALSE', []
+    params = []
+    for start, end in ranges:
+        params.extend([start, end])
+    return '(' + ' OR '.join(['(a.created_at >= %s AND a.created_at < %s)'] * len(ranges)) + ')', params
+
+
+def close_out(cursor, max_days=None):
+    cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', (TREND_LOCK_ID,))
+    if not cursor.fetchone()[0]:
+        return None
+
+    # Stay an hour behind midnight so a transaction that started yesterday has committed before its day closes.
+    cursor.execute(
+        "SELECT closed_through, (clock_timestamp() - interval '1 hour')::date - 1 FROM trend_state WHERE id = 1"
+    )
+    closed_through, target = cursor.fetchone()
+    if max_days is not None:
+        target = min(target, closed_through + timedelta(days=max_days))
+
+    # Claim dirty days before recounting: a write that lands afterwards re-marks its day.
+    cursor.execute(
+        '''
+        DELETE FROM trend_dirty_days
+        WHERE day IN (SELECT day FROM trend_dirty_days WHERE day <= %s ORDER BY day LIMIT %s)
+        RETURNING day
+        ''',
+        (closed_through, max_days),
+    )
+    days = {row[0] for row in cursor.fetchall()}
+    day = closed_through + timedelta(days=1)
+    while day <= target:
+        days.add(day)
+        day += timedelta(days=1)
+    if not days:
+        return {'closed_through': closed_through, 'days': 0, 'buckets': 0}
+
+    condition, params = ranges_condition(day_ranges(days))
+    cursor.execute('DELETE FROM adr_trend_daily WHERE day = ANY(%s)', (sorted(days),))
+    cursor.execute(
+        f'''
+        INSERT INTO adr_trend_daily (day, drug_id, severity, report_count)
+        SELECT a.created_at::date, COALESCE(a.drug_id, 0), a.severity, COUNT(*)
+        FROM adr a
+        WHERE {condition}
+        GROUP BY 1, 2, 3
+        ''',
+        params,
+    )
+    buckets = cursor.rowcount
+    if target > closed_through:
+        cursor.execute(
+            'UPDATE trend_state SET closed_through = %s, closed_at = CURRENT_TIMESTAMP WHERE id = 1', (target,),
+        )
+        closed_through = target
+    return {'closed_through': closed_through, 'days': len(days), 'buckets': buckets}
+
+
+def close_is_due(cursor):
+    cursor.execute(
+        '''
+        SELECT closed_through < (clock_timestamp() - interval '1 hour')::date - 1
+            OR EXISTS (SELECT 1 FROM trend_dirty_days)
+        FROM trend_state WHERE id = 1
+        '''
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def rebuild(cursor):
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (TREND_LOCK_ID,))
+    cursor.execute('TRUNCATE adr_trend_daily, trend_dirty_days')
+    cursor.execute(
+        '''
+        UPDATE trend_state
+        SET closed_through = (SELECT COALESCE(MIN(created_at)::date, CURRENT_DATE) - 1 FROM adr)
+        WHERE id = 1
+        '''
+    )
+    return close_out(cursor)
+
+
+def truncate_day(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, interval):
+    if interval == 'week':
+        return day + timedelta(days=7)
+    if interval == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def bucket_starts(start, end, interval):
+    buckets = []
+    day = truncate_day(start, interval)
+    while day <= end:
+        buckets.append(day)
+        day = next_bucket(day, interval)
+    return buckets
+
+
+def fetch_bucket_counts(cursor, start, end, interval, group, drug_ids=None, severity=None):
+    cursor.execute('SELECT closed_through FROM trend_state WHERE id = 1')
+    closed_through = cursor.fetchone()[0]
+    cursor.execute(
+        'SELECT day FROM trend_dirty_days WHERE day BETWEEN %s AND %s ORDER BY day', (start, min(end, closed_through)),
+    )
+    dirty = [row[0] for row in cursor.fetchall()]
+
+    # Closed, clean days come from the bucket table; the open tail and dirty days are counted live from adr.
+    live_days = list(dirty)
+    day = max(start, closed_through + timedelta(days=1))
+    while day <= end:
+        live_days.append(day)
+        day += timedelta(days=1)
+    live_condition, live_params = ranges_condition(day_ranges(live_days))
+
+    filters = ''
+    filter_params = []
+    if drug_ids is not None:
+        filters += ' AND drug_id = ANY(%s)'
+        filter_params.append(drug_ids)
+    if severity:
+        filters += ' AND severity = %s'
+        filter_params.append(severity)
+
+    key_sql = {'total': "''", 'severity': 'severity', 'drug': 'drug_id::text'}[group]
+    cursor.execute(
+        f'''
+        WITH daily AS (
+            SELECT t.day, t.drug_id, t.severity, t.report_count
+            FROM adr_trend_daily t
+            WHERE t.day BETWEEN %s AND %s AND NOT (t.day = ANY(%s::date[]))
+            UNION ALL
+            SELECT a.created_at::date, COALESCE(a.drug_id, 0), a.severity, COUNT(*)
+            FROM adr a
+            WHERE {live_condition}
+            GROUP BY 1, 2, 3
+        )
+        SELECT date_trunc(%s, day)::date AS bucket, {key_sql} AS series, SUM(report_count)
+        FROM daily
+        WHERE TRUE{filters}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ''',
+        [start, min(end, closed_through), dirty] + live_params + [interval] + filter_params,
+    )
+    return cursor.fetchall()
+
+
+def moving_average(values, window):
+    averages = []
+    running = 0
+    for index, value in enumerate(values):
+        running += value
+        if index >= window:
+            running -= values[index - window]
+        averages.append(round(running / window, 2) if index >= window - 1 else None)
+    return averages
+
+
+def build_series(rows, buckets, group, moving_window=0, top=TREND_TOP_DRUGS):
+    position = {bucket: index for index, bucket in enumerate(buckets)}
+    counts = {}
+    for bucket, key, count in rows:
+        if bucket in position:
+            counts.setdefault(key, [0] * len(buckets))[position[bucket]] += int(count)
+
+    if group == 'drug':
+        ranked = sorted(counts, key=lambda key: -sum(counts[key]))
+        named = {}
+        for key in ranked[:top]:
+            named[drugs.dictionary.name(int(key)) or 'Unknown'] = counts[key]
+        if len(ranked) > top:
+            named['Other'] = [sum(column) for column in zip(*(counts[key] for key in ranked[top:]))]
+        counts = named
+    elif group == 'total':
+        counts = {'All reports': counts.get('', [0] * len(buckets))}
+
+    series = []
+    for label, values in counts.items():
+        entry = {'label': label, 'values': values, 'total': sum(values)}
+        if moving_window > 1:
+            entry['moving_average'] = moving_average(values, moving_window)
+        series.append(entry)
+    if group != 'drug':
+        series.sort(key=lambda entry: entry['label'])
+    return series
+
+
+def fetch_trend(cursor, start, end, interval='day', group='total', drug_ids=None, severity=None, moving_window=0):
+    buckets = bucket_starts(start, end, interval)
+    rows = fetch_bucket_counts(cursor, start, end, interval, group, drug_ids, severity)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'interval': interval,
+        'group': group,
+        'moving_average': moving_window,
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'series': build_series(rows, buckets, group, moving_window),
+    }
@@ -0,0 +1,29 @@
+import hashlib
+from datetime import timezone
+
+REPORTS_SCOPE = 'reports'
+USERS_SCOPE = 'users'
+DRUGS_SCOPE = 'drugs'
+
+
+def user_scope(user_id):
+    return f'{REPORTS_SCOPE}:user:{user_id}'
+
+
+def fetch_versions(cursor, scopes):
+    cursor.execute('SELECT scope, version, modified_at FROM data_versions WHERE scope = ANY(%s)', (list(scopes),))
+    found = {scope: (version, modified_at) for scope, version, modified_at in cursor.fetchall()}
+    # A user who has never written a report has no row yet; version 0 is stable until they do.
+    versions = [(scope, *found.get(scope, (0, None))) for scope in scopes]
+    stamps = [modified_at for _, _, modified_at in versions if modified_at is not None]
+    last_modified = max(stamps).astimezone(timezone.utc).replace(microsecond=0) if stamps else None
+    return versions, last_modified
+
+
+def watermark(versions):
+    return '.'.join(str(version) for _, version, _ in versions)
+
+
+def make_etag(versions, *extra):
+    raw = '|'.join([watermark(versions)] + [str(part) for part in extra])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]